@@ -1,10 +1,21 @@
 from pydantic_settings import BaseSettings
 
+from backend.lazy import Lazy
+
 
 class Settings(BaseSettings):
     # 302ai
     api_302_key: str
     api_302_base_url: str = "https://api.302ai.cn"
+    api_rate_limit: float = 10  # 每秒请求数（提交与查询共用），0 表示不限
+    api_rate_burst: int = 20
+    api_submit_concurrency: int = 4  # 同时进行的提交请求数
+    api_submit_retries: int = 2  # 上游限流 / 5xx / 网络错误时的重试次数
+    api_retry_backoff: float = 1.0  # 秒，指数退避基数
+    api_queue_size: int = 200  # 提交队列上限，超过直接返回 503
+    api_queue_timeout: float = 60  # 秒，排队超过该时间返回 503
+    api_breaker_failures: int = 5  # 连续失败多少次后熔断
+    api_breaker_recovery: float = 30  # 秒，熔断后多久放行试探请求
 
     # Cloudflare R2
     aws_access_key_id: str
@@ -14,13 +25,110 @@ class Settings(BaseSettings):
     aws_s3_prefix: str = "layer-images"
     aws_endpoint: str
     aws_public_url: str
+    storage_workers: int = 8  # 上传线程池大小
+    storage_multipart_threshold: int = 8 * 1024 * 1024  # 超过该大小使用分块上传
+    storage_multipart_chunksize: int = 8 * 1024 * 1024  # 分块大小（S3 要求 >= 5MB）
+    storage_multipart_concurrency: int = 4  # 单个文件的分块并发数
+    storage_direct_upload: bool = False  # 浏览器用预签名 PUT URL 直传 R2（bucket 需配置 CORS 允许 PUT）
+    storage_psd_redirect: bool = False  # PSD 存到 R2，下载接口重定向到预签名 GET URL
+    storage_presign_ttl: int = 900  # 秒，预签名 URL 有效期
+
+    # R2 清理（任务过期后删除其上传的原图和 PSD，定期清理没有任务引用的孤立对象）
+    storage_gc_enabled: bool = True
+    storage_gc_interval: int = 60  # 秒，删除已释放对象的检查间隔
+    storage_gc_batch_size: int = 1000  # 每次 delete_objects 的对象数（S3 上限 1000）
+    storage_gc_rate: float = 2  # 清理的 delete / list 请求每秒上限，避免与正常上传争抢 R2 请求配额
+    storage_gc_orphan_interval: int = 6 * 3600  # 秒，扫描孤立对象的间隔，0 表示不扫描
+    # 删除扫描到的孤立对象；默认只记录日志（dry run），确认数量合理后再开启
+    storage_gc_orphan_delete: bool = False
+    # 秒，超过该时间且没有任务引用的对象视为孤立；memory 存储多 worker 时只知道本 worker 的任务，应大于 task_ttl + dedup_ttl
+    storage_gc_orphan_age: int = 3 * 24 * 3600
+
+    # HTTP 连接池（302ai 接口与图层下载共用）
+    http_timeout: float = 30.0  # 秒
+    http_max_connections: int = 100
+    http_max_keepalive: int = 20
+    http2: bool = False  # 需要安装 h2：pip install 'httpx[http2]'
+
+    # 图层下载
+    download_concurrency: int = 4  # 单个请求内并发下载数
+    download_global_concurrency: int = 32  # 全局并发下载数
+    download_retries: int = 2
+    download_retry_backoff: float = 0.5  # 秒，指数退避基数
 
     # 应用
     max_upload_size: int = 10 * 1024 * 1024  # 10MB
-    poll_interval: int = 3  # 秒
+    upload_chunk_size: int = 1024 * 1024  # 读取上传文件的分块大小
+    poll_interval: int = 3  # 秒，最小轮询间隔
     poll_timeout: int = 120  # 秒
+    poll_max_interval: float = 15  # 秒，退避后的最大轮询间隔
+    poll_backoff: float = 1.5  # 超过预期耗时后的退避倍数
+    poll_expected_duration: float = 30  # 秒，没有历史数据时的预期耗时
+    poll_history: int = 50  # 用最近多少个完成任务估算预期耗时
+    poll_concurrency: int = 16  # 同时进行的查询请求数
+
+    # 输入预处理（上传 R2、提交 302ai 之前；直传模式下文件不经过后端，不做预处理）
+    preprocess_enabled: bool = True
+    preprocess_max_edge: int = 2048  # 长边上限（像素），超过则等比缩小，0 表示不缩小
+    preprocess_strip_metadata: bool = True  # 按 EXIF 方向旋正后去掉 EXIF / ICC（先转换到 sRGB）/ XMP 等元数据
+    preprocess_normalize_mode: bool = True  # 调色板、灰度、CMYK、16 位等统一为 RGB / RGBA
+    preprocess_format: str = "auto"  # auto（保持原格式）/ png / jpeg（有透明度时仍为 png）
+    preprocess_jpeg_quality: int = 90
+    preprocess_png_compress_level: int = 6  # 0-9
+
+    # PSD
+    psd_compression: str = "rle"  # rle / raw
+    psd_rle_level: int = 2  # 1 速度优先，2 体积优先
+    psd_prebuild: bool = False  # 任务完成后立即在后台下载图层并生成 PSD
+    psd_low_memory_pixels: int = 64 * 1024 * 1024  # 画布像素数 × 图层数达到该值时用低内存模式（临时文件暂存）
+    psd_upscale: bool = False  # 输入被预处理缩小时，PSD 的图层放大回原图尺寸
+
+    # 预览图（图层和拼合图的缩略图 / 中等尺寸预览，前端展示用，避免加载原尺寸 PNG）
+    preview_enabled: bool = True
+    preview_prebuild: bool = True  # 任务完成后立即在后台生成，否则首次请求时生成
+    preview_format: str = "webp"  # webp（保留透明度）/ jpeg（透明部分铺白底）
+    preview_quality: int = 80
+    preview_thumb_size: int = 256  # 缩略图长边像素
+    preview_size: int = 1024  # 预览图长边像素
+
+    # 任务存储
+    task_store: str = "memory"  # memory（单 worker）/ sqlite（多 worker 共享）
+    task_store_path: str = "tasks.db"  # sqlite 数据库文件
+    # 秒，sqlite 等待其他 worker 写锁的时间；请求路径上的读写在事件循环中执行，等待期间整个 worker 停顿，要短
+    task_store_busy_timeout: float = 0.05
+    task_store_busy_retries: int = 3  # 等锁超时后的重试次数（重试间隔递增）
+    task_ttl: int = 24 * 3600  # 秒，超过后删除任务记录
+    task_max_entries: int = 100000
+    task_sweep_interval: int = 30  # 秒，清理过期任务 / worker 心跳间隔
+
+    # 批量上传
+    batch_max_items: int = 500  # 单个批次最多图片数
+    batch_concurrency: int = 8  # 单个批次同时上传 / 提交的图片数
+    batch_download_concurrency: int = 2  # 打包下载时同时合成的 PSD 数
+
+    # 任务状态推送（SSE）
+    sse_heartbeat: int = 15  # 秒，无事件时发送心跳，并重新读取任务状态（兜底其他 worker 的更新）
+    sse_queue_size: int = 8  # 每个订阅者缓存的事件数
+
+    # 上传去重（相同图片 + 相同参数复用 R2 URL 和分层结果）
+    dedup_enabled: bool = True
+    dedup_ttl: int = 24 * 3600  # 秒
+    dedup_max_entries: int = 10000
+
+    # 磁盘缓存（图层 PNG、生成好的 PSD、预览图）
+    cache_dir: str = ""  # 空则用系统临时目录下的 layer-tool-cache
+    # 2GB，超出按 LRU 淘汰；每个 worker 进程只统计自己写入和启动时扫描到的文件，
+    # 多个 worker 共用 cache_dir 时目录最多约为 worker 数 × cache_max_bytes，按此预留磁盘
+    cache_max_bytes: int = 2 * 1024 * 1024 * 1024
+    cache_ttl: int = 24 * 3600  # 秒
+
+    # CPU 任务执行器（PNG 解码、PSD 合成）
+    cpu_executor: str = "process"  # process / thread
+    cpu_workers: int = 2  # 同时运行的任务数
+    cpu_max_queue: int = 8  # 排队上限，超出返回 503
 
     model_config = {"env_file": ".env", "env_file_encoding": "utf-8"}
 
 
-settings = Settings()
+# 第一次访问属性时才读取配置：缺少凭据时 import 不会失败，错误在启动（lifespan）时暴露
+settings = Lazy("settings", Settings)
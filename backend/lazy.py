@@ -0,0 +1,63 @@
+import threading
+import time
+from typing import Callable, Dict, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+# 各服务的创建耗时（秒），key 为服务名，/api/metrics 输出
+init_seconds: Dict[str, float] = {}
+
+_OWN_ATTRS = {"_name", "_factory", "_instance", "_lock"}
+
+
+class Lazy(Generic[T]):
+    """
+    延迟创建的模块级单例：第一次访问属性（或调用 resolve()）时才调用 factory 创建实例
+
+    import 时不读取配置、不创建客户端、不导入重依赖，由 lifespan 在启动时按需创建，
+    其余在第一次使用时创建。属性访问透明转发给实例，调用方按原来的方式使用。
+
+    override() 注入替代实例（测试、压测替身），reset() 丢弃实例，下次访问时重新创建。
+    自身的方法名（resolve / override / reset / initialized）不要与被代理的服务重名。
+    """
+
+    def __init__(self, name: str, factory: Callable[[], T]):
+        self._name = name
+        self._factory = factory
+        self._instance: Optional[T] = None
+        self._lock = threading.Lock()
+
+    @property
+    def initialized(self) -> bool:
+        return self._instance is not None
+
+    def resolve(self) -> T:
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                if self._instance is None:
+                    started = time.perf_counter()
+                    self._instance = self._factory()
+                    init_seconds[self._name] = time.perf_counter() - started
+                instance = self._instance
+        return instance
+
+    def override(self, instance: T):
+        """注入替代实例，之后的访问都转发给它"""
+        with self._lock:
+            self._instance = instance
+
+    def reset(self):
+        """丢弃当前实例（不做清理），下次访问时重新创建"""
+        with self._lock:
+            self._instance = None
+
+    def __getattr__(self, name: str):
+        if name in _OWN_ATTRS:
+            # __init__ 完成前（如复制、反序列化时）不要递归创建实例
+            raise AttributeError(name)
+        return getattr(self.resolve(), name)
+
+    def __repr__(self) -> str:
+        state = "initialized" if self.initialized else "pending"
+        return f"<Lazy {self._name} ({state})>"
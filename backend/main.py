@@ -1,13 +1,61 @@
 import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Dict
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
-from backend.routers import task
+from backend.config import settings
+from backend.lazy import init_seconds
+from backend.routers import batch, task
+from backend.services.disk_cache import disk_cache
+from backend.services.executor import cpu_executor
+from backend.services.http_client import http_client
+from backend.services.janitor import storage_janitor
+from backend.services.layer_api import layer_api_service
+from backend.services.metrics import registry
+from backend.services.poller import task_poller
+from backend.services.storage import storage_service
+from backend.services.task_events import task_events
+from backend.services.task_store import task_store
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="图片分层工具", version="1.0.0")
+
+# 启动各阶段耗时（秒），/api/metrics 输出
+_startup_seconds: Dict[str, float] = {}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 服务都是延迟创建的（backend.lazy），这里只创建启动时就要运行的；存储、302ai 客户端在第一次用到时创建
+    started = time.perf_counter()
+    # 先读取配置：缺少凭据等配置错误在启动时失败，而不是等到第一个请求
+    settings.resolve()
+    cpu_executor.start()
+    http_client.start()
+    task_poller.start()
+    task_store.start(on_orphans=task.resume_tasks)
+    storage_janitor.start()
+    _startup_seconds["lifespan"] = time.perf_counter() - started
+    services = ", ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in init_seconds.items())
+    logger.info(f"启动完成: {_startup_seconds['lifespan'] * 1000:.0f}ms（{services}）")
+    yield
+    await storage_janitor.stop()
+    await task_store.stop()
+    await task_poller.stop()
+    if layer_api_service.initialized:
+        await layer_api_service.stop()
+    await http_client.close()
+    if storage_service.initialized:
+        storage_service.close()
+    cpu_executor.shutdown()
+
+
+app = FastAPI(title="图片分层工具", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -17,11 +65,57 @@ app.add_middleware(
 )
 
 app.include_router(task.router, prefix="/api")
+app.include_router(batch.router, prefix="/api")
 
 
 @app.get("/api/health")
 async def health():
-    return {"status": "ok"}
+    return {"status": "ok", "cache": disk_cache.stats(), "upstream": _upstream_stats()}
+
+
+@app.get("/api/metrics")
+async def metrics():
+    """Prometheus 文本格式的指标"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+def _upstream_stats() -> dict:
+    """302ai 客户端的状态；还没有创建时不为了探活 / 指标去创建它（连同 http_client）"""
+    if not layer_api_service.initialized:
+        return {"breaker": "idle", "queued": 0}
+    return layer_api_service.stats()
+
+
+def _runtime_metrics():
+    """渲染时读取的运行状态：进行中的任务、队列深度、缓存命中等"""
+    upstream = _upstream_stats()
+    cache = disk_cache.stats()
+    yield "layer_tool_tasks", "gauge", "任务存储中各状态的任务数", [
+        ({"status": status}, n) for status, n in task_store.count_by_status().items()
+    ]
+    yield "layer_tool_polling_tasks", "gauge", "轮询中的任务数", [({}, task_poller.pending)]
+    yield "layer_tool_submit_queue", "gauge", "302ai 提交队列中的任务数", [({}, upstream["queued"])]
+    yield "layer_tool_upstream_breaker", "gauge", "302ai 熔断器状态（当前状态为 1）", [
+        ({"state": state}, 1 if upstream["breaker"] == state else 0) for state in ("closed", "open", "half_open")
+    ]
+    yield "layer_tool_cpu_pending", "gauge", "CPU 执行器中运行 / 排队的任务数", [({}, cpu_executor.pending)]
+    yield "layer_tool_sse_subscribers", "gauge", "状态推送连接数", [({}, task_events.subscribers)]
+    yield "layer_tool_cache_requests_total", "counter", "磁盘缓存查询次数", [
+        ({"namespace": ns, "result": result}, n)
+        for result in ("hits", "misses")
+        for ns, n in cache[result].items()
+    ]
+    yield "layer_tool_cache_bytes", "gauge", "磁盘缓存占用字节数", [({}, cache["bytes"])]
+    yield "layer_tool_cache_evictions_total", "counter", "磁盘缓存淘汰次数", [({}, cache["evictions"])]
+    yield "layer_tool_startup_seconds", "gauge", "启动各阶段耗时", [
+        ({"phase": phase}, seconds) for phase, seconds in _startup_seconds.items()
+    ]
+    yield "layer_tool_service_init_seconds", "gauge", "各服务的创建耗时（第一次使用时创建）", [
+        ({"service": name}, seconds) for name, seconds in init_seconds.items()
+    ]
+
+
+registry.register_collector(_runtime_metrics)
 
 
 if __name__ == "__main__":
@@ -9,11 +9,21 @@ class TaskStatus(str, Enum):
     FAILED = "FAILED"
 
 
+class PSDStatus(str, Enum):
+    """任务完成后 PSD 预生成的子状态"""
+    PENDING = "PENDING"
+    BUILDING = "BUILDING"
+    READY = "READY"
+    FAILED = "FAILED"
+
+
 class LayerInfo(BaseModel):
     name: str
     url: str
     width: int
     height: int
+    thumb_url: str = ""  # 缩略图（未开启预览图时为空）
+    preview_url: str = ""  # 中等尺寸预览图
 
 
 class UploadResponse(BaseModel):
@@ -21,8 +31,47 @@ class UploadResponse(BaseModel):
     status: TaskStatus
 
 
+class PresignResponse(BaseModel):
+    task_id: str
+    upload_url: str  # 预签名 PUT URL
+    headers: dict[str, str] = {}  # 上传时必须带上的请求头
+    expires_in: int
+
+
 class TaskResponse(BaseModel):
     status: TaskStatus
     message: str = ""
     layers: list[LayerInfo] = []
     error: str = ""
+    psd_ready: bool = False
+    thumb_url: str = ""  # 拼合图的缩略图
+    preview_url: str = ""  # 拼合图的预览图
+    timings: dict[str, float] = {}  # 各阶段耗时（秒）
+
+
+class BatchItem(BaseModel):
+    filename: str
+    task_id: str = ""  # 上传 / 提交失败时为空
+    error: str = ""
+
+
+class BatchResponse(BaseModel):
+    batch_id: str
+    items: list[BatchItem] = []
+
+
+class BatchItemStatus(BaseModel):
+    filename: str
+    task_id: str = ""
+    status: TaskStatus
+    error: str = ""
+
+
+class BatchStatusResponse(BaseModel):
+    batch_id: str
+    total: int
+    processing: int = 0
+    completed: int = 0
+    failed: int = 0
+    progress: float = 0.0  # 已结束（完成或失败）的比例
+    items: list[BatchItemStatus] = []
@@ -0,0 +1,288 @@
+import asyncio
+import hashlib
+import itertools
+import logging
+import os
+import tempfile
+import uuid
+import zipfile
+from collections import deque
+from typing import AsyncIterator, BinaryIO, Deque, List, Optional, Tuple
+
+from fastapi import APIRouter, File, Form, HTTPException, UploadFile
+from fastapi.responses import StreamingResponse
+
+from backend.config import settings
+from backend.models import BatchItem, BatchItemStatus, BatchResponse, BatchStatusResponse, TaskStatus
+from backend.routers.task import ALLOWED_TYPES, ensure_psd, scan_upload, submit_image
+from backend.services.layer_api import PRIORITY_LOW
+from backend.services.layer_fetcher import LayerDownloadError
+from backend.services.task_store import BatchRecord, TaskRecord, task_store
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+ALLOWED_EXTENSIONS = {".png", ".jpg", ".jpeg"}
+
+# (文件名, 文件对象, sha256)
+_Entry = Tuple[str, BinaryIO, str]
+
+
+@router.post("/batch", response_model=BatchResponse)
+async def create_batch(
+    files: List[UploadFile] = File(default=[]),
+    archive: Optional[UploadFile] = File(None),
+    num_layers: int = Form(4),
+    prompt: str = Form(""),
+):
+    """
+    批量上传：多个图片文件和 / 或一个 ZIP 包
+
+    各图片的 R2 上传与 302ai 提交并发进行（受 batch_concurrency 限制），
+    单张失败不影响其他图片，失败原因记录在对应条目的 error 中。
+    """
+    entries: List[_Entry] = []
+    extracted: List[_Entry] = []
+    items: List[BatchItem] = []
+    try:
+        for file in files:
+            filename = file.filename or "upload.png"
+            if file.content_type not in ALLOWED_TYPES:
+                items.append(BatchItem(filename=filename, error=f"不支持的文件类型: {file.content_type}"))
+                continue
+            try:
+                digest = await scan_upload(file)
+            except HTTPException as e:
+                items.append(BatchItem(filename=filename, error=e.detail))
+                continue
+            entries.append((filename, file.file, digest))
+
+        if archive is not None:
+            extracted, rejected = await asyncio.to_thread(_extract_archive, archive.file)
+            entries.extend(extracted)
+            items.extend(rejected)
+
+        if not entries and not items:
+            raise HTTPException(status_code=400, detail="没有上传文件")
+        if len(entries) + len(items) > settings.batch_max_items:
+            raise HTTPException(status_code=400, detail=f"单个批次最多 {settings.batch_max_items} 张图片")
+
+        slots = asyncio.Semaphore(settings.batch_concurrency)
+        submitted = await asyncio.gather(*(_submit(entry, num_layers, prompt, slots) for entry in entries))
+    finally:
+        for _, fileobj, _ in extracted:
+            fileobj.close()
+
+    batch_id = uuid.uuid4().hex[:12]
+    record = BatchRecord(batch_id=batch_id, items=list(submitted) + items)
+    task_store.put_batch(record)
+    ok = sum(1 for item in record.items if item.task_id)
+    logger.info(f"批次已创建: batch_id={batch_id}, 成功 {ok}/{len(record.items)}")
+    return BatchResponse(batch_id=batch_id, items=record.items)
+
+
+@router.get("/batch/{batch_id}", response_model=BatchStatusResponse)
+async def get_batch_status(batch_id: str):
+    """查询批次进度"""
+    batch = task_store.get_batch(batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="批次不存在")
+
+    resp = BatchStatusResponse(batch_id=batch_id, total=len(batch.items))
+    for item in batch.items:
+        status, error = _item_status(item)
+        if status == TaskStatus.COMPLETED:
+            resp.completed += 1
+        elif status == TaskStatus.FAILED:
+            resp.failed += 1
+        else:
+            resp.processing += 1
+        resp.items.append(BatchItemStatus(filename=item.filename, task_id=item.task_id, status=status, error=error))
+    if resp.total:
+        resp.progress = round((resp.completed + resp.failed) / resp.total, 4)
+    return resp
+
+
+@router.get("/batch/{batch_id}/download")
+async def download_batch(batch_id: str):
+    """打包下载批次内所有已完成任务的 PSD（ZIP）"""
+    batch = task_store.get_batch(batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="批次不存在")
+
+    done = []
+    for item in batch.items:
+        task = task_store.get(item.task_id) if item.task_id else None
+        if task and task.status == TaskStatus.COMPLETED and task.layers:
+            done.append((item.filename, task))
+    if not done:
+        raise HTTPException(status_code=400, detail="批次中没有已完成的任务")
+
+    # 边合成边打包，立即开始发送，不等所有 PSD 合成完
+    return StreamingResponse(
+        _iter_zip(done),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename=batch_{batch_id}.zip"},
+    )
+
+
+async def _submit(entry: _Entry, num_layers: int, prompt: str, slots: asyncio.Semaphore) -> BatchItem:
+    filename, fileobj, digest = entry
+    async with slots:
+        try:
+            task_id = await submit_image(fileobj, filename, digest, num_layers, prompt, PRIORITY_LOW)
+        except HTTPException as e:
+            return BatchItem(filename=filename, error=e.detail)
+        except Exception as e:
+            # 单个文件的意外错误只记在该条目上，不影响同批的其他文件
+            logger.error(f"批量提交失败: {filename}, {e}")
+            return BatchItem(filename=filename, error="提交失败")
+    return BatchItem(filename=filename, task_id=task_id)
+
+
+async def _ensure_psd(task: TaskRecord) -> Optional[str]:
+    """合成（或命中缓存）任务的 PSD，返回缓存文件路径；失败时跳过该任务，返回 None"""
+    try:
+        return await ensure_psd(task)
+    except LayerDownloadError as e:
+        logger.error(f"批量下载跳过任务: task_id={task.task_id}, {e}")
+    except Exception as e:
+        # 单个任务的错误（上游图层损坏、执行器繁忙等）不影响同批的其他任务
+        logger.error(f"批量下载跳过任务: task_id={task.task_id}, PSD 合成失败: {e}")
+    return None
+
+
+async def _open_psd(task: TaskRecord, path: Optional[str]) -> Optional[BinaryIO]:
+    """打开 PSD 缓存文件；打开前已被缓存淘汰时重新合成一次，失败返回 None"""
+    for rebuilt in (False, True):
+        if path is None:
+            return None
+        try:
+            return await asyncio.to_thread(open, path, "rb")
+        except FileNotFoundError:
+            if rebuilt:
+                break
+            path = await _ensure_psd(task)
+    logger.error(f"批量下载跳过任务: task_id={task.task_id}, PSD 缓存已失效")
+    return None
+
+
+def _item_status(item: BatchItem) -> Tuple[TaskStatus, str]:
+    if not item.task_id:
+        return TaskStatus.FAILED, item.error
+    task = task_store.get(item.task_id)
+    if task is None:
+        return TaskStatus.FAILED, "任务已过期"
+    return task.status, task.error
+
+
+def _extract_archive(archive: BinaryIO) -> Tuple[List[_Entry], List[BatchItem]]:
+    """
+    解出 ZIP 中的图片到临时文件，同时计算 sha256（在线程中执行）
+
+    只读取文件头声明和实际解压都不超过 max_upload_size 的条目，防止压缩炸弹。
+    """
+    try:
+        zf = zipfile.ZipFile(archive)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="ZIP 文件无效")
+
+    entries: List[_Entry] = []
+    rejected: List[BatchItem] = []
+    with zf:
+        for info in zf.infolist():
+            name = info.filename
+            base = os.path.basename(name)
+            if info.is_dir() or not base or base.startswith(".") or name.startswith("__MACOSX/"):
+                continue
+            if os.path.splitext(base)[1].lower() not in ALLOWED_EXTENSIONS:
+                rejected.append(BatchItem(filename=base, error="不支持的文件类型"))
+                continue
+            if len(entries) + len(rejected) >= settings.batch_max_items:
+                raise HTTPException(status_code=400, detail=f"单个批次最多 {settings.batch_max_items} 张图片")
+            if info.file_size > settings.max_upload_size:
+                rejected.append(BatchItem(filename=base, error="文件大小超过 10MB 限制"))
+                continue
+            extracted = _extract_entry(zf, info)
+            if extracted is None:
+                rejected.append(BatchItem(filename=base, error="文件大小超过 10MB 限制"))
+                continue
+            entries.append((base, *extracted))
+    return entries, rejected
+
+
+def _extract_entry(zf: zipfile.ZipFile, info: zipfile.ZipInfo) -> Optional[Tuple[BinaryIO, str]]:
+    out = tempfile.SpooledTemporaryFile(max_size=settings.upload_chunk_size)
+    digest = hashlib.sha256()
+    total = 0
+    with zf.open(info) as src:
+        while chunk := src.read(settings.upload_chunk_size):
+            total += len(chunk)
+            if total > settings.max_upload_size:
+                out.close()
+                return None
+            digest.update(chunk)
+            out.write(chunk)
+    out.seek(0)
+    return out, digest.hexdigest()
+
+
+class _ZipSink:
+    """zipfile 的只写输出：收集写入的字节，由生成器取走后发送"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def _iter_zip(done: List[Tuple[str, TaskRecord]]) -> AsyncIterator[bytes]:
+    """
+    边合成边把 PSD 流式打包成 ZIP
+
+    按顺序最多提前合成 batch_download_concurrency 个 PSD（或命中缓存），第一个好了就开始发送，
+    几百个任务的批次不会长时间没有响应。合成失败的任务跳过；客户端断开时取消还没用到的合成。
+    PSD 已经 RLE 压缩，ZIP 只存储不再压缩。
+    """
+    from backend.services.psd_builder import CHUNK_SIZE
+
+    pending = iter(done)
+    builds: Deque[Tuple[str, TaskRecord, asyncio.Task]] = deque()
+    sink = _ZipSink()
+    used = set()
+    try:
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as zf:
+            while True:
+                for filename, task in itertools.islice(pending, settings.batch_download_concurrency - len(builds)):
+                    builds.append((filename, task, asyncio.create_task(_ensure_psd(task))))
+                if not builds:
+                    break
+                filename, task, build = builds.popleft()
+                src = await _open_psd(task, await build)
+                if src is None:
+                    continue
+                arcname = f"{os.path.splitext(filename)[0]}.psd"
+                if arcname in used:
+                    arcname = f"{os.path.splitext(filename)[0]}_{task.task_id}.psd"
+                used.add(arcname)
+                with src, zf.open(arcname, "w", force_zip64=True) as dst:
+                    while chunk := await asyncio.to_thread(src.read, CHUNK_SIZE):
+                        dst.write(chunk)
+                        yield sink.drain()
+        # 中央目录
+        yield sink.drain()
+    finally:
+        for _, _, build in builds:
+            build.cancel()
+    # 中央目录
+    yield sink.drain()
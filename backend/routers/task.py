@@ -1,26 +1,51 @@
 import asyncio
+import hashlib
+import io
+import json
 import logging
+import os
+import shutil
+import tempfile
 import time
 import uuid
-from typing import Dict
+from contextlib import contextmanager
+from typing import BinaryIO, Dict, List, Optional, Tuple
 
-import httpx
-from fastapi import APIRouter, File, Form, HTTPException, UploadFile
-from fastapi.responses import Response
+from fastapi import APIRouter, File, Form, HTTPException, Response, UploadFile
+from fastapi.responses import RedirectResponse, StreamingResponse
 
 from backend.config import settings
-from backend.models import LayerInfo, TaskResponse, TaskStatus, UploadResponse
-from backend.services.layer_api import layer_api_service
-from backend.services.psd_builder import build_psd_to_bytes
+from backend.models import LayerInfo, PresignResponse, PSDStatus, TaskResponse, TaskStatus, UploadResponse
+from backend.services.dedup import dedup_index
+from backend.services.disk_cache import NS_PREVIEW, NS_PSD, disk_cache
+from backend.services.executor import EXECUTOR_PROCESS, ExecutorBusyError, cpu_executor
+from backend.services.layer_api import PRIORITY_NORMAL, layer_api_service
+from backend.services.layer_fetcher import LayerDownloadError, layer_fetcher
+from backend.services.metrics import (
+    BYTES_TOTAL, STAGE_LAYER_DOWNLOAD, STAGE_PREPROCESS, STAGE_PREVIEW, STAGE_PROCESSING, STAGE_PSD_BUILD,
+    STAGE_PSD_UPLOAD, STAGE_SUBMIT, STAGE_UPLOAD, TASKS_TOTAL, timed,
+)
+from backend.services.poller import task_poller
+from backend.services.resilience import UpstreamBusyError
 from backend.services.storage import storage_service
+from backend.services.task_events import task_events
+from backend.services.task_store import TaskRecord, task_store
+
+# psd_builder / psd_reader / preview / preprocess 依赖 numpy、PIL，在用到的函数内导入，启动时不加载
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
 ALLOWED_TYPES = {"image/png", "image/jpeg", "image/jpg"}
 
-# 内存任务存储
-tasks: Dict[str, dict] = {}
+# 进行中的 PSD 预生成任务（同时持有引用，避免被 GC）
+_prebuilds: Dict[str, asyncio.Task] = {}
+
+# 进行中的 PSD 上传 R2 任务，key 为 PSD 缓存 key
+_psd_uploads: Dict[str, asyncio.Task] = {}
+
+# 进行中的预览图生成任务，key 为 task_id
+_preview_builds: Dict[str, asyncio.Task] = {}
 
 
 @router.post("/upload", response_model=UploadResponse)
@@ -34,160 +59,906 @@ async def upload_image(
     if file.content_type not in ALLOWED_TYPES:
         raise HTTPException(status_code=400, detail=f"不支持的文件类型: {file.content_type}")
 
-    # 读取文件
-    file_bytes = await file.read()
+    # 分块读取：边读边校验大小并计算 sha256，不在内存中保留整个文件
+    digest = await scan_upload(file)
+    task_id = await submit_image(file.file, file.filename or "upload.png", digest, num_layers, prompt)
+    return UploadResponse(task_id=task_id, status=task_store.get(task_id).status)
+
 
-    # 校验大小
-    if len(file_bytes) > settings.max_upload_size:
+@router.post("/upload/presign", response_model=PresignResponse)
+async def presign_upload(
+    filename: str = Form(...),
+    content_type: str = Form(...),
+    size: int = Form(...),
+):
+    """
+    直传第一步：校验文件信息，创建等待上传的任务，返回预签名 PUT URL
+
+    浏览器把文件直接 PUT 到 R2，再调用 /task/{task_id}/submit 提交分层，文件不经过后端。
+    未开启直传时返回 404，前端回退到 /upload。
+    """
+    if not settings.storage_direct_upload:
+        raise HTTPException(status_code=404, detail="未开启直传")
+    if content_type not in ALLOWED_TYPES:
+        raise HTTPException(status_code=400, detail=f"不支持的文件类型: {content_type}")
+    if size > settings.max_upload_size:
         raise HTTPException(status_code=400, detail="文件大小超过 10MB 限制")
 
+    key, upload_url = storage_service.presign_upload(filename, content_type)
+    task_id = uuid.uuid4().hex[:12]
+    task_store.put(TaskRecord(task_id=task_id, status=TaskStatus.PENDING, image_url=storage_service.public_url_of(key)))
+    task_store.track_objects(task_id, [key])
+    return PresignResponse(
+        task_id=task_id,
+        upload_url=upload_url,
+        headers={"Content-Type": content_type},
+        expires_in=settings.storage_presign_ttl,
+    )
+
+
+@router.post("/task/{task_id}/submit", response_model=UploadResponse)
+async def submit_uploaded(
+    task_id: str,
+    num_layers: int = Form(4),
+    prompt: str = Form(""),
+):
+    """直传第二步：确认图片已上传到 R2 并提交分层任务（已提交过则直接返回当前状态）"""
+    task = task_store.get(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    if task.status != TaskStatus.PENDING:
+        return UploadResponse(task_id=task_id, status=task.status)
+
+    # 先占住任务，重复的确认请求直接返回；提交失败时恢复为 PENDING 允许重试
+    task_store.update(task_id, status=TaskStatus.PROCESSING)
+    try:
+        await _check_uploaded(task)
+        timings = {}
+        request_id = await _submit_layers(task.image_url, num_layers, prompt, PRIORITY_NORMAL, timings)
+    except HTTPException as e:
+        if e.status_code == 413:
+            _publish(task_store.update(task_id, status=TaskStatus.FAILED, error=e.detail))
+        else:
+            task_store.update(task_id, status=TaskStatus.PENDING)
+        raise
+    except BaseException:
+        # 意外错误或客户端断开（取消）：同样恢复为 PENDING，否则任务一直停在没有轮询的 PROCESSING
+        task_store.update(task_id, status=TaskStatus.PENDING)
+        raise
+
+    task_store.update(task_id, request_id=request_id, timings=timings)
+    task_poller.add(task_id, request_id)
+    return UploadResponse(task_id=task_id, status=TaskStatus.PROCESSING)
+
+
+@router.get("/task/{task_id}", response_model=TaskResponse)
+async def get_task_status(task_id: str):
+    """查询任务状态"""
+    task = task_store.get(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return _task_response(task)
+
+
+@router.get("/task/{task_id}/events")
+async def task_events_stream(task_id: str):
+    """
+    推送任务状态（Server-Sent Events）
+
+    连接后立即发送当前状态，之后每次状态变化推送一条 status 事件；
+    任务结束（PSD 预生成也结束）后关闭连接。
+    """
+    if not task_store.get(task_id):
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return StreamingResponse(
+        _status_events(task_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/download/{task_id}")
+async def download_psd(task_id: str):
+    """下载 PSD 文件"""
+    task = task_store.get(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    if task.status != TaskStatus.COMPLETED:
+        raise HTTPException(status_code=400, detail="任务尚未完成")
+
+    layers = task.layers
+    if not layers:
+        raise HTTPException(status_code=500, detail="没有分层数据")
+
+    if settings.storage_psd_redirect:
+        return await _psd_redirect(task)
+
+    headers = {"Content-Disposition": f"attachment; filename=layered_{task_id}.psd"}
+    cache_key = _psd_cache_key(task)
+
+    # 正在预生成时等它完成，命中缓存直接返回文件
+    psd_path = await _cached_psd(task)
+    if psd_path:
+        return await _psd_file_response(task, psd_path, headers)
+
+    # 并发下载所有分层 PNG
+    try:
+        layer_images = await _fetch_layers(task_id, layers)
+    except LayerDownloadError as e:
+        raise HTTPException(status_code=500, detail=f"下载图层 {e.index} 失败")
+
+    from backend.services.psd_builder import CHUNK_SIZE, iter_psd_from_png
+
+    # 合成 PSD：在 CPU 执行器中完成，不阻塞事件循环
+    build_args = (layer_images, *_canvas_size(layers))
+    output_size = _psd_output_size(task)
+    try:
+        if cpu_executor.kind == EXECUTOR_PROCESS:
+            # 子进程写入缓存目录下的临时文件，完成后放入缓存
+            psd_path = await _build_psd_file(*build_args, cache_key, task_id, output_size)
+        else:
+            # 线程池模式：流式输出，边生成边发送，同时写入缓存
+            psd_chunks = cpu_executor.stream(
+                iter_psd_from_png, *build_args, settings.psd_compression, settings.psd_rle_level,
+                CHUNK_SIZE, _low_memory(*build_args, output_size), output_size,
+            )
+    except ExecutorBusyError:
+        raise HTTPException(status_code=503, detail="服务繁忙，请稍后重试")
+    except Exception as e:
+        logger.error(f"PSD 合成失败: {e}")
+        raise HTTPException(status_code=500, detail="PSD 合成失败")
+    if psd_path:
+        return await _psd_file_response(task, psd_path, headers)
+
+    return StreamingResponse(
+        _tee_to_cache(psd_chunks, cache_key, task_id),
+        media_type="application/octet-stream",
+        headers=headers,
+    )
+
+
+@router.get("/task/{task_id}/layer/{index}")
+async def download_layer(task_id: str, index: int, crop: bool = False):
+    """
+    从 PSD 中取出单个图层（PNG）
+
+    直接定位 PSD 中该图层的通道数据解码，不读取其余图层；PSD 不在缓存中时先生成。
+    crop=true 时只返回图层的非透明矩形区域，否则为整个画布大小。
+    """
+    task = task_store.get(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    if task.status != TaskStatus.COMPLETED:
+        raise HTTPException(status_code=400, detail="任务尚未完成")
+    if not 0 <= index < len(task.layers or []):
+        raise HTTPException(status_code=404, detail="图层不存在")
+
+    from backend.services.psd_reader import PSDFormatError, extract_layer_png
+
+    try:
+        psd_path = await ensure_psd(task)
+        try:
+            png = await cpu_executor.run(extract_layer_png, psd_path, index, crop)
+        except FileNotFoundError:
+            # 读取前 PSD 已被缓存淘汰（或被其他 worker 删除）：重新生成一次
+            logger.warning(f"PSD 缓存已被淘汰，重新合成: task_id={task_id}")
+            png = await cpu_executor.run(extract_layer_png, await ensure_psd(task), index, crop)
+    except LayerDownloadError as e:
+        raise HTTPException(status_code=500, detail=f"下载图层 {e.index} 失败")
+    except ExecutorBusyError:
+        raise HTTPException(status_code=503, detail="服务繁忙，请稍后重试")
+    except IndexError:
+        raise HTTPException(status_code=404, detail="图层不存在")
+    except PSDFormatError as e:
+        logger.error(f"读取 PSD 失败 {task_id}: {e}")
+        raise HTTPException(status_code=500, detail="读取 PSD 失败")
+
+    return Response(
+        png,
+        media_type="image/png",
+        headers={"Content-Disposition": f"inline; filename=layer_{task_id}_{index}.png"},
+    )
+
+
+@router.get("/task/{task_id}/preview/{target}/{size}")
+async def get_preview(task_id: str, target: str, size: str):
+    """
+    图层（target 为图层下标）或拼合图（target 为 composite）的缩略图（thumb）/ 预览图（preview）
+
+    任务完成后在后台生成（preview_prebuild），还没生成好时等待生成完成。
+    """
+    if not settings.preview_enabled:
+        raise HTTPException(status_code=404, detail="未开启预览图")
+    from backend.services.preview import MEDIA_TYPES, SIZES, TARGET_COMPOSITE, preview_name
+
+    task = task_store.get(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    if task.status != TaskStatus.COMPLETED:
+        raise HTTPException(status_code=400, detail="任务尚未完成")
+    if size not in SIZES:
+        raise HTTPException(status_code=404, detail="预览图不存在")
+    if target != TARGET_COMPOSITE:
+        if not target.isdigit() or int(target) >= len(task.layers):
+            raise HTTPException(status_code=404, detail="图层不存在")
+        target = str(int(target))
+
+    name = preview_name(target, size)
+    data = await asyncio.to_thread(disk_cache.get_bytes, NS_PREVIEW, _preview_cache_key(task.layers, name))
+    if data is None:
+        try:
+            data = (await asyncio.shield(_start_previews(task)))[name]
+        except LayerDownloadError as e:
+            raise HTTPException(status_code=500, detail=f"下载图层 {e.index} 失败")
+        except ExecutorBusyError:
+            raise HTTPException(status_code=503, detail="服务繁忙，请稍后重试")
+        except Exception:
+            raise HTTPException(status_code=500, detail="预览图生成失败")
+
+    return Response(
+        data,
+        media_type=MEDIA_TYPES.get(settings.preview_format, "application/octet-stream"),
+        # 同一任务的预览图内容不会变化
+        headers={"Cache-Control": f"public, max-age={settings.cache_ttl}"},
+    )
+
+
+async def submit_image(
+    fileobj: BinaryIO, filename: str, digest: str, num_layers: int, prompt: str, priority: int = PRIORITY_NORMAL
+) -> str:
+    """
+    上传图片并提交分层任务（批量上传共用），返回 task_id
+
+    相同图片 + 相同参数直接复用已有任务 / 结果，并发的相同请求只提交一次。
+
+    Raises:
+        HTTPException: 上传 R2 或提交 302ai 失败，上游繁忙时为 503
+    """
+    if not settings.dedup_enabled:
+        return await _create_task(fileobj, filename, num_layers, prompt, priority=priority)
+
+    dedup_key = dedup_index.make_key(digest, num_layers, prompt)
+    task_id = _find_duplicate(dedup_key)
+    if task_id is None:
+        task_id = await dedup_index.coalesce(
+            dedup_key,
+            lambda: _create_task(fileobj, filename, num_layers, prompt, dedup_key, priority),
+        )
+    return task_id
+
+
+async def ensure_psd(task: TaskRecord) -> str:
+    """
+    返回已完成任务的 PSD 文件路径（磁盘缓存），没有缓存时下载图层并合成
+
+    Raises:
+        LayerDownloadError: 图层下载失败
+        ExecutorBusyError: CPU 执行器繁忙
+    """
+    psd_path = await _cached_psd(task)
+    if psd_path:
+        return psd_path
+    layer_images = await _fetch_layers(task.task_id, task.layers)
+    return await _build_psd_file(
+        layer_images, *_canvas_size(task.layers), _psd_cache_key(task), task.task_id, _psd_output_size(task)
+    )
+
+
+async def scan_upload(file: UploadFile) -> str:
+    """分块读取上传文件，超过大小限制立即拒绝，返回 sha256；读完后回到文件开头"""
+    too_large = HTTPException(status_code=400, detail="文件大小超过 10MB 限制")
+    if file.size is not None and file.size > settings.max_upload_size:
+        raise too_large
+
+    digest = hashlib.sha256()
+    total = 0
+    while chunk := await file.read(settings.upload_chunk_size):
+        total += len(chunk)
+        if total > settings.max_upload_size:
+            raise too_large
+        digest.update(chunk)
+    await file.seek(0)
+    return digest.hexdigest()
+
+
+async def _create_task(
+    fileobj: BinaryIO, filename: str, num_layers: int, prompt: str, dedup_key=None, priority: int = PRIORITY_NORMAL
+) -> str:
+    """预处理、流式上传到 R2（已上传过的相同图片跳过）、提交分层任务并创建任务记录，返回 task_id"""
+    timings = {}
+
     # 上传到 R2
+    image_url = dedup_index.get_image_url(dedup_key[0]) if dedup_key else None
+    source_size = dedup_index.get_source_size(dedup_key[0]) if dedup_key else None
+    if image_url:
+        logger.info(f"复用已上传的图片: {image_url}")
+    else:
+        if settings.preprocess_enabled:
+            fileobj, filename, source_size = await _preprocess(fileobj, filename, timings)
+        try:
+            with timed(STAGE_UPLOAD) as t:
+                image_url = await storage_service.upload_stream(fileobj, filename)
+            timings[STAGE_UPLOAD] = round(t.elapsed, 3)
+            logger.info(f"图片已上传到 R2: {image_url}")
+        except Exception as e:
+            logger.error(f"R2 上传失败: {e}")
+            raise HTTPException(status_code=500, detail="图片上传失败")
+        if dedup_key:
+            dedup_index.record_image(dedup_key[0], image_url, source_size)
+
+    # 提交 302ai 分层任务；复用的图片同样记录引用，提交期间不会被清理，引用它的任务都过期后才删除
+    task_id = uuid.uuid4().hex[:12]
+    with _pin_objects(task_id, [storage_service.key_of(image_url)]):
+        request_id = await _submit_layers(image_url, num_layers, prompt, priority, timings)
+
+    # 创建任务记录
+    task_store.put(TaskRecord(
+        task_id=task_id,
+        status=TaskStatus.PROCESSING,
+        request_id=request_id,
+        image_url=image_url,
+        dedup_key=dedup_key,
+        timings=timings,
+        source_size=source_size,
+    ))
+    if dedup_key:
+        dedup_index.record_task(dedup_key, task_id, source_size)
+
+    # 交给集中轮询器
+    task_poller.add(task_id, request_id)
+    return task_id
+
+
+@contextmanager
+def _pin_objects(task_id: str, keys: List[str]):
+    """在等待提交 / 上传之前先记录任务对这些对象的引用，期间不会被清理删除；出错时撤销引用"""
+    task_store.track_objects(task_id, keys)
+    try:
+        yield
+    except BaseException:
+        task_store.untrack_objects(task_id, keys)
+        raise
+
+
+async def _preprocess(fileobj: BinaryIO, filename: str, timings: dict) -> Tuple[BinaryIO, str, Optional[Tuple[int, int]]]:
+    """
+    上传前预处理（缩小、去元数据、统一颜色模式、重新编码），返回 (文件对象, 文件名, 缩小前的原图尺寸)
+
+    不需要处理时原样返回；图片无法解码时也原样上传，交给 302ai 判断。
+
+    Raises:
+        HTTPException: CPU 执行器繁忙时为 503
+    """
+    from backend.services.preprocess import preprocess_image
+
+    # 还在内存中的上传直接传字节；已落盘的复制到临时文件，只把路径交给 worker，不整个读入内存再序列化给子进程
+    source = _memory_bytes(fileobj)
+    tmp_path = None
+    if source is None:
+        tmp_path = disk_cache.temp_path()
+        size = await asyncio.to_thread(_copy_to_path, fileobj, tmp_path)
+    else:
+        size = len(source)
+    cancelled = False
     try:
-        image_url = storage_service.upload_image(file_bytes, file.filename or "upload.png")
-        logger.info(f"图片已上传到 R2: {image_url}")
+        with timed(STAGE_PREPROCESS) as t:
+            result = await cpu_executor.run(
+                preprocess_image, source if tmp_path is None else tmp_path,
+                settings.preprocess_max_edge, settings.preprocess_strip_metadata,
+                settings.preprocess_normalize_mode, settings.preprocess_format,
+                settings.preprocess_jpeg_quality, settings.preprocess_png_compress_level,
+                # 被取消时子进程可能还在读临时文件，等它结束后再删除
+                on_cancel=(lambda: _remove_quietly(tmp_path)) if tmp_path else None,
+            )
+    except asyncio.CancelledError:
+        cancelled = True
+        raise
+    except ExecutorBusyError:
+        raise HTTPException(status_code=503, detail="服务繁忙，请稍后重试")
     except Exception as e:
-        logger.error(f"R2 上传失败: {e}")
-        raise HTTPException(status_code=500, detail="图片上传失败")
+        logger.warning(f"预处理失败，原样上传: {filename}, {e}")
+        result = None
+    finally:
+        if tmp_path and not cancelled:
+            _remove_quietly(tmp_path)
+    timings[STAGE_PREPROCESS] = round(t.elapsed, 3)
+
+    if result is None:
+        await asyncio.to_thread(fileobj.seek, 0)
+        return fileobj, filename, None
+    logger.info(f"预处理完成: {filename}, {', '.join(result.steps)}, {size} -> {len(result.data)} 字节")
+    source_size = (result.source_width, result.source_height) if result.scale < 1 else None
+    return io.BytesIO(result.data), f"{os.path.splitext(filename)[0]}.{result.extension}", source_size
 
-    # 提交 302ai 分层任务
+
+async def _submit_layers(image_url: str, num_layers: int, prompt: str, priority: int, timings: dict) -> str:
+    """提交 302ai 分层任务，耗时记入 timings，返回 request_id"""
     try:
-        request_id = await layer_api_service.submit_task(image_url, num_layers, prompt)
+        with timed(STAGE_SUBMIT) as t:
+            request_id = await layer_api_service.submit_task(image_url, num_layers, prompt, priority)
+        timings[STAGE_SUBMIT] = round(t.elapsed, 3)
         logger.info(f"分层任务已提交: request_id={request_id}, num_layers={num_layers}, prompt={prompt}")
+        return request_id
+    except UpstreamBusyError as e:
+        logger.warning(f"分层服务繁忙: {e}")
+        raise HTTPException(status_code=503, detail="分层服务繁忙，请稍后重试")
     except Exception as e:
         logger.error(f"提交分层任务失败: {e}")
         raise HTTPException(status_code=500, detail="提交分层任务失败")
-        logger.info(f"分层任务已提交: request_id={request_id}")
+
+
+async def _check_uploaded(task: TaskRecord):
+    """
+    确认直传的图片已在 R2 上且不超过大小限制（预签名 PUT 无法限制大小，超限的对象直接删除）
+
+    Raises:
+        HTTPException: 未上传为 400，超过大小限制为 413
+    """
+    try:
+        meta = await storage_service.head(storage_service.key_of(task.image_url))
     except Exception as e:
-        logger.error(f"提交分层任务失败: {e}")
-        raise HTTPException(status_code=500, detail="提交分层任务失败")
+        logger.error(f"查询 R2 对象失败: {e}")
+        raise HTTPException(status_code=500, detail="查询上传结果失败")
+    if meta is None:
+        raise HTTPException(status_code=400, detail="图片尚未上传")
+    if meta["size"] > settings.max_upload_size:
+        await asyncio.to_thread(storage_service.delete_image, task.image_url)
+        raise HTTPException(status_code=413, detail="文件大小超过 10MB 限制")
 
-    # 创建任务记录
-    task_id = uuid.uuid4().hex[:12]
-    tasks[task_id] = {
-        "status": TaskStatus.PROCESSING,
-        "request_id": request_id,
-        "image_url": image_url,
-        "layers": [],
-        "error": "",
-        "created_at": time.time(),
-    }
-
-    # 启动后台轮询
-    asyncio.create_task(_poll_task(task_id))
 
-    return UploadResponse(task_id=task_id, status=TaskStatus.PROCESSING)
+def _find_duplicate(dedup_key):
+    """查找相同请求的可复用任务：进行中或已完成的任务直接复用，任务记录已清理但结果还在时新建已完成任务"""
+    entry = dedup_index.get(dedup_key)
+    if entry is None:
+        return None
 
+    task = task_store.get(entry.task_id)
+    if task and task.status != TaskStatus.FAILED:
+        logger.info(f"命中重复请求: task_id={entry.task_id}")
+        return entry.task_id
 
-@router.get("/task/{task_id}", response_model=TaskResponse)
-async def get_task_status(task_id: str):
-    """查询任务状态"""
-    task = tasks.get(task_id)
-    if not task:
-        raise HTTPException(status_code=404, detail="任务不存在")
+    if not entry.layers:
+        return None
+    task_id = uuid.uuid4().hex[:12]
+    image_url = dedup_index.get_image_url(dedup_key[0]) or ""
+    task_store.put(TaskRecord(
+        task_id=task_id,
+        status=TaskStatus.COMPLETED,
+        image_url=image_url,
+        layers=entry.layers,
+        dedup_key=dedup_key,
+        source_size=entry.source_size,
+    ))
+    if image_url:
+        task_store.track_objects(task_id, [storage_service.key_of(image_url)])
+    logger.info(f"复用已完成的分层结果: task_id={task_id}")
+    return task_id
+
+
+def _task_response(task: TaskRecord) -> TaskResponse:
+    if task.status == TaskStatus.COMPLETED:
+        from backend.services.preview import SIZE_PREVIEW, SIZE_THUMB, TARGET_COMPOSITE
 
-    if task["status"] == TaskStatus.COMPLETED:
+        layers = task.layers
+        if settings.preview_enabled:
+            layers = [
+                layer.model_copy(update={
+                    "thumb_url": _preview_url(task.task_id, i, SIZE_THUMB),
+                    "preview_url": _preview_url(task.task_id, i, SIZE_PREVIEW),
+                })
+                for i, layer in enumerate(layers)
+            ]
         return TaskResponse(
             status=TaskStatus.COMPLETED,
-            layers=task["layers"],
+            layers=layers,
+            psd_ready=task.psd_status == PSDStatus.READY,
+            thumb_url=_preview_url(task.task_id, TARGET_COMPOSITE, SIZE_THUMB) if layers else "",
+            preview_url=_preview_url(task.task_id, TARGET_COMPOSITE, SIZE_PREVIEW) if layers else "",
+            timings=task.timings,
         )
-    elif task["status"] == TaskStatus.FAILED:
+    elif task.status == TaskStatus.FAILED:
         return TaskResponse(
             status=TaskStatus.FAILED,
-            error=task["error"],
+            error=task.error,
+            timings=task.timings,
+        )
+    elif task.status == TaskStatus.PENDING:
+        return TaskResponse(
+            status=TaskStatus.PENDING,
+            message="等待上传...",
         )
     else:
         return TaskResponse(
             status=TaskStatus.PROCESSING,
             message="AI 分层中...",
+            timings=task.timings,
         )
 
 
-@router.get("/download/{task_id}")
-async def download_psd(task_id: str):
-    """下载 PSD 文件"""
-    task = tasks.get(task_id)
-    if not task:
-        raise HTTPException(status_code=404, detail="任务不存在")
-    if task["status"] != TaskStatus.COMPLETED:
-        raise HTTPException(status_code=400, detail="任务尚未完成")
+def _preview_url(task_id: str, target, size: str) -> str:
+    return f"/api/task/{task_id}/preview/{target}/{size}" if settings.preview_enabled else ""
 
-    layers = task["layers"]
-    if not layers:
-        raise HTTPException(status_code=500, detail="没有分层数据")
 
-    # 下载所有分层 PNG
-    layer_images = []
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        for i, layer in enumerate(layers):
-            png_bytes = await _download_with_retry(client, layer.url)
-            if png_bytes is None:
-                raise HTTPException(status_code=500, detail=f"下载图层 {i} 失败")
-            layer_images.append((layer.name, png_bytes))
+def _is_final(task: TaskRecord) -> bool:
+    """任务已结束且不会再有状态推送"""
+    if task.status == TaskStatus.FAILED:
+        return True
+    return task.status == TaskStatus.COMPLETED and task.psd_status in (None, PSDStatus.READY, PSDStatus.FAILED)
+
+
+def _publish(task: Optional[TaskRecord]):
+    if task is not None:
+        task_events.publish(task.task_id, _task_response(task).model_dump(mode="json"))
+
+
+async def _status_events(task_id: str):
+    # 先订阅再读当前状态，避免漏掉两者之间的变化
+    with task_events.subscribe(task_id) as queue:
+        task = task_store.get(task_id)
+        last = None
+        while task is not None:
+            event = _task_response(task).model_dump(mode="json")
+            if event != last:
+                yield f"event: status\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+                last = event
+            if _is_final(task):
+                return
+            getter = asyncio.ensure_future(queue.get())
+            try:
+                done, _ = await asyncio.wait({getter}, timeout=settings.sse_heartbeat)
+            finally:
+                getter.cancel()
+            if not done:
+                # 心跳：保持连接，同时兜底其他 worker 写入存储的状态
+                yield ": ping\n\n"
+            task = task_store.get(task_id)
+
+
+def _canvas_size(layers) -> tuple:
+    """画布尺寸取所有图层的最大宽高"""
+    return max(l.width for l in layers), max(l.height for l in layers)
+
+
+def _low_memory(layer_images, max_w: int, max_h: int, output_size: Optional[Tuple[int, int]] = None) -> bool:
+    """超大画布 / 图层很多时用低内存模式合成 PSD"""
+    w, h = output_size or (max_w, max_h)
+    return w * h * len(layer_images) >= settings.psd_low_memory_pixels
+
+
+def _psd_output_size(task: TaskRecord) -> Optional[Tuple[int, int]]:
+    """PSD 放大回原图尺寸（psd_upscale 且输入被预处理缩小过），否则为空（即图层画布尺寸）"""
+    return task.source_size if settings.psd_upscale and task.source_size else None
+
+
+async def _cached_psd(task: TaskRecord) -> Optional[str]:
+    """PSD 缓存文件路径（正在预生成时先等它完成），未命中返回 None"""
+    build = _prebuilds.get(task.task_id)
+    if build is not None:
+        await asyncio.shield(build)
+    return await asyncio.to_thread(disk_cache.get_path, NS_PSD, _psd_cache_key(task))
+
+
+def _psd_cache_key(task: TaskRecord) -> str:
+    """PSD 缓存 key：图层 URL + 画布尺寸 + 压缩参数"""
+    layers = task.layers
+    canvas = _psd_output_size(task) or _canvas_size(layers)
+    return disk_cache.make_key(
+        NS_PSD, *(l.url for l in layers), *canvas, settings.psd_compression, settings.psd_rle_level
+    )
+
+
+async def _build_psd_file(
+    layer_images, max_w: int, max_h: int, cache_key: str, task_id: str = "",
+    output_size: Optional[Tuple[int, int]] = None,
+) -> str:
+    """在 CPU 执行器中合成 PSD 并放入磁盘缓存，返回缓存文件路径"""
+    from backend.services.psd_builder import write_psd_from_png
+
+    tmp_path = disk_cache.temp_path()
+    try:
+        with timed(STAGE_PSD_BUILD) as t:
+            await cpu_executor.run(
+                write_psd_from_png,
+                layer_images, max_w, max_h, tmp_path, settings.psd_compression, settings.psd_rle_level,
+                _low_memory(layer_images, max_w, max_h, output_size), output_size,
+                # 被取消时子进程可能还在写临时文件，等它结束后再删除
+                on_cancel=lambda: _remove_quietly(tmp_path),
+            )
+    except asyncio.CancelledError:
+        raise
+    except BaseException:
+        _remove_quietly(tmp_path)
+        raise
+    _save_timing(task_id, STAGE_PSD_BUILD, t.elapsed)
+    return await asyncio.to_thread(disk_cache.put_file, NS_PSD, cache_key, tmp_path)
+
+
+async def _tee_to_cache(chunks, cache_key: str, task_id: str = ""):
+    """边发送边写入临时文件，完整发送后放入缓存；中途失败或断开则丢弃"""
+    tmp_path = disk_cache.temp_path()
+    done = False
+    try:
+        # 流式模式下合成与发送交替进行，这里记录的是边合成边发送的总耗时；写盘放到线程中
+        f = await asyncio.to_thread(open, tmp_path, "wb")
+        with timed(STAGE_PSD_BUILD) as t, f:
+            async for chunk in chunks:
+                await asyncio.to_thread(f.write, chunk)
+                BYTES_TOTAL.inc(len(chunk), direction="psd_download")
+                yield chunk
+        _save_timing(task_id, STAGE_PSD_BUILD, t.elapsed)
+        await asyncio.to_thread(disk_cache.put_file, NS_PSD, cache_key, tmp_path)
+        done = True
+    finally:
+        if not done:
+            _remove_quietly(tmp_path)
+
+
+def _memory_bytes(fileobj: BinaryIO) -> Optional[bytes]:
+    """文件内容还在内存中时返回全部字节（不移动读写位置），已落盘返回 None"""
+    if isinstance(fileobj, io.BytesIO):
+        return fileobj.getvalue()
+    if isinstance(fileobj, tempfile.SpooledTemporaryFile) and not fileobj._rolled:
+        return fileobj._file.getvalue()
+    return None
+
+
+def _copy_to_path(fileobj: BinaryIO, path: str) -> int:
+    """从头分块复制到 path，返回字节数"""
+    fileobj.seek(0)
+    with open(path, "wb") as out:
+        shutil.copyfileobj(fileobj, out, settings.upload_chunk_size)
+        return out.tell()
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+async def _open_psd(task: TaskRecord, psd_path: Optional[str] = None) -> BinaryIO:
+    """
+    打开任务的 PSD 缓存文件（psd_path 为空时先取缓存或合成）
+
+    先打开再发送：之后即使被 LRU 淘汰或被其他 worker 删除，已打开的文件仍能读完；
+    打开前就已被删除时重新合成一次。
+    """
+    for rebuilt in (False, True):
+        psd_path = psd_path or await ensure_psd(task)
+        try:
+            return await asyncio.to_thread(open, psd_path, "rb")
+        except FileNotFoundError:
+            if rebuilt:
+                raise
+            logger.warning(f"PSD 缓存已被淘汰，重新合成: task_id={task.task_id}")
+            psd_path = None
+
 
-    # 合成 PSD
+async def _psd_file_response(task: TaskRecord, psd_path: str, headers: dict) -> StreamingResponse:
     try:
-        max_w = max(l.width for l in layers)
-        max_h = max(l.height for l in layers)
-        psd_bytes = build_psd_to_bytes(layer_images, max_w, max_h)
+        f = await _open_psd(task, psd_path)
+    except LayerDownloadError as e:
+        raise HTTPException(status_code=500, detail=f"下载图层 {e.index} 失败")
+    except ExecutorBusyError:
+        raise HTTPException(status_code=503, detail="服务繁忙，请稍后重试")
+    size = os.fstat(f.fileno()).st_size
+    BYTES_TOTAL.inc(size, direction="psd_download")
+    return StreamingResponse(
+        _iter_file(f), media_type="application/octet-stream", headers={**headers, "Content-Length": str(size)}
+    )
+
+
+async def _iter_file(f: BinaryIO):
+    from backend.services.psd_builder import CHUNK_SIZE
+
+    with f:
+        while chunk := await asyncio.to_thread(f.read, CHUNK_SIZE):
+            yield chunk
+
+
+async def _psd_redirect(task: TaskRecord) -> RedirectResponse:
+    """PSD 放到 R2 后重定向到预签名 GET URL，PSD 字节不经过后端"""
+    build = _prebuilds.get(task.task_id)
+    if build is not None:
+        # 预生成完成时已上传到 R2
+        await asyncio.shield(build)
+        task = task_store.get(task.task_id) or task
+    try:
+        key = task.psd_key or await _push_psd(task)
+    except LayerDownloadError as e:
+        raise HTTPException(status_code=500, detail=f"下载图层 {e.index} 失败")
+    except ExecutorBusyError:
+        raise HTTPException(status_code=503, detail="服务繁忙，请稍后重试")
     except Exception as e:
-        logger.error(f"PSD 合成失败: {e}")
+        logger.error(f"PSD 上传 R2 失败: task_id={task.task_id}, {e}")
         raise HTTPException(status_code=500, detail="PSD 合成失败")
+    return RedirectResponse(
+        storage_service.presign_download(key, f"layered_{task.task_id}.psd"), status_code=307
+    )
 
-    return Response(
-        content=psd_bytes,
-        media_type="application/octet-stream",
-        headers={"Content-Disposition": f"attachment; filename=layered_{task_id}.psd"},
+
+async def _push_psd(task: TaskRecord) -> str:
+    """把任务的 PSD 放到 R2 并记录到任务，返回对象 key；相同 PSD 的并发调用只上传一次"""
+    cache_key = _psd_cache_key(task)
+    upload = _psd_uploads.get(cache_key)
+    if upload is None:
+        upload = asyncio.create_task(_upload_psd(task, cache_key))
+        _psd_uploads[cache_key] = upload
+        upload.add_done_callback(lambda _: _psd_uploads.pop(cache_key, None))
+    # PSD 按内容共用：每个引用它的任务都在等待上传（或复用已有对象）之前记录引用
+    with _pin_objects(task.task_id, [storage_service.psd_key(cache_key)]):
+        key = await asyncio.shield(upload)
+    _set_psd_key(task.task_id, key)
+    return key
+
+
+def _set_psd_key(task_id: str, key: str):
+    """记录任务的 PSD 对象；任务记录已被清理时撤销引用"""
+    if task_store.update(task_id, psd_key=key) is None:
+        task_store.untrack_objects(task_id, [key])
+
+
+async def _upload_psd(task: TaskRecord, cache_key: str, psd_path: Optional[str] = None) -> str:
+    """上传 PSD 到 R2，返回对象 key；psd_path 为空时从缓存取或重新合成"""
+    # 对象 key 由 PSD 内容决定：其他任务 / worker 已上传过相同图层的 PSD 时直接复用
+    key = storage_service.psd_key(cache_key)
+    if await storage_service.head(key) is None:
+        psd_path = psd_path or await ensure_psd(task)
+        with timed(STAGE_PSD_UPLOAD) as t:
+            await storage_service.upload_file(psd_path, key, "application/octet-stream")
+        _save_timing(task.task_id, STAGE_PSD_UPLOAD, t.elapsed)
+    return key
+
+
+def _preview_cache_key(layers, name: str) -> str:
+    """预览图缓存 key：图层 URL + 预览图名 + 编码参数"""
+    return disk_cache.make_key(
+        NS_PREVIEW, *(l.url for l in layers), name,
+        settings.preview_format, settings.preview_quality, settings.preview_thumb_size, settings.preview_size,
     )
 
 
-async def _poll_task(task_id: str):
-    """后台轮询 302ai 任务结果"""
-    task = tasks.get(task_id)
+def _start_previews(task: TaskRecord) -> asyncio.Task:
+    """生成任务的全部预览图（同一任务的并发调用共用一次生成），返回 {预览图名: 字节} 的 asyncio.Task"""
+    task_id = task.task_id
+    build = _preview_builds.get(task_id)
+    if build is None:
+        build = asyncio.create_task(_build_previews(task))
+        _preview_builds[task_id] = build
+        build.add_done_callback(lambda t: _on_previews_done(task_id, t))
+    return build
+
+
+def _on_previews_done(task_id: str, build: asyncio.Task):
+    _preview_builds.pop(task_id, None)
+    # 取出异常，后台生成没人等待时也记录日志
+    if not build.cancelled() and build.exception() is not None:
+        logger.error(f"预览图生成失败: task_id={task_id}, {build.exception()}")
+
+
+async def _build_previews(task: TaskRecord) -> Dict[str, bytes]:
+    from backend.services.preview import render_previews
+
+    layers = task.layers
+    layer_images = await _fetch_layers(task.task_id, layers)
+    with timed(STAGE_PREVIEW) as t:
+        previews = await cpu_executor.run(
+            render_previews, layer_images, *_canvas_size(layers),
+            settings.preview_thumb_size, settings.preview_size, settings.preview_format, settings.preview_quality,
+        )
+    _save_timing(task.task_id, STAGE_PREVIEW, t.elapsed)
+    await asyncio.to_thread(_cache_previews, layers, previews)
+    return previews
+
+
+def _cache_previews(layers, previews: Dict[str, bytes]):
+    for name, data in previews.items():
+        disk_cache.put_bytes(NS_PREVIEW, _preview_cache_key(layers, name), data)
+
+
+async def _fetch_layers(task_id: str, layers: List[LayerInfo]):
+    with timed(STAGE_LAYER_DOWNLOAD) as t:
+        layer_images = await layer_fetcher.fetch_layers(layers)
+    _save_timing(task_id, STAGE_LAYER_DOWNLOAD, t.elapsed)
+    return layer_images
+
+
+def _save_timing(task_id: str, stage: str, seconds: float):
+    """把阶段耗时写入任务记录"""
+    task = task_store.get(task_id) if task_id else None
+    if task is not None:
+        task_store.update(task_id, timings={**task.timings, stage: round(seconds, 3)})
+
+
+async def _on_task_result(task_id: str, result: dict):
+    """轮询到 302ai 结果：标记任务完成"""
+    layers = []
+    for i, img in enumerate(result["images"]):
+        layers.append(LayerInfo(
+            name=f"Layer_{i}",
+            url=img["url"],
+            width=img.get("width", 0),
+            height=img.get("height", 0),
+        ))
+    task = task_store.get(task_id)
     if not task:
         return
 
-    request_id = task["request_id"]
-    max_attempts = settings.poll_timeout // settings.poll_interval
-    attempt = 0
+    prebuild = settings.psd_prebuild and bool(layers)
+    task = task_store.update(
+        task_id,
+        status=TaskStatus.COMPLETED,
+        layers=layers,
+        psd_status=PSDStatus.PENDING if prebuild else None,
+        timings={**task.timings, STAGE_PROCESSING: round(time.time() - task.created_at, 3)},
+    )
+    if not task:
+        return
 
-    while attempt < max_attempts:
-        await asyncio.sleep(settings.poll_interval)
-        attempt += 1
+    TASKS_TOTAL.inc(status=TaskStatus.COMPLETED.value)
+    _publish(task)
+    if task.dedup_key:
+        dedup_index.record_result(task.dedup_key, layers)
+    logger.info(f"任务完成: task_id={task_id}, 图层数={len(layers)}")
 
-        try:
-            result = await layer_api_service.poll_result(request_id)
-            if result and "images" in result:
-                # 任务完成
-                layers = []
-                for i, img in enumerate(result["images"]):
-                    layers.append(LayerInfo(
-                        name=f"Layer_{i}",
-                        url=img["url"],
-                        width=img.get("width", 0),
-                        height=img.get("height", 0),
-                    ))
-                task["status"] = TaskStatus.COMPLETED
-                task["layers"] = layers
-                logger.info(f"任务完成: task_id={task_id}, 图层数={len(layers)}")
-                return
-        except Exception as e:
-            logger.error(f"轮询失败 (attempt {attempt}): {e}")
+    if settings.preview_enabled and settings.preview_prebuild and layers:
+        _start_previews(task)
+    if prebuild:
+        build = asyncio.create_task(_prebuild_psd(task_id))
+        _prebuilds[task_id] = build
+        build.add_done_callback(lambda _: _prebuilds.pop(task_id, None))
 
-    # 超时
-    task["status"] = TaskStatus.FAILED
-    task["error"] = "处理超时，请重试"
+
+async def _on_task_timeout(task_id: str):
+    """轮询超时：标记任务失败"""
+    task = task_store.update(task_id, status=TaskStatus.FAILED, error="处理超时，请重试")
+    if not task:
+        return
+
+    TASKS_TOTAL.inc(status=TaskStatus.FAILED.value)
+    _publish(task)
+    if task.dedup_key:
+        dedup_index.discard(task.dedup_key)
     logger.error(f"任务超时: task_id={task_id}")
 
 
-async def _download_with_retry(client: httpx.AsyncClient, url: str, retries: int = 2) -> bytes | None:
-    """下载文件，失败重试"""
-    for i in range(retries + 1):
-        try:
-            resp = await client.get(url)
-            resp.raise_for_status()
-            return resp.content
-        except Exception as e:
-            logger.error(f"下载失败 (attempt {i + 1}): {url}, {e}")
-            if i < retries:
-                await asyncio.sleep(1)
-    return None
+async def _prebuild_psd(task_id: str):
+    """后台预生成 PSD：下载图层、合成并压缩，完成后标记 READY"""
+    task = task_store.update(task_id, psd_status=PSDStatus.BUILDING)
+    if not task:
+        return
+
+    started = time.time()
+    previews = _preview_builds.get(task_id)
+    if previews is not None:
+        # 预览图优先（前端先展示），图层下载完后这里直接读磁盘缓存，不重复下载
+        await asyncio.wait({previews})
+    try:
+        layers = task.layers
+        layer_images = await _fetch_layers(task_id, layers)
+        cache_key = _psd_cache_key(task)
+        psd_path = await _build_psd_file(
+            layer_images, *_canvas_size(layers), cache_key, task_id, _psd_output_size(task)
+        )
+        if settings.storage_psd_redirect:
+            with _pin_objects(task_id, [storage_service.psd_key(cache_key)]):
+                key = await _upload_psd(task, cache_key, psd_path)
+            _set_psd_key(task_id, key)
+    except Exception as e:
+        # 失败后下载时会按需重新生成
+        _publish(task_store.update(task_id, psd_status=PSDStatus.FAILED))
+        logger.error(f"PSD 预生成失败: task_id={task_id}, {e}")
+        return
+
+    _publish(task_store.update(task_id, psd_status=PSDStatus.READY))
+    logger.info(f"PSD 预生成完成: task_id={task_id}, 耗时 {time.time() - started:.2f}s")
+
+
+def resume_tasks(records: List[TaskRecord]):
+    """接管已有的进行中任务（失联 worker 留下的），交给轮询器继续轮询"""
+    for record in records:
+        task_poller.add(record.task_id, record.request_id, record.created_at)
+
+
+task_poller.set_handlers(_on_task_result, _on_task_timeout)
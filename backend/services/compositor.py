@@ -0,0 +1,97 @@
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+# 每次混合处理的像素数上限（按行条带），控制临时数组大小
+STRIP_PIXELS = 256 * 1024
+
+
+def composite(
+    layers: Iterable,
+    width: int,
+    height: int,
+    strip_pixels: int = STRIP_PIXELS,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    按 Porter-Duff "over" 自底向上合成所有图层，得到拼合后的 RGBA 图像
+
+    图层依次解码、逐条带混合到画布后即释放，峰值内存约为画布 + 单个图层 + 一个条带的临时数组。
+
+    Args:
+        layers: 自底向上的图层，每个元素需有 load() -> (h, w, 4) uint8 数组，以及 top / left 偏移
+                （如 psd_builder.LayerSource）
+        width: 画布宽度
+        height: 画布高度
+        strip_pixels: 单个条带的像素数上限
+        out: 全零的 (height, width, 4) uint8 画布（如 numpy.memmap），不传则新分配
+
+    Returns:
+        (height, width, 4) uint8 数组（非预乘 alpha）
+    """
+    canvas = np.zeros((height, width, 4), dtype=np.uint8) if out is None else out
+    for layer in layers:
+        top, left = getattr(layer, "top", 0), getattr(layer, "left", 0)
+        arr = layer.load()
+        composite_over(canvas, arr, top, left, strip_pixels)
+        del arr
+    return canvas
+
+
+def composite_over(canvas: np.ndarray, src: np.ndarray, top: int = 0, left: int = 0, strip_pixels: int = STRIP_PIXELS):
+    """
+    把 src 以 (top, left) 为偏移 "over" 到 canvas 上（原地修改），超出画布的部分裁掉
+
+    Args:
+        canvas: (H, W, 4) uint8 画布
+        src: (h, w, 4) uint8 图层
+        top: 图层上边在画布中的位置，可以为负
+        left: 图层左边在画布中的位置，可以为负
+        strip_pixels: 单个条带的像素数上限
+    """
+    region = _overlap(canvas.shape, src.shape, top, left)
+    if region is None:
+        return
+    r0, r1, c0, c1 = region
+    sr0, sc0 = r0 - top, c0 - left
+    w = c1 - c0
+    rows = max(1, strip_pixels // w)
+    for y in range(r0, r1, rows):
+        y1 = min(y + rows, r1)
+        sy = sr0 + (y - r0)
+        _over_strip(canvas[y:y1, c0:c1], src[sy:sy + (y1 - y), sc0:sc0 + w])
+
+
+def _overlap(canvas_shape, src_shape, top: int, left: int) -> Optional[Tuple[int, int, int, int]]:
+    """图层与画布相交区域在画布中的 (起始行, 结束行, 起始列, 结束列)，不相交返回 None"""
+    H, W = canvas_shape[:2]
+    h, w = src_shape[:2]
+    r0, r1 = max(top, 0), min(top + h, H)
+    c0, c1 = max(left, 0), min(left + w, W)
+    if r0 >= r1 or c0 >= c1:
+        return None
+    return r0, r1, c0, c1
+
+
+def _over_strip(dst: np.ndarray, src: np.ndarray):
+    """单个条带的 over 混合（float32），结果写回 dst"""
+    src_a = src[:, :, 3]
+    if not src_a.any():
+        return  # 全透明条带，画布不变
+    if src_a.min() == 255 or not dst[:, :, 3].any():
+        dst[:] = src  # 图层完全不透明，或画布这里还是空的：结果就是图层本身
+        return
+
+    sa = src_a.astype(np.float32) * (1.0 / 255.0)
+    da = dst[:, :, 3].astype(np.float32) * (1.0 / 255.0)
+    # out_a = sa + da * (1 - sa)
+    da *= 1.0 - sa
+    out_a = sa + da
+
+    # out_rgb = (src_rgb * sa + dst_rgb * da * (1 - sa)) / out_a
+    rgb = src[:, :, :3].astype(np.float32) * sa[:, :, None]
+    rgb += dst[:, :, :3].astype(np.float32) * da[:, :, None]
+    np.divide(rgb, out_a[:, :, None], out=rgb, where=out_a[:, :, None] > 0)
+
+    dst[:, :, :3] = np.clip(rgb + 0.5, 0, 255).astype(np.uint8)
+    dst[:, :, 3] = np.clip(out_a * 255.0 + 0.5, 0, 255).astype(np.uint8)
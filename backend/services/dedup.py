@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from backend.config import settings
+from backend.models import LayerInfo
+
+logger = logging.getLogger(__name__)
+
+DedupKey = Tuple[str, int, str]  # (sha256, num_layers, prompt)
+
+
+@dataclass
+class DedupEntry:
+    task_id: str
+    layers: List[LayerInfo] = field(default_factory=list)  # 任务完成后填充
+    source_size: Optional[Tuple[int, int]] = None  # 预处理缩小前的原图尺寸
+    created_at: float = field(default_factory=time.time)
+
+
+class DedupIndex:
+    """
+    上传去重索引
+
+    - sha256 -> 已上传到 R2 的 URL：相同图片不再重复上传
+    - (sha256, num_layers, prompt) -> 任务 / 分层结果：相同请求不再重复提交 302ai
+    - 同一 key 的并发请求合并为一次提交
+    """
+
+    def __init__(self):
+        # sha256 -> (image_url, created_at, 预处理缩小前的原图尺寸)
+        self._images: "OrderedDict[str, Tuple[str, float, Optional[Tuple[int, int]]]]" = OrderedDict()
+        self._results: "OrderedDict[DedupKey, DedupEntry]" = OrderedDict()
+        self._inflight: Dict[DedupKey, asyncio.Future] = {}
+
+    @staticmethod
+    def make_key(digest: str, num_layers: int, prompt: str) -> DedupKey:
+        return digest, num_layers, prompt
+
+    def get_image_url(self, digest: str) -> Optional[str]:
+        item = _get_fresh(self._images, digest, lambda v: v[1])
+        return item[0] if item else None
+
+    def get_source_size(self, digest: str) -> Optional[Tuple[int, int]]:
+        item = _get_fresh(self._images, digest, lambda v: v[1])
+        return item[2] if item else None
+
+    def record_image(self, digest: str, image_url: str, source_size: Optional[Tuple[int, int]] = None):
+        _put_bounded(self._images, digest, (image_url, time.time(), source_size))
+
+    def forget_images(self, urls: Set[str]):
+        """R2 上的图片将被删除：移除对应记录，之后相同的图片重新上传"""
+        for digest in [d for d, v in self._images.items() if v[0] in urls]:
+            del self._images[digest]
+
+    def get(self, key: DedupKey) -> Optional[DedupEntry]:
+        return _get_fresh(self._results, key, lambda v: v.created_at)
+
+    def record_task(self, key: DedupKey, task_id: str, source_size: Optional[Tuple[int, int]] = None):
+        _put_bounded(self._results, key, DedupEntry(task_id, source_size=source_size))
+
+    def record_result(self, key: DedupKey, layers: List[LayerInfo]):
+        entry = self._results.get(key)
+        if entry is not None:
+            entry.layers = layers
+
+    def discard(self, key: DedupKey):
+        """任务失败时移除，下次相同请求重新提交"""
+        self._results.pop(key, None)
+
+    async def coalesce(self, key: DedupKey, factory: Callable[[], Awaitable[str]]) -> str:
+        """
+        合并同一 key 的并发请求：只有第一个请求执行 factory，其余等待它的结果；
+        第一个请求被取消时，等待者中的一个重新执行自己的 factory，其余继续等待
+
+        Args:
+            key: 去重 key
+            factory: 实际创建任务的协程函数，返回 task_id
+
+        Returns:
+            task_id
+        """
+        while (pending := self._inflight.get(key)) is not None:
+            logger.info(f"合并重复请求: sha256={key[0][:12]}")
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                # 执行 factory 的请求被取消（客户端断开）时不跟着失败，由等待者用自己的上传重新执行；
+                # factory 读取的是第一个请求的上传文件，请求结束后文件即关闭，不能交给后台继续执行
+                if not pending.cancelled() or asyncio.current_task().cancelling():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            task_id = await factory()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # 没有其他等待者时避免 "exception was never retrieved"
+            future.exception()
+            raise
+        else:
+            future.set_result(task_id)
+            return task_id
+        finally:
+            self._inflight.pop(key, None)
+
+
+def _get_fresh(index: OrderedDict, key, created_at):
+    value = index.get(key)
+    if value is None:
+        return None
+    if time.time() - created_at(value) > settings.dedup_ttl:
+        index.pop(key, None)
+        return None
+    index.move_to_end(key)
+    return value
+
+
+def _put_bounded(index: OrderedDict, key, value):
+    index[key] = value
+    index.move_to_end(key)
+    while len(index) > settings.dedup_max_entries:
+        index.popitem(last=False)
+
+
+dedup_index = DedupIndex()
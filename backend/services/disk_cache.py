@@ -0,0 +1,192 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, Optional, Tuple
+
+from backend.config import settings
+from backend.lazy import Lazy
+
+logger = logging.getLogger(__name__)
+
+# 缓存命名空间
+NS_LAYER = "layer"
+NS_PSD = "psd"
+NS_PREVIEW = "preview"
+
+STALE_TEMP_AGE = 3600  # 秒
+
+
+class DiskCache:
+    """
+    内容寻址的磁盘缓存（图层 PNG、生成好的 PSD、预览图）
+
+    - key 由输入内容的 sha256 得到，文件按 {namespace}/{key[:2]}/{key} 存放
+    - 写入先落到临时文件再 os.replace，读到的一定是完整文件
+    - 总大小超过 max_bytes 时按最近最少使用淘汰，超过 ttl 的条目视为未命中
+    - 索引在进程内：多个 worker 共用目录时各自按 max_bytes 淘汰，目录总大小最多约为 worker 数 × max_bytes；
+      文件可能随时被其他 worker 删除，需要长时间读取的调用方先打开文件再使用
+    """
+
+    def __init__(self, root: str, max_bytes: int, ttl: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._index: "OrderedDict[Tuple[str, str], Tuple[int, float]]" = OrderedDict()  # -> (size, created_at)
+        self._total = 0
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.hits: Counter = Counter()
+        self.misses: Counter = Counter()
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """由输入内容计算缓存 key"""
+        h = hashlib.sha256()
+        for part in parts:
+            h.update(str(part).encode("utf-8"))
+            h.update(b"\x00")
+        return h.hexdigest()
+
+    def get_path(self, namespace: str, key: str) -> Optional[str]:
+        """命中返回文件路径，未命中返回 None"""
+        self._ensure_loaded()
+        with self._lock:
+            entry = self._index.get((namespace, key))
+            if entry is not None and time.time() - entry[1] > self.ttl:
+                self._remove_locked(namespace, key)
+                entry = None
+            if entry is None:
+                self.misses[namespace] += 1
+                return None
+            path = self._path(namespace, key)
+            if not os.path.exists(path):
+                # 可能已被其他 worker 淘汰
+                self._remove_locked(namespace, key)
+                self.misses[namespace] += 1
+                return None
+            self._index.move_to_end((namespace, key))
+            self.hits[namespace] += 1
+        return path
+
+    def get_bytes(self, namespace: str, key: str) -> Optional[bytes]:
+        path = self.get_path(namespace, key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put_bytes(self, namespace: str, key: str, data: bytes) -> str:
+        tmp_path = self.temp_path()
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        return self.put_file(namespace, key, tmp_path)
+
+    def put_file(self, namespace: str, key: str, tmp_path: str) -> str:
+        """把已写好的临时文件原子地移入缓存，返回缓存文件路径"""
+        self._ensure_loaded()
+        path = self._path(namespace, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        with self._lock:
+            old = self._index.pop((namespace, key), None)
+            if old is not None:
+                self._total -= old[0]
+            self._index[(namespace, key)] = (size, time.time())
+            self._total += size
+            self._evict_locked(keep=(namespace, key))
+        return path
+
+    def temp_path(self) -> str:
+        """在缓存目录内分配临时文件（同一文件系统，保证 os.replace 原子）"""
+        tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        os.close(fd)
+        return tmp_path
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "entries": len(self._index),
+            "bytes": self._total,
+            "max_bytes": self.max_bytes,
+            "hits": dict(self.hits),
+            "misses": dict(self.misses),
+            "evictions": self.evictions,
+        }
+
+    def _path(self, namespace: str, key: str) -> str:
+        return os.path.join(self.root, namespace, key[:2], key)
+
+    def _evict_locked(self, keep=None):
+        while self._total > self.max_bytes and self._index:
+            oldest = next(iter(self._index))
+            if oldest == keep:
+                if len(self._index) == 1:
+                    break
+                self._index.move_to_end(oldest)
+                continue
+            self._remove_locked(*oldest)
+            self.evictions += 1
+
+    def _remove_locked(self, namespace: str, key: str):
+        entry = self._index.pop((namespace, key), None)
+        if entry is not None:
+            self._total -= entry[0]
+        try:
+            os.remove(self._path(namespace, key))
+        except FileNotFoundError:
+            pass
+
+    def _ensure_loaded(self):
+        """首次使用时扫描缓存目录重建索引（按修改时间作为 LRU 顺序），清理残留临时文件"""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            found = []
+            for namespace in (NS_LAYER, NS_PSD, NS_PREVIEW):
+                ns_dir = os.path.join(self.root, namespace)
+                for dirpath, _, filenames in os.walk(ns_dir):
+                    for name in filenames:
+                        st = os.stat(os.path.join(dirpath, name))
+                        found.append((st.st_mtime, namespace, name, st.st_size))
+            for mtime, namespace, key, size in sorted(found):
+                self._index[(namespace, key)] = (size, mtime)
+                self._total += size
+
+            # 残留的临时文件（写入中途进程退出），只清理足够旧的，避免误删其他 worker 正在写的文件
+            tmp_dir = os.path.join(self.root, "tmp")
+            if os.path.isdir(tmp_dir):
+                now = time.time()
+                for name in os.listdir(tmp_dir):
+                    tmp_path = os.path.join(tmp_dir, name)
+                    try:
+                        if now - os.path.getmtime(tmp_path) > STALE_TEMP_AGE:
+                            os.remove(tmp_path)
+                    except OSError:
+                        pass
+
+            self._evict_locked()
+            self._loaded = True
+            logger.info(f"磁盘缓存已加载: {self.root}, {len(self._index)} 个条目, {self._total} 字节")
+
+
+def create_disk_cache() -> DiskCache:
+    return DiskCache(
+        settings.cache_dir or os.path.join(tempfile.gettempdir(), "layer-tool-cache"),
+        settings.cache_max_bytes,
+        settings.cache_ttl,
+    )
+
+
+disk_cache = Lazy("disk_cache", create_disk_cache)
@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Optional
+
+from backend.config import settings
+from backend.lazy import Lazy
+
+logger = logging.getLogger(__name__)
+
+EXECUTOR_PROCESS = "process"
+EXECUTOR_THREAD = "thread"
+
+
+class ExecutorBusyError(Exception):
+    """排队中的 CPU 任务超过上限"""
+
+
+class CPUExecutor:
+    """
+    CPU 密集任务执行器（PNG 解码、PSD 合成），避免阻塞事件循环
+
+    同时运行的任务数不超过 workers，排队任务数不超过 max_queue，
+    超出时直接抛出 ExecutorBusyError，由调用方返回 503。
+    """
+
+    def __init__(self):
+        self.kind = settings.cpu_executor
+        self.workers = settings.cpu_workers
+        self.max_queue = settings.cpu_max_queue
+        self._pool: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._pending = 0
+
+    def start(self):
+        """创建进程池 / 线程池"""
+        if self._pool is not None:
+            return
+        if self.kind == EXECUTOR_PROCESS:
+            # spawn 避免 fork 时继承事件循环和锁的状态
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        elif self.kind == EXECUTOR_THREAD:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="cpu")
+        else:
+            raise ValueError(f"不支持的执行器类型: {self.kind}")
+        logger.info(f"CPU 执行器已启动: {self.kind}, workers={self.workers}, max_queue={self.max_queue}")
+
+    def shutdown(self):
+        if self._pool is None:
+            return
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+        logger.info("CPU 执行器已关闭")
+
+    @property
+    def pending(self) -> int:
+        """运行中 + 排队中的任务数"""
+        return self._pending
+
+    async def run(self, fn: Callable, *args, on_cancel: Optional[Callable[[], None]] = None):
+        """
+        在执行器中运行 fn(*args)
+
+        调用方被取消时，已经在执行的任务无法中止：名额一直占用到任务实际结束，
+        之后再调用 on_cancel（清理任务写出的文件等）；任务还没开始执行时立即调用。
+
+        Raises:
+            ExecutorBusyError: 排队任务过多
+        """
+        self._admit()
+        slots = self._semaphore()
+        try:
+            await slots.acquire()
+        except BaseException:
+            self._pending -= 1
+            if on_cancel is not None:
+                on_cancel()
+            raise
+
+        loop = asyncio.get_running_loop()
+        try:
+            future = self._ensure_pool().submit(fn, *args)
+        except BaseException:
+            slots.release()
+            self._pending -= 1
+            raise
+
+        finished = cancelled = False
+
+        def finish():
+            nonlocal finished
+            finished = True
+            slots.release()
+            self._pending -= 1
+            if cancelled and on_cancel is not None:
+                on_cancel()
+
+        def on_done(_):
+            # 在执行器的线程中回调，回到事件循环释放名额
+            try:
+                loop.call_soon_threadsafe(finish)
+            except RuntimeError:
+                pass  # 事件循环已关闭
+
+        future.add_done_callback(on_done)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            cancelled = True
+            if finished and on_cancel is not None:
+                # 任务已结束、结果还没交给调用方时被取消
+                on_cancel()
+            raise
+
+    def stream(self, factory: Callable, *args) -> AsyncIterator[bytes]:
+        """
+        在线程池中逐块拉取 factory(*args) 产出的数据（仅线程池模式）
+
+        入队检查在调用时立即进行，生成器本身的每一块都占用一个并发名额，直到该块在线程中实际算完
+        （消费方被取消时线程里的 next() 仍在执行，名额不提前释放）。
+        入队名额在迭代结束、出错、关闭时释放；一次都没迭代就被丢弃（如客户端在响应开始前断开）时，回收时释放。
+
+        Raises:
+            ExecutorBusyError: 排队任务过多
+        """
+        if self.kind != EXECUTOR_THREAD:
+            raise RuntimeError("流式执行仅支持线程池模式")
+        self._admit()
+        return _AdmittedStream(self, self._stream(factory, args))
+
+    async def _stream(self, factory: Callable, args: tuple) -> AsyncIterator[bytes]:
+        iterator = await self._run_in_slot(lambda: iter(factory(*args)))
+        while (chunk := await self._run_in_slot(next, iterator, None)) is not None:
+            yield chunk
+
+    async def _run_in_slot(self, fn: Callable, *args):
+        """占用一个并发名额执行 fn(*args)；名额在任务实际结束时释放，调用方被取消时也不提前释放"""
+        slots = self._semaphore()
+        await slots.acquire()
+        loop = asyncio.get_running_loop()
+        try:
+            future = self._ensure_pool().submit(fn, *args)
+        except BaseException:
+            slots.release()
+            raise
+
+        def on_done(_):
+            try:
+                loop.call_soon_threadsafe(slots.release)
+            except RuntimeError:
+                pass  # 事件循环已关闭
+
+        future.add_done_callback(on_done)
+        return await asyncio.wrap_future(future)
+
+    def _admit(self):
+        if self._pending >= self.workers + self.max_queue:
+            logger.warning(f"CPU 执行器繁忙: pending={self._pending}")
+            raise ExecutorBusyError("服务繁忙，请稍后重试")
+        self._pending += 1
+
+    def _ensure_pool(self) -> Executor:
+        if self._pool is None:
+            self.start()
+        return self._pool
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        return self._slots
+
+
+class _AdmittedStream:
+    """占用一个入队名额的异步迭代器，名额只释放一次"""
+
+    def __init__(self, executor: CPUExecutor, gen: AsyncIterator[bytes]):
+        self._executor = executor
+        self._gen = gen
+        self._held = True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        try:
+            return await self._gen.__anext__()
+        except BaseException:
+            # 包括 StopAsyncIteration（正常结束）和取消
+            self._release()
+            raise
+
+    async def aclose(self):
+        try:
+            await self._gen.aclose()
+        finally:
+            self._release()
+
+    def _release(self):
+        if self._held:
+            self._held = False
+            self._executor._pending -= 1
+
+    def __del__(self):
+        self._release()
+
+
+cpu_executor = Lazy("cpu_executor", CPUExecutor)
@@ -0,0 +1,52 @@
+import logging
+from typing import Optional
+
+import httpx
+
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPClient:
+    """应用级共享的 httpx 连接池，随 FastAPI 启动创建、关闭时释放"""
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def start(self):
+        if self._client is not None:
+            return
+        http2 = settings.http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("未安装 h2，HTTP/2 已关闭（pip install 'httpx[http2]'）")
+                http2 = False
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(settings.http_timeout),
+            limits=httpx.Limits(
+                max_connections=settings.http_max_connections,
+                max_keepalive_connections=settings.http_max_keepalive,
+            ),
+            http2=http2,
+        )
+        logger.info(f"HTTP 连接池已创建: max_connections={settings.http_max_connections}, http2={http2}")
+
+    async def close(self):
+        if self._client is None:
+            return
+        await self._client.aclose()
+        self._client = None
+        logger.info("HTTP 连接池已关闭")
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """共享的 AsyncClient，未启动时按需创建（脚本等场景）"""
+        if self._client is None:
+            self.start()
+        return self._client
+
+
+http_client = HTTPClient()
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import time
+from typing import List, Optional
+
+from backend.config import settings
+from backend.services.dedup import dedup_index
+from backend.services.metrics import STORAGE_GC_DELETED_TOTAL
+from backend.services.resilience import TokenBucket
+from backend.services.storage import MAX_DELETE_KEYS, storage_service
+from backend.services.task_store import task_store
+
+logger = logging.getLogger(__name__)
+
+REASON_EXPIRED = "expired"  # 引用它的任务全部过期
+REASON_ORPHAN = "orphan"  # 没有任务引用（上传后提交失败、进程崩溃、启用清理之前的遗留对象）
+
+
+class StorageJanitor:
+    """
+    R2 对象后台清理
+
+    - 任务过期删除后，不再被任何任务引用的对象（原图、PSD）由任务存储放入待删除队列，
+      这里定期取出，每批最多 1000 个用 delete_objects 删除，失败的放回队列下次重试
+    - 每隔 storage_gc_orphan_interval 列出 aws_s3_prefix 下的对象，找出超过 storage_gc_orphan_age
+      且没有任务引用的孤立对象；storage_gc_orphan_delete 开启时删除，否则只记录日志
+
+    delete / list 请求经过令牌桶限速（storage_gc_rate），在默认线程池中执行，不占用上传线程池。
+    """
+
+    def __init__(self):
+        self._runner: Optional[asyncio.Task] = None
+        self._bucket: Optional[TokenBucket] = None
+
+    def start(self):
+        if self._runner is not None or not settings.storage_gc_enabled:
+            return
+        self._bucket = TokenBucket(settings.storage_gc_rate, 1)
+        self._runner = asyncio.create_task(self._run())
+        logger.info(f"R2 清理已启动: rate={settings.storage_gc_rate}/s, orphan_age={settings.storage_gc_orphan_age}s")
+
+    async def stop(self):
+        if self._runner is not None:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+            self._runner = None
+
+    async def purge_released(self) -> int:
+        """删除待删除队列中的对象，返回删除数；某一批有删除失败时停止，下个周期再试"""
+        total = 0
+        batch_size = max(1, min(settings.storage_gc_batch_size, MAX_DELETE_KEYS))
+        while keys := task_store.take_released_objects(batch_size):
+            try:
+                failed = await self._delete(keys, REASON_EXPIRED)
+            except BaseException:
+                task_store.release_objects(keys)
+                raise
+            total += len(keys) - len(failed)
+            if failed:
+                task_store.release_objects(failed)
+                break
+        return total
+
+    async def sweep_orphans(self, delete: bool) -> int:
+        """找出超过 storage_gc_orphan_age 且没有任务引用的对象，delete 时删除；返回（删除或找到的）对象数"""
+        cutoff = time.time() - settings.storage_gc_orphan_age
+        total = 0
+        token = ""
+        while True:
+            await self._bucket.acquire()
+            items, token = await asyncio.to_thread(storage_service.list_objects, token)
+            old = [key for key, modified in items if modified < cutoff]
+            referenced = task_store.referenced_objects(old) if old else set()
+            orphans = [key for key in old if key not in referenced]
+            if not delete:
+                total += len(orphans)
+                if orphans:
+                    logger.info(f"孤立对象（dry run，未删除）: {len(orphans)} 个，例如 {orphans[0]}")
+            for i in range(0, len(orphans) if delete else 0, MAX_DELETE_KEYS):
+                batch = orphans[i:i + MAX_DELETE_KEYS]
+                total += len(batch) - len(await self._delete(batch, REASON_ORPHAN))
+            if not token:
+                return total
+
+    async def _run(self):
+        next_sweep = time.monotonic() + settings.storage_gc_orphan_interval
+        while True:
+            await asyncio.sleep(settings.storage_gc_interval)
+            try:
+                deleted = await self.purge_released()
+                if deleted:
+                    logger.info(f"清理过期任务的 R2 对象: {deleted} 个")
+                if settings.storage_gc_orphan_interval and time.monotonic() >= next_sweep:
+                    next_sweep = time.monotonic() + settings.storage_gc_orphan_interval
+                    delete = settings.storage_gc_orphan_delete
+                    count = await self.sweep_orphans(delete)
+                    logger.info(f"{'清理' if delete else '发现'}孤立的 R2 对象: {count} 个")
+            except Exception as e:
+                logger.error(f"R2 清理失败: {e}")
+
+    async def _delete(self, keys: List[str], reason: str) -> List[str]:
+        """限速后批量删除（跳过期间重新被任务引用的），返回删除失败的 key"""
+        # 先让去重索引忘掉这些图片，避免新任务复用即将删除的 URL
+        dedup_index.forget_images({storage_service.public_url_of(k) for k in keys})
+        await self._bucket.acquire()
+        # 新任务在复用对象前就会记录引用：取出之后、删除之前被引用的不再删除
+        referenced = task_store.referenced_objects(keys)
+        keys = [k for k in keys if k not in referenced]
+        if not keys:
+            return []
+        failed = await asyncio.to_thread(storage_service.delete_objects, keys)
+        STORAGE_GC_DELETED_TOTAL.inc(len(keys) - len(failed), reason=reason)
+        return failed
+
+
+storage_janitor = StorageJanitor()
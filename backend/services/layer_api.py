@@ -1,14 +1,53 @@
+import asyncio
+import itertools
 import logging
-from typing import Optional
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
 
 import httpx
 
 from backend.config import settings
+from backend.lazy import Lazy
+from backend.services.http_client import http_client
+from backend.services.metrics import (
+    STAGE_POLL_REQUEST, STAGE_SUBMIT_QUEUE, STAGE_SUBMIT_REQUEST, STAGE_SECONDS, UPSTREAM_ERRORS_TOTAL, timed,
+)
+from backend.services.resilience import CircuitBreaker, TokenBucket, UpstreamBusyError
 
 logger = logging.getLogger(__name__)
 
+# 提交优先级（数值越小越先提交）
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1  # 单张上传
+PRIORITY_LOW = 2  # 批量上传
+
+
+@dataclass(order=True)
+class _Submission:
+    priority: int
+    seq: int
+    payload: dict = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    attempts: int = field(default=0, compare=False)
+    sent: bool = field(default=False, compare=False)  # 已经（至少一次）发往 302ai
+    abandoned: bool = field(default=False, compare=False)  # 发出后调用方被取消，不再重试
+    enqueued_at: float = field(default_factory=time.monotonic, compare=False)
+
 
 class LayerAPIService:
+    """
+    302ai 分层接口客户端
+
+    - 提交和查询共用一个令牌桶限流和一个熔断器
+    - 提交先进入有界优先级队列，由固定数量的 worker 按优先级发出；
+      熔断打开期间队列暂停，上游恢复（半开试探成功）后自动继续
+    - 队列已满、排队超时、熔断中的查询直接抛出 UpstreamBusyError；
+      排队超时只针对还没发出的提交，已经发往 302ai 的等待结果，避免上游产生没人跟踪的任务
+    - 调用方被取消（客户端断开）时，还没发出的提交直接丢弃；已经发出的不再重试，
+      302ai 仍返回 request_id 时记录日志（该任务没人轮询）
+    """
+
     def __init__(self):
         self.base_url = settings.api_302_base_url
         self.api_key = settings.api_302_key
@@ -16,20 +55,30 @@ class LayerAPIService:
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
         }
+        self.bucket = TokenBucket(settings.api_rate_limit, settings.api_rate_burst)
+        self.breaker = CircuitBreaker("302ai", settings.api_breaker_failures, settings.api_breaker_recovery)
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers: List[asyncio.Task] = []
+        self._seq = itertools.count()
 
-    async def submit_task(self, image_url: str, num_layers: int = 4, prompt: str = "") -> str:
+    async def submit_task(
+        self, image_url: str, num_layers: int = 4, prompt: str = "", priority: int = PRIORITY_NORMAL
+    ) -> str:
         """
-        提交分层任务
+        提交分层任务（排队，按优先级发出）
 
         Args:
             image_url: 图片公网 URL
             num_layers: 分层数量，默认 4
             prompt: 提示词，可选
+            priority: 提交优先级，PRIORITY_HIGH / PRIORITY_NORMAL / PRIORITY_LOW
 
         Returns:
             request_id
+
+        Raises:
+            UpstreamBusyError: 队列已满或排队超时（超时时还没发往 302ai）
         """
-        url = f"{self.base_url}/302/submit/qwen-image-layered"
         payload = {
             "image_url": image_url,
             "prompt": prompt,
@@ -37,18 +86,29 @@ class LayerAPIService:
             "enable_safety_checker": True,
             "output_format": "png",
         }
+        self.start()
+        if self._queue.qsize() >= settings.api_queue_size:
+            raise UpstreamBusyError("提交队列已满")
 
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            try:
-                response = await client.post(url, json=payload, headers=self.headers)
-                response.raise_for_status()
-                data = response.json()
-                request_id = data.get("request_id")
-                logger.info(f"提交任务成功: request_id={request_id}")
-                return request_id
-            except httpx.HTTPError as e:
-                logger.error(f"提交任务失败: {e}")
-                raise
+        future = asyncio.get_running_loop().create_future()
+        item = _Submission(priority, next(self._seq), payload, future)
+        self._queue.put_nowait(item)
+        try:
+            done, _ = await asyncio.wait({future}, timeout=settings.api_queue_timeout)
+            if done:
+                return future.result()
+            if not item.sent:
+                future.cancel()  # worker 取到时跳过
+                raise UpstreamBusyError("排队超时")
+            # 已经发出（请求中或等待重试）：302ai 可能已创建任务，等待最终结果
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if not item.sent:
+                future.cancel()
+            elif not future.done():
+                item.abandoned = True
+                future.add_done_callback(_log_abandoned)
+            raise
 
     async def poll_result(self, request_id: str) -> Optional[dict]:
         """
@@ -59,27 +119,138 @@ class LayerAPIService:
 
         Returns:
             如果完成返回结果字典，否则返回 None
+
+        Raises:
+            UpstreamBusyError: 熔断中
         """
+        await self.bucket.acquire()
+        if not self.breaker.allow():
+            raise UpstreamBusyError("302ai 熔断中")
+
         url = f"{self.base_url}/302/submit/qwen-image-layered"
         params = {"request_id": request_id}
 
-        async with httpx.AsyncClient(timeout=30.0) as client:
+        try:
+            with timed(STAGE_POLL_REQUEST):
+                response = await self._request("GET", url, params=params)
+            data = response.json()
+
+            # 检查是否有 images 字段（完成标志）
+            if "images" in data and data["images"]:
+                logger.info(f"任务完成: request_id={request_id}, 图层数={len(data['images'])}")
+                return data
+
+            logger.info(f"任务处理中: request_id={request_id}")
+            return None
+
+        except httpx.HTTPError as e:
+            logger.error(f"查询任务失败: {e}")
+            UPSTREAM_ERRORS_TOTAL.inc(call="poll")
+            raise
+
+    def start(self):
+        if self._queue is not None:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(settings.api_submit_concurrency)]
+
+    async def stop(self):
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+    def stats(self) -> dict:
+        return {
+            "breaker": self.breaker.state,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+        }
+
+    async def _worker(self):
+        while True:
+            item: _Submission = await self._queue.get()
+            if item.future.done():
+                continue  # 调用方已放弃
+
+            # 熔断打开时在这里等待，队列中的提交在上游恢复后继续
+            await self.bucket.acquire()
+            while not self.breaker.allow():
+                await asyncio.sleep(max(self.breaker.retry_after(), 0.1))
+            if item.future.done():
+                self.breaker.release()
+                continue
+            STAGE_SECONDS.observe(time.monotonic() - item.enqueued_at, stage=STAGE_SUBMIT_QUEUE)
+
+            item.sent = True
             try:
-                response = await client.get(url, params=params, headers=self.headers)
-                response.raise_for_status()
-                data = response.json()
+                request_id = await self._submit_once(item.payload)
+            except Exception as e:
+                retry = not item.abandoned and not item.future.done()
+                if _retryable(e) and item.attempts < settings.api_submit_retries and retry:
+                    item.attempts += 1
+                    delay = settings.api_retry_backoff * 2 ** (item.attempts - 1)
+                    logger.warning(f"提交任务失败，{delay:.1f}s 后重新排队 (attempt {item.attempts}): {e}")
+                    asyncio.get_running_loop().call_later(delay, self._requeue, item)
+                elif not item.future.done():
+                    item.future.set_exception(e)
+            else:
+                if not item.future.done():
+                    item.future.set_result(request_id)
+
+    def _requeue(self, item: _Submission):
+        if self._queue is not None and not item.future.done():
+            item.enqueued_at = time.monotonic()
+            self._queue.put_nowait(item)
+
+    async def _submit_once(self, payload: dict) -> str:
+        url = f"{self.base_url}/302/submit/qwen-image-layered"
+        try:
+            with timed(STAGE_SUBMIT_REQUEST):
+                response = await self._request("POST", url, json=payload)
+            data = response.json()
+            request_id = data.get("request_id")
+            logger.info(f"提交任务成功: request_id={request_id}")
+            return request_id
+        except httpx.HTTPError as e:
+            logger.error(f"提交任务失败: {e}")
+            UPSTREAM_ERRORS_TOTAL.inc(call="submit")
+            raise
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """发出请求并把结果计入熔断器（调用前已通过 breaker.allow()）"""
+        try:
+            response = await http_client.client.request(method, url, headers=self.headers, **kwargs)
+        except httpx.HTTPError:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        if _upstream_failure(response.status_code):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        response.raise_for_status()
+        return response
+
+
+def _upstream_failure(status_code: int) -> bool:
+    """限流和服务端错误计入熔断，其余 4xx 是请求本身的问题"""
+    return status_code == 429 or status_code >= 500
+
 
-                # 检查是否有 images 字段（完成标志）
-                if "images" in data and data["images"]:
-                    logger.info(f"任务完成: request_id={request_id}, 图层数={len(data['images'])}")
-                    return data
+def _log_abandoned(future: asyncio.Future):
+    """调用方已取消的提交最终结果：302ai 已创建的任务没人轮询，记录 request_id"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    logger.warning(f"调用方已取消，302ai 任务无人跟踪: request_id={future.result()}")
 
-                logger.info(f"任务处理中: request_id={request_id}")
-                return None
 
-            except httpx.HTTPError as e:
-                logger.error(f"查询任务失败: {e}")
-                raise
+def _retryable(e: Exception) -> bool:
+    if isinstance(e, httpx.HTTPStatusError):
+        return _upstream_failure(e.response.status_code)
+    return isinstance(e, httpx.TransportError)
 
 
-layer_api_service = LayerAPIService()
+layer_api_service = Lazy("layer_api", LayerAPIService)
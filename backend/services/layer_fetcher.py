@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import random
+from typing import List, Optional, Tuple
+
+from backend.config import settings
+from backend.models import LayerInfo
+from backend.services.disk_cache import NS_LAYER, disk_cache
+from backend.services.http_client import http_client
+from backend.services.metrics import BYTES_TOTAL
+
+logger = logging.getLogger(__name__)
+
+
+class LayerDownloadError(Exception):
+    """图层下载失败（重试后仍失败）"""
+
+    def __init__(self, index: int, url: str):
+        super().__init__(f"下载图层 {index} 失败: {url}")
+        self.index = index
+        self.url = url
+
+
+class LayerFetcher:
+    """
+    并发下载分层 PNG
+
+    单个请求内的并发数和全局并发数分别受信号量限制，
+    总耗时取决于最慢的图层而不是所有图层之和。
+    """
+
+    def __init__(self):
+        self._global_slots: Optional[asyncio.Semaphore] = None
+
+    async def fetch_layers(self, layers: List[LayerInfo]) -> List[Tuple[str, bytes]]:
+        """
+        下载所有图层
+
+        Args:
+            layers: 图层列表
+
+        Returns:
+            [(name, png_bytes), ...]，顺序与 layers 一致
+
+        Raises:
+            LayerDownloadError: 任一图层重试后仍下载失败
+        """
+        request_slots = asyncio.Semaphore(settings.download_concurrency)
+        results = await asyncio.gather(*(self._fetch_limited(layer.url, request_slots) for layer in layers))
+        for i, (layer, png_bytes) in enumerate(zip(layers, results)):
+            if png_bytes is None:
+                raise LayerDownloadError(i, layer.url)
+        return [(layer.name, png_bytes) for layer, png_bytes in zip(layers, results)]
+
+    async def fetch(self, url: str) -> Optional[bytes]:
+        """下载单个文件（优先读磁盘缓存），失败按指数退避重试，最终失败返回 None"""
+        cache_key = disk_cache.make_key(url)
+        # 磁盘读写放到线程中，不阻塞事件循环（第一次访问缓存时还会扫描缓存目录）
+        cached = await asyncio.to_thread(disk_cache.get_bytes, NS_LAYER, cache_key)
+        if cached is not None:
+            return cached
+
+        retries = settings.download_retries
+        for i in range(retries + 1):
+            try:
+                resp = await http_client.client.get(url)
+                resp.raise_for_status()
+                BYTES_TOTAL.inc(len(resp.content), direction="layer_download")
+                await asyncio.to_thread(_cache_put, cache_key, resp.content)
+                return resp.content
+            except Exception as e:
+                logger.error(f"下载失败 (attempt {i + 1}): {url}, {e}")
+                if i < retries:
+                    await asyncio.sleep(_backoff(i))
+        return None
+
+    async def _fetch_limited(self, url: str, request_slots: asyncio.Semaphore) -> Optional[bytes]:
+        async with request_slots, self._global_semaphore():
+            return await self.fetch(url)
+
+    def _global_semaphore(self) -> asyncio.Semaphore:
+        if self._global_slots is None:
+            self._global_slots = asyncio.Semaphore(settings.download_global_concurrency)
+        return self._global_slots
+
+
+def _cache_put(cache_key: str, data: bytes):
+    try:
+        disk_cache.put_bytes(NS_LAYER, cache_key, data)
+    except OSError as e:
+        logger.warning(f"写入图层缓存失败: {e}")
+
+
+def _backoff(attempt: int) -> float:
+    """指数退避 + 随机抖动"""
+    base = settings.download_retry_backoff * (2 ** attempt)
+    return base + random.uniform(0, base)
+
+
+layer_fetcher = LayerFetcher()
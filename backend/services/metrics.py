@@ -0,0 +1,175 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# 各阶段名称：同时用作直方图的 stage 标签和任务记录 timings 的 key
+STAGE_PREPROCESS = "preprocess"  # 上传前预处理原图
+STAGE_UPLOAD = "r2_upload"  # 上传原图到 R2
+STAGE_SUBMIT = "submit"  # 提交 302ai（含排队）
+STAGE_SUBMIT_QUEUE = "submit_queue"  # 在提交队列中等待
+STAGE_SUBMIT_REQUEST = "submit_request"  # 单次提交请求
+STAGE_POLL_REQUEST = "poll_request"  # 单次查询请求
+STAGE_PROCESSING = "processing"  # 提交到拿到结果
+STAGE_LAYER_DOWNLOAD = "layer_download"  # 下载所有图层
+STAGE_PSD_BUILD = "psd_build"  # 合成 PSD
+STAGE_PSD_UPLOAD = "psd_upload"  # PSD 上传到 R2
+STAGE_PREVIEW = "preview"  # 生成预览图
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# 采集函数返回 [(指标名, 类型, 说明, [(标签, 值), ...]), ...]，在渲染时调用
+Sample = Tuple[Dict[str, str], float]
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in pairs) + "}"
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{self._labels(key)} {_fmt(v)}" for key, v in items]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        self._values: Dict[Tuple[str, ...], list] = {}  # -> [各桶计数..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            if i < len(self.buckets):
+                data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(data)) for key, data in self._values.items()]
+        lines = []
+        for key, data in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, data):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{self._labels(key, ('le', _fmt(bound)))} {cumulative}")
+            lines.append(f"{self.name}_bucket{self._labels(key, ('le', '+Inf'))} {data[-1]}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {_fmt(data[-2])}")
+            lines.append(f"{self.name}_count{self._labels(key)} {data[-1]}")
+        return lines
+
+
+class Registry:
+    """指标注册表，按 Prometheus 文本格式输出"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Collector] = []
+
+    def counter(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Collector):
+        """注册渲染时才读取的指标（进行中的任务数、缓存命中数等已有的计数）"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, type_, help, samples in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {type_}")
+                for labels, value in samples:
+                    label_str = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                    lines.append(f"{name}{{{label_str}}} {_fmt(value)}" if label_str else f"{name} {_fmt(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class Timer:
+    elapsed: float = 0.0
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[Timer]:
+    """记录代码块耗时到 stage 直方图（异常时也记录），耗时通过 timer.elapsed 取得"""
+    timer = Timer()
+    start = time.perf_counter()
+    try:
+        yield timer
+    finally:
+        timer.elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(timer.elapsed, stage=stage)
+
+
+def _fmt(value: float) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram("layer_tool_stage_seconds", "各处理阶段耗时（秒）", ("stage",))
+BYTES_TOTAL = registry.counter("layer_tool_bytes_total", "传输字节数", ("direction",))
+TASKS_TOTAL = registry.counter("layer_tool_tasks_total", "结束的任务数", ("status",))
+UPSTREAM_ERRORS_TOTAL = registry.counter("layer_tool_upstream_errors_total", "302ai 请求失败次数", ("call",))
+STORAGE_GC_DELETED_TOTAL = registry.counter(
+    "layer_tool_storage_gc_deleted_total", "R2 清理删除的对象数（expired：任务过期释放，orphan：孤立对象）", ("reason",)
+)
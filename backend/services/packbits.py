@@ -0,0 +1,126 @@
+from typing import Tuple
+
+import numpy as np
+
+# 压缩等级
+LEVEL_FAST = 1  # 只把整行相同的行编码为重复包，其余行按字面量分块，速度最快
+LEVEL_BEST = 2  # 完整游程检测，体积最小
+
+MIN_RUN = 3  # 游程长度达到该值才编码为重复包
+MAX_PACKET = 128  # PackBits 单个包最多 128 字节
+
+
+def encode_rows(data: np.ndarray, level: int = LEVEL_BEST) -> Tuple[np.ndarray, bytes]:
+    """
+    按行对二维 uint8 数组做 PackBits 编码（向量化实现，包不会跨行）
+
+    Args:
+        data: (rows, width) 的 uint8 数组
+        level: 压缩等级，LEVEL_FAST 或 LEVEL_BEST
+
+    Returns:
+        (每行编码后字节数的 uint16 数组, 编码后的字节流)
+    """
+    rows, width = data.shape
+    if rows == 0 or width == 0:
+        return np.zeros(rows, dtype=np.uint16), b""
+
+    flat = np.ascontiguousarray(data, dtype=np.uint8).reshape(-1)
+    seg_starts, seg_lens, seg_rep = _plan_segments(data, flat, width, level)
+
+    # 把段切成不超过 128 字节的包
+    npk = (seg_lens + MAX_PACKET - 1) // MAX_PACKET
+    pk_seg = np.repeat(np.arange(seg_starts.size), npk)
+    k = np.arange(pk_seg.size) - np.repeat(np.cumsum(npk) - npk, npk)
+    pk_start = seg_starts[pk_seg] + k * MAX_PACKET
+    pk_len = np.minimum(MAX_PACKET, seg_lens[pk_seg] - k * MAX_PACKET)
+    pk_rep = seg_rep[pk_seg]
+
+    # 重复包 2 字节（头 + 值），字面量包 1 + len 字节
+    pk_size = np.where(pk_rep, 2, 1 + pk_len)
+    row_counts = np.bincount(pk_start // width, weights=pk_size, minlength=rows).astype(np.uint16)
+
+    out_off = np.cumsum(pk_size) - pk_size
+    out = np.empty(int(out_off[-1] + pk_size[-1]), dtype=np.uint8)
+    out[out_off] = np.where(pk_rep, 257 - pk_len, pk_len - 1).astype(np.uint8)
+    out[out_off[pk_rep] + 1] = flat[pk_start[pk_rep]]
+
+    # 字面量字节：源和目标中的相对顺序一致，用布尔掩码整体拷贝
+    dst_lit = np.ones(out.size, dtype=bool)
+    dst_lit[out_off] = False
+    dst_lit[out_off[pk_rep] + 1] = False
+    src_lit = np.repeat(~seg_rep, seg_lens)
+    out[dst_lit] = flat[src_lit]
+
+    return row_counts, out.tobytes()
+
+
+def decode_rows(data, rows: int, width: int) -> np.ndarray:
+    """
+    PackBits 解码（encode_rows 的逆过程，也兼容 Photoshop 写出的数据）
+
+    包头需要逐个顺序扫描，字面量直接整段拷贝，重复包用字节串乘法展开。
+
+    Args:
+        data: 一个通道所有行的编码数据（bytes / memoryview）
+        rows: 行数
+        width: 每行像素数
+
+    Returns:
+        (rows, width) 的 uint8 数组
+
+    Raises:
+        ValueError: 数据不完整或解码后长度不符
+    """
+    buf = bytes(data)
+    out = bytearray()
+    pos, n = 0, len(buf)
+    while pos < n:
+        h = buf[pos]
+        if h < 128:
+            # 字面量包：后面 h + 1 个字节原样输出
+            end = pos + 2 + h
+            out += buf[pos + 1:end]
+            pos = end
+        elif h > 128:
+            # 重复包：下一个字节重复 257 - h 次
+            out += buf[pos + 1:pos + 2] * (257 - h)
+            pos += 2
+        else:
+            pos += 1  # 128 为空操作
+    if len(out) != rows * width:
+        raise ValueError(f"RLE 数据解码后长度不符: {len(out)} != {rows} x {width}")
+    return np.frombuffer(out, dtype=np.uint8).reshape(rows, width)
+
+
+def _plan_segments(data: np.ndarray, flat: np.ndarray, width: int, level: int):
+    """把数据划分为重复段 / 字面量段，返回 (起点, 长度, 是否重复)"""
+    rows = data.shape[0]
+
+    if level <= LEVEL_FAST:
+        # 每行一个段：整行相同为重复段，否则为字面量段
+        seg_starts = np.arange(rows, dtype=np.int64) * width
+        seg_lens = np.full(rows, width, dtype=np.int64)
+        seg_rep = (data == data[:, :1]).all(axis=1)
+        if width < MIN_RUN:
+            seg_rep[:] = False
+        return seg_starts, seg_lens, seg_rep
+
+    n = flat.size
+    run_mask = np.empty(n, dtype=bool)
+    run_mask[0] = True
+    np.not_equal(flat[1:], flat[:-1], out=run_mask[1:])
+    run_mask[::width] = True  # 行首强制断开
+    run_starts = np.flatnonzero(run_mask)
+    run_lens = np.diff(np.append(run_starts, n))
+    is_rep = run_lens >= MIN_RUN
+
+    # 相邻的短游程（同一行内）合并为一个字面量段
+    seg_mask = is_rep.copy()
+    seg_mask[1:] |= is_rep[:-1]
+    seg_mask |= run_starts % width == 0
+    first_run = np.flatnonzero(seg_mask)
+    seg_starts = run_starts[first_run]
+    seg_lens = np.diff(np.append(seg_starts, n))
+    seg_rep = is_rep[first_run]
+    return seg_starts, seg_lens, seg_rep
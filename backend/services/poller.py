@@ -0,0 +1,188 @@
+import asyncio
+import heapq
+import logging
+import random
+import statistics
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from backend.config import settings
+from backend.services.layer_api import layer_api_service
+from backend.services.metrics import STAGE_PROCESSING, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+ResultHandler = Callable[[str, dict], Awaitable[None]]
+TimeoutHandler = Callable[[str], Awaitable[None]]
+
+
+@dataclass
+class _PollEntry:
+    task_id: str
+    request_id: str
+    started_at: float  # time.monotonic()
+    deadline: float
+    attempts: int = 0
+    seq: int = 0  # 每次重新调度递增，用于识别堆里过期的条目
+
+
+class TaskPoller:
+    """
+    集中式任务轮询调度器
+
+    所有进行中的任务放在一个按下次轮询时间排序的优先队列里，由单个协程调度：
+    - 首次轮询时间根据最近完成任务的耗时中位数估算
+    - 超过预期后按指数退避 + 随机抖动继续轮询
+    - 同时进行的 poll_result 请求数不超过 poll_concurrency
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, str]] = []  # (next_poll_at, seq, task_id)
+        self._entries: Dict[str, _PollEntry] = {}
+        self._durations: deque = deque()  # 最近完成任务的耗时，start() 时按配置设置长度
+        self._seq = 0
+        self._runner: Optional[asyncio.Task] = None
+        self._inflight: Set[asyncio.Task] = set()  # 持有引用，避免任务被 GC
+        self._wakeup: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._on_result: Optional[ResultHandler] = None
+        self._on_timeout: Optional[TimeoutHandler] = None
+
+    def set_handlers(self, on_result: ResultHandler, on_timeout: TimeoutHandler):
+        """设置任务完成 / 超时的回调"""
+        self._on_result = on_result
+        self._on_timeout = on_timeout
+
+    def start(self):
+        if self._runner is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(settings.poll_concurrency)
+        self._durations = deque(self._durations, maxlen=settings.poll_history)
+        self._runner = asyncio.create_task(self._run())
+        logger.info(f"任务轮询器已启动: concurrency={settings.poll_concurrency}")
+
+    async def stop(self):
+        tasks = list(self._inflight)
+        if self._runner is not None:
+            tasks.append(self._runner)
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._runner = None
+        self._inflight.clear()
+        logger.info("任务轮询器已停止")
+
+    def add(self, task_id: str, request_id: str, created_at: Optional[float] = None):
+        """
+        登记一个进行中的任务
+
+        Args:
+            task_id: 任务 ID
+            request_id: 302ai request_id
+            created_at: 任务提交时间（time.time()），接管已有任务时传入，默认为现在
+        """
+        self.start()
+        now = time.monotonic()
+        elapsed = time.time() - created_at if created_at else 0.0
+        started_at = now - elapsed
+        entry = _PollEntry(task_id, request_id, started_at=started_at, deadline=started_at + settings.poll_timeout)
+        self._entries[task_id] = entry
+        self._schedule(entry, started_at + self._first_delay())
+
+    def remove(self, task_id: str):
+        self._entries.pop(task_id, None)
+
+    @property
+    def pending(self) -> int:
+        return len(self._entries)
+
+    def expected_duration(self) -> float:
+        """最近完成任务耗时的中位数，没有历史时用配置的初始值"""
+        if not self._durations:
+            return settings.poll_expected_duration
+        return statistics.median(self._durations)
+
+    def _first_delay(self) -> float:
+        # 稍早于预期完成时间进行首次轮询
+        return max(settings.poll_interval, self.expected_duration() * 0.8)
+
+    def _retry_delay(self, attempts: int) -> float:
+        delay = min(settings.poll_max_interval, settings.poll_interval * settings.poll_backoff ** (attempts - 1))
+        return delay * random.uniform(0.8, 1.2)
+
+    def _schedule(self, entry: _PollEntry, at: float):
+        self._seq += 1
+        entry.seq = self._seq
+        heapq.heappush(self._heap, (min(at, entry.deadline), entry.seq, entry.task_id))
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            if not self._heap:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            due, seq, task_id = self._heap[0]
+            delay = due - time.monotonic()
+            if delay > 0:
+                await self._sleep(delay)
+                continue
+
+            heapq.heappop(self._heap)
+            entry = self._entries.get(task_id)
+            if entry is None or entry.seq != seq:
+                continue  # 已移除或已重新调度
+
+            await self._slots.acquire()
+            t = asyncio.create_task(self._poll(entry))
+            self._inflight.add(t)
+            t.add_done_callback(self._inflight.discard)
+
+    async def _sleep(self, delay: float):
+        """等到 delay 秒后或有新任务加入（不用 wait_for，避免取消被吞掉）"""
+        waiter = asyncio.ensure_future(self._wakeup.wait())
+        try:
+            await asyncio.wait({waiter}, timeout=delay)
+        finally:
+            waiter.cancel()
+        self._wakeup.clear()
+
+    async def _poll(self, entry: _PollEntry):
+        entry.attempts += 1
+        result = None
+        try:
+            result = await layer_api_service.poll_result(entry.request_id)
+        except Exception as e:
+            logger.error(f"轮询失败 (attempt {entry.attempts}): task_id={entry.task_id}, {e}")
+        finally:
+            self._slots.release()
+
+        if self._entries.get(entry.task_id) is not entry:
+            return
+
+        now = time.monotonic()
+        if result and "images" in result:
+            self._entries.pop(entry.task_id, None)
+            self._durations.append(now - entry.started_at)
+            STAGE_SECONDS.observe(now - entry.started_at, stage=STAGE_PROCESSING)
+            await self._dispatch(self._on_result, entry.task_id, result)
+        elif now >= entry.deadline:
+            self._entries.pop(entry.task_id, None)
+            await self._dispatch(self._on_timeout, entry.task_id)
+        else:
+            self._schedule(entry, now + self._retry_delay(entry.attempts))
+
+    async def _dispatch(self, handler, *args):
+        if handler is None:
+            return
+        try:
+            await handler(*args)
+        except Exception as e:
+            logger.error(f"轮询回调失败: {e}")
+
+
+task_poller = TaskPoller()
@@ -0,0 +1,183 @@
+import io
+import logging
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+FORMAT_AUTO = "auto"  # 保持原格式
+FORMAT_PNG = "png"
+FORMAT_JPEG = "jpeg"
+
+# 元数据：EXIF / ICC / XMP / Photoshop 资源 / 注释
+METADATA_KEYS = ("exif", "icc_profile", "xmp", "XML:com.adobe.xmp", "photoshop", "comment")
+
+# EXIF 方向为 5-8 时宽高互换
+_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+@dataclass
+class PreprocessResult:
+    data: bytes
+    extension: str  # png / jpeg
+    width: int
+    height: int
+    source_width: int  # 处理前（按 EXIF 方向旋正后）的尺寸
+    source_height: int
+    steps: List[str] = field(default_factory=list)  # 实际执行的步骤，日志用
+
+    @property
+    def scale(self) -> float:
+        """缩放比例（处理后 / 处理前），未缩小时为 1"""
+        return self.width / self.source_width
+
+
+def preprocess_image(
+    source: Union[bytes, str],
+    max_edge: int = 0,
+    strip_metadata: bool = True,
+    normalize_mode: bool = True,
+    output_format: str = FORMAT_AUTO,
+    jpeg_quality: int = 90,
+    png_compress_level: int = 6,
+) -> Optional[PreprocessResult]:
+    """
+    上传前预处理输入图片（在 CPU 执行器中执行）
+
+    依次：按 EXIF 方向旋正、颜色模式统一为 RGB / RGBA、长边缩到 max_edge 以内、
+    转换到 sRGB 并去掉元数据、重新编码。JPEG 需要缩小时用 draft 在解码阶段按 1/2、1/4、1/8 缩小，
+    不解码全尺寸像素；色彩转换在缩小之后做。
+
+    Args:
+        source: 原始图片字节，或原图文件路径（已落盘的上传文件，不把整个文件读入内存再传给子进程）
+        max_edge: 长边上限（像素），0 表示不缩小
+        strip_metadata: 去掉 EXIF / ICC / XMP / 文本块等元数据（ICC 先转换到 sRGB）
+        normalize_mode: 调色板、灰度、CMYK、16 位等转为 RGB / RGBA，全不透明的 alpha 通道去掉
+        output_format: auto（保持原格式）/ png / jpeg（有透明度时仍为 png）
+        jpeg_quality: JPEG 编码质量
+        png_compress_level: PNG zlib 压缩等级 0-9
+
+    Returns:
+        处理结果；不需要任何处理时返回 None（原样上传，避免无谓的重新编码）
+
+    Raises:
+        PIL.UnidentifiedImageError / OSError: 不是有效的图片
+    """
+    with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as img:
+        return _preprocess(
+            img, max_edge, strip_metadata, normalize_mode, output_format, jpeg_quality, png_compress_level
+        )
+
+
+def _preprocess(
+    img: Image.Image, max_edge: int, strip_metadata: bool, normalize_mode: bool, output_format: str,
+    jpeg_quality: int, png_compress_level: int,
+) -> Optional[PreprocessResult]:
+    source_format = FORMAT_JPEG if img.format == "JPEG" else FORMAT_PNG
+    steps = []
+
+    orientation = img.getexif().get(0x0112, 1) if strip_metadata else 1
+    w, h = img.size
+    source_w, source_h = (h, w) if orientation in _TRANSPOSED_ORIENTATIONS else (w, h)
+    target = _target_size(source_w, source_h, max_edge)
+    if target is not None and img.format == "JPEG":
+        # draft 按存储方向计算，宽高比不变，取与目标同比例的尺寸即可
+        scale = target[0] / source_w
+        img.draft("RGB", (max(1, int(w * scale)), max(1, int(h * scale))))
+
+    has_metadata = _has_metadata(img)
+    if strip_metadata and orientation != 1:
+        img = ImageOps.exif_transpose(img)
+        steps.append("orient")
+
+    if normalize_mode:
+        img, normalized = _normalize_mode(img)
+        if normalized:
+            steps.append(f"mode:{normalized}")
+
+    if target is not None:
+        img = img.resize(target, Image.Resampling.LANCZOS, reducing_gap=2.0)
+        steps.append(f"resize:{source_w}x{source_h}->{target[0]}x{target[1]}")
+
+    if strip_metadata and has_metadata:
+        img, converted = _to_srgb(img)
+        steps.append("srgb+strip" if converted else "strip")
+
+    has_alpha = "A" in img.getbands() or "transparency" in img.info
+    out_format = source_format if output_format == FORMAT_AUTO else output_format
+    if out_format == FORMAT_JPEG and has_alpha:
+        out_format = FORMAT_PNG
+    if out_format != source_format:
+        steps.append(f"format:{out_format}")
+
+    if not steps:
+        return None
+
+    buf = io.BytesIO()
+    save_args = {} if strip_metadata else _metadata_args(img)
+    if out_format == FORMAT_JPEG:
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.save(buf, format="JPEG", quality=jpeg_quality, optimize=True, **save_args)
+    else:
+        img.save(buf, format="PNG", compress_level=png_compress_level, **save_args)
+    return PreprocessResult(buf.getvalue(), out_format, img.width, img.height, source_w, source_h, steps)
+
+
+def _target_size(width: int, height: int, max_edge: int) -> Optional[Tuple[int, int]]:
+    """长边超过 max_edge 时的目标尺寸（保持宽高比），不需要缩小返回 None"""
+    if not max_edge or max(width, height) <= max_edge:
+        return None
+    scale = max_edge / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _has_metadata(img: Image.Image) -> bool:
+    return any(k in img.info for k in METADATA_KEYS) or bool(getattr(img, "text", None))
+
+
+def _to_srgb(img: Image.Image) -> Tuple[Image.Image, bool]:
+    """带 ICC 配置文件的图片转换到 sRGB（去掉配置文件后颜色不变）；转换失败时保持原样"""
+    icc = img.info.get("icc_profile")
+    if not icc or img.mode not in ("RGB", "RGBA"):
+        return img, False
+    try:
+        from PIL import ImageCms
+
+        src = ImageCms.ImageCmsProfile(io.BytesIO(icc))
+        converted = ImageCms.profileToProfile(img, src, ImageCms.createProfile("sRGB"), outputMode=img.mode)
+    except Exception as e:
+        logger.warning(f"ICC 转换失败，直接去掉配置文件: {e}")
+        return img, False
+    return converted, True
+
+
+def _normalize_mode(img: Image.Image) -> Tuple[Image.Image, str]:
+    """转为 RGB / RGBA，返回 (图片, 转换说明)；已是目标模式时说明为空"""
+    mode = img.mode
+    if mode in ("I;16", "I;16B", "I;16L", "I"):
+        # 16 位灰度：convert 会直接截断，先按比例缩到 8 位
+        arr = np.asarray(img, dtype=np.uint32)
+        shift = 8 if arr.max() > 255 else 0
+        img = Image.fromarray((arr >> shift).astype(np.uint8), "L")
+
+    has_alpha = "A" in img.getbands() or "transparency" in img.info
+    target = "RGBA" if has_alpha else "RGB"
+    if img.mode != target:
+        img = img.convert(target)
+    if target == "RGBA" and img.getchannel("A").getextrema() == (255, 255):
+        # alpha 全不透明：去掉，PNG 更小
+        img = img.convert("RGB")
+    return img, "" if img.mode == mode else f"{mode}->{img.mode}"
+
+
+def _metadata_args(img: Image.Image) -> dict:
+    """保留元数据时传给 save 的参数"""
+    args = {}
+    for key in ("exif", "icc_profile"):
+        if img.info.get(key):
+            args[key] = img.info[key]
+    return args
@@ -0,0 +1,99 @@
+import io
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from backend.services.compositor import composite
+from backend.services.psd_builder import LayerSource
+
+# 预览图尺寸名
+SIZE_THUMB = "thumb"
+SIZE_PREVIEW = "preview"
+SIZES = (SIZE_THUMB, SIZE_PREVIEW)
+
+# 合成图在预览图名中的目标名（图层用下标）
+TARGET_COMPOSITE = "composite"
+
+FORMAT_WEBP = "webp"
+FORMAT_JPEG = "jpeg"
+MEDIA_TYPES = {FORMAT_WEBP: "image/webp", FORMAT_JPEG: "image/jpeg"}
+
+
+def preview_name(target, size: str) -> str:
+    """预览图名：{图层下标或 composite}-{thumb / preview}"""
+    return f"{target}-{size}"
+
+
+def render_previews(
+    layer_images: List[Tuple[str, bytes]],
+    width: int,
+    height: int,
+    thumb_size: int,
+    preview_size: int,
+    fmt: str = FORMAT_WEBP,
+    quality: int = 80,
+) -> Dict[str, bytes]:
+    """
+    生成各图层和拼合图的缩略图、中等尺寸预览图（在 CPU 执行器中执行）
+
+    尺寸为画布长边像素数（原图更小时不放大），所有图层按画布统一缩放。每个 PNG 只解码一次：
+    缩到 preview 尺寸后再缩出缩略图，拼合图直接用缩小后的图层合成，不在原尺寸上合成。
+
+    Args:
+        layer_images: [(name, png_bytes), ...]，自底向上
+        width: 画布宽度
+        height: 画布高度
+        thumb_size: 缩略图长边
+        preview_size: 预览图长边
+        fmt: webp（保留透明度）/ jpeg（透明部分铺白底）
+        quality: 编码质量 1-100
+
+    Returns:
+        {preview_name(target, size): 编码后的字节}
+    """
+    preview_scale = min(1.0, preview_size / max(width, height))
+    thumb_scale = min(1.0, thumb_size / max(width, height)) / preview_scale
+
+    results = {}
+    layers = []
+    for i, (name, png_bytes) in enumerate(layer_images):
+        with Image.open(io.BytesIO(png_bytes)) as img:
+            preview = _scale(img.convert("RGBA"), preview_scale)
+        results.update(_encode_both(preview, i, thumb_scale, fmt, quality))
+        layers.append(LayerSource.from_array(name, np.asarray(preview)))
+
+    canvas_w, canvas_h = _scaled_size(width, height, preview_scale)
+    flat = Image.fromarray(composite(layers, canvas_w, canvas_h), "RGBA")
+    results.update(_encode_both(flat, TARGET_COMPOSITE, thumb_scale, fmt, quality))
+    return results
+
+
+def _encode_both(preview: Image.Image, target, thumb_scale: float, fmt: str, quality: int) -> Dict[str, bytes]:
+    return {
+        preview_name(target, SIZE_PREVIEW): _encode(preview, fmt, quality),
+        preview_name(target, SIZE_THUMB): _encode(_scale(preview, thumb_scale), fmt, quality),
+    }
+
+
+def _scaled_size(width: int, height: int, scale: float) -> Tuple[int, int]:
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _scale(img: Image.Image, scale: float) -> Image.Image:
+    if scale >= 1.0:
+        return img
+    # reducing_gap：先按整数倍快速缩小，再做双三次重采样（RGBA 按预乘 alpha 插值）
+    return img.resize(_scaled_size(*img.size, scale), Image.Resampling.BICUBIC, reducing_gap=2.0)
+
+
+def _encode(img: Image.Image, fmt: str, quality: int) -> bytes:
+    buf = io.BytesIO()
+    if fmt == FORMAT_JPEG:
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        background.save(buf, format="JPEG", quality=quality, optimize=True)
+    else:
+        # method 2：比默认的 4 快约 30%，体积只大几个百分点
+        img.save(buf, format="WEBP", quality=quality, method=2)
+    return buf.getvalue()
@@ -1,15 +1,93 @@
 import io
 import logging
 import struct
-from typing import List, Tuple
+import tempfile
+from typing import Callable, Iterator, List, Optional, Tuple
 
 import numpy as np
 from PIL import Image
 
+from backend.services.compositor import composite, composite_over
+from backend.services.packbits import LEVEL_BEST, encode_rows
+
 logger = logging.getLogger(__name__)
 
+# 通道压缩方式
+COMPRESSION_RAW = "raw"
+COMPRESSION_RLE = "rle"
+_COMPRESSION_CODES = {COMPRESSION_RAW: 0, COMPRESSION_RLE: 1}
+
+# 流式输出时单个数据块的目标大小
+CHUNK_SIZE = 1024 * 1024
+
+# 低内存模式下按行条带编码时，单个条带的像素数
+STRIP_PIXELS = 1024 * 1024
+
+# 图层通道写入顺序：(channel id, RGBA 数组下标)
+_LAYER_CHANNELS = [(-1, 3), (0, 0), (1, 1), (2, 2)]
+
+
+class LayerSource:
+    """图层数据源：尺寸预先已知，像素按需解码，避免同时持有所有图层"""
+
+    def __init__(
+        self,
+        name: str,
+        height: int,
+        width: int,
+        loader: Callable[[], np.ndarray],
+        top: int = 0,
+        left: int = 0,
+    ):
+        self.name = name
+        self.height = height
+        self.width = width
+        self.top = top  # 图层在画布中的偏移
+        self.left = left
+        self._loader = loader
+
+    @classmethod
+    def from_array(cls, name: str, arr: np.ndarray, top: int = 0, left: int = 0) -> "LayerSource":
+        h, w = arr.shape[:2]
+        return cls(name, h, w, lambda: arr, top, left)
+
+    @classmethod
+    def from_png(cls, name: str, png_bytes: bytes, top: int = 0, left: int = 0) -> "LayerSource":
+        # 只读 PNG 头拿尺寸，不解码像素
+        with Image.open(io.BytesIO(png_bytes)) as img:
+            w, h = img.size
+        return cls(name, h, w, lambda: _decode_rgba(png_bytes), top, left)
+
+    @classmethod
+    def from_file(cls, name: str, path: str, top: int = 0, left: int = 0) -> "LayerSource":
+        # 像素在用到时才从磁盘读取解码，不在内存中保留 PNG 数据
+        with Image.open(path) as img:
+            w, h = img.size
+        return cls(name, h, w, lambda: _load_rgba(path), top, left)
+
+    def load(self) -> np.ndarray:
+        """解码为 (h, w, 4) 的 RGBA 数组"""
+        return self._loader()
+
+    def resized(self, width: int, height: int) -> "LayerSource":
+        """缩放到指定尺寸的图层（同样按需解码，偏移不变）"""
+        if (width, height) == (self.width, self.height):
+            return self
+
+        def loader():
+            return _resize_rgba(self.load(), width, height)
 
-def write_psd(layers_data: List[Tuple[str, np.ndarray]], width: int, height: int, output_path: str):
+        return LayerSource(self.name, height, width, loader, self.top, self.left)
+
+
+def write_psd(
+    layers_data: List[Tuple[str, np.ndarray]],
+    width: int,
+    height: int,
+    output_path: str,
+    compression: str = COMPRESSION_RLE,
+    level: int = LEVEL_BEST,
+):
     """
     手动写入 PSD 文件，避免 pytoshop 的 packbits 问题
 
@@ -18,13 +96,21 @@ def write_psd(layers_data: List[Tuple[str, np.ndarray]], width: int, height: int
         width: 画布宽度
         height: 画布高度
         output_path: 输出文件路径
+        compression: 通道压缩方式，"rle"（默认）或 "raw"
+        level: RLE 压缩等级，1 最快，2 体积最小
     """
     with open(output_path, "wb") as f:
-        _write_psd_to_file(f, layers_data, width, height)
+        _write_psd_to_file(f, layers_data, width, height, compression, level)
     logger.info(f"PSD 生成成功: {output_path}, {len(layers_data)} 个图层")
 
 
-def build_psd_to_bytes(layer_images: List[Tuple[str, bytes]], max_width: int, max_height: int) -> bytes:
+def build_psd_to_bytes(
+    layer_images: List[Tuple[str, bytes]],
+    max_width: int,
+    max_height: int,
+    compression: str = COMPRESSION_RLE,
+    level: int = LEVEL_BEST,
+) -> bytes:
     """
     将分层 PNG 合成为 PSD，返回字节流
 
@@ -32,141 +118,398 @@ def build_psd_to_bytes(layer_images: List[Tuple[str, bytes]], max_width: int, ma
         layer_images: [(name, png_bytes), ...]
         max_width: 画布宽度
         max_height: 画布高度
+        compression: 通道压缩方式，"rle"（默认）或 "raw"
+        level: RLE 压缩等级，1 最快，2 体积最小
 
     Returns:
         PSD 文件字节流
     """
-    layers_data = []
-    for name, png_bytes in layer_images:
-        img = Image.open(io.BytesIO(png_bytes)).convert("RGBA")
-        arr = np.array(img)
-        layers_data.append((name, arr))
+    psd_bytes = b"".join(iter_psd_from_png(layer_images, max_width, max_height, compression, level))
+    logger.info(f"PSD 合成完成: {len(layer_images)} 个图层, {max_width}x{max_height}, 压缩={compression}")
+    return psd_bytes
 
-    buffer = io.BytesIO()
-    _write_psd_to_file(buffer, layers_data, max_width, max_height)
-    buffer.seek(0)
-    logger.info(f"PSD 合成完成: {len(layers_data)} 个图层, {max_width}x{max_height}")
-    return buffer.read()
 
+def write_psd_from_png(
+    layer_images: List[Tuple[str, bytes]],
+    max_width: int,
+    max_height: int,
+    output_path: str,
+    compression: str = COMPRESSION_RLE,
+    level: int = LEVEL_BEST,
+    low_memory: bool = False,
+    output_size: Optional[Tuple[int, int]] = None,
+) -> str:
+    """
+    将分层 PNG 合成为 PSD 并写入文件（可在子进程中执行）
 
-def _write_psd_to_file(f, layers_data, width, height):
-    """内部实现：写入 PSD 二进制格式"""
-    # === File Header ===
-    f.write(b"8BPS")  # signature
-    f.write(struct.pack(">H", 1))  # version
-    f.write(b"\x00" * 6)  # reserved
-    f.write(struct.pack(">H", 4))  # channels (RGBA)
-    f.write(struct.pack(">I", height))
-    f.write(struct.pack(">I", width))
-    f.write(struct.pack(">H", 8))  # depth 8bit
-    f.write(struct.pack(">H", 3))  # color mode: RGB
+    Args:
+        layer_images: [(name, png_bytes), ...]
+        max_width: 画布宽度
+        max_height: 画布高度
+        output_path: 输出文件路径
+        compression: 通道压缩方式，"rle"（默认）或 "raw"
+        level: RLE 压缩等级，1 最快，2 体积最小
+        low_memory: 低内存模式，见 iter_psd
+        output_size: 见 iter_psd_from_png
 
-    # === Color Mode Data ===
-    f.write(struct.pack(">I", 0))
+    Returns:
+        输出文件路径
+    """
+    with open(output_path, "wb") as f:
+        for chunk in iter_psd_from_png(
+            layer_images, max_width, max_height, compression, level,
+            low_memory=low_memory, output_size=output_size,
+        ):
+            f.write(chunk)
+    logger.info(f"PSD 生成成功: {output_path}, {len(layer_images)} 个图层")
+    return output_path
 
-    # === Image Resources ===
-    f.write(struct.pack(">I", 0))
 
-    # === Layer and Mask Info ===
-    layer_mask_start = f.tell()
-    f.write(struct.pack(">I", 0))  # placeholder
+def flatten_png(layer_images: List[Tuple[str, bytes]], width: int, height: int) -> bytes:
+    """
+    把分层 PNG 拼合成一张 PNG（不生成 PSD），用于预览
 
-    # -- Layer Info --
-    layer_info_start = f.tell()
-    f.write(struct.pack(">I", 0))  # placeholder
+    Args:
+        layer_images: [(name, png_bytes), ...]，自底向上
+        width: 画布宽度
+        height: 画布高度
 
-    num_layers = len(layers_data)
-    f.write(struct.pack(">h", num_layers))
+    Returns:
+        拼合后的 PNG 字节
+    """
+    layers = [LayerSource.from_png(name, png_bytes) for name, png_bytes in layer_images]
+    buf = io.BytesIO()
+    Image.fromarray(composite(layers, width, height), "RGBA").save(buf, format="PNG")
+    return buf.getvalue()
 
-    # 每个图层的 channel data 先缓存
-    channel_buffers = []
 
-    for name, arr in layers_data:
-        h, w = arr.shape[:2]
-        top, left, bottom, right = 0, 0, h, w
-
-        f.write(struct.pack(">i", top))
-        f.write(struct.pack(">i", left))
-        f.write(struct.pack(">i", bottom))
-        f.write(struct.pack(">i", right))
-
-        num_ch = 4  # R G B A
-        f.write(struct.pack(">H", num_ch))
-
-        # channel info: id + data length
-        ch_map = [(-1, arr[:, :, 3]), (0, arr[:, :, 0]), (1, arr[:, :, 1]), (2, arr[:, :, 2])]
-        layer_ch_data = []
-        for ch_id, ch_arr in ch_map:
-            raw = ch_arr.tobytes()
-            data_len = 2 + len(raw)  # 2 bytes compression + raw data
-            f.write(struct.pack(">h", ch_id))
-            f.write(struct.pack(">I", data_len))
-            layer_ch_data.append(raw)
-        channel_buffers.append(layer_ch_data)
-
-        # blend mode signature
-        f.write(b"8BIM")
-        f.write(b"norm")  # blend mode
-        f.write(struct.pack(">B", 255))  # opacity
-        f.write(struct.pack(">B", 0))  # clipping
-        f.write(struct.pack(">B", 0x08))  # flags: transparency protected=no
-        f.write(struct.pack(">B", 0))  # filler
-
-        # extra data
-        extra_start = f.tell()
-        f.write(struct.pack(">I", 0))  # placeholder
-
-        # layer mask data
-        f.write(struct.pack(">I", 0))
-        # blending ranges
-        f.write(struct.pack(">I", 0))
-
-        # layer name (Pascal string, padded to 4 bytes)
-        name_bytes = name.encode("utf-8")[:255]
-        name_len = len(name_bytes)
-        f.write(struct.pack(">B", name_len))
-        f.write(name_bytes)
-        # pad to multiple of 4
-        total = 1 + name_len
-        pad = (4 - total % 4) % 4
-        f.write(b"\x00" * pad)
-
-        extra_end = f.tell()
-        extra_size = extra_end - extra_start - 4
-        f.seek(extra_start)
-        f.write(struct.pack(">I", extra_size))
-        f.seek(extra_end)
+def iter_psd_from_png(
+    layer_images: List[Tuple[str, bytes]],
+    max_width: int,
+    max_height: int,
+    compression: str = COMPRESSION_RLE,
+    level: int = LEVEL_BEST,
+    chunk_size: int = CHUNK_SIZE,
+    low_memory: bool = False,
+    output_size: Optional[Tuple[int, int]] = None,
+) -> Iterator[bytes]:
+    """
+    将分层 PNG 流式合成为 PSD，逐块产出字节
+
+    图层按需解码，峰值内存约为单个图层而不是整个文档。
+    指定 output_size 时画布为该尺寸，各图层按同一比例缩放（用于放大回预处理前的原图尺寸）。
+
+    Args:
+        layer_images: [(name, png_bytes), ...]
+        max_width: 画布宽度
+        max_height: 画布高度
+        compression: 通道压缩方式，"rle"（默认）或 "raw"
+        level: RLE 压缩等级，1 最快，2 体积最小
+        chunk_size: 单个数据块的目标大小
+        low_memory: 低内存模式，见 iter_psd
+        output_size: 输出画布尺寸 (宽, 高)，为空时即 max_width x max_height
+
+    Returns:
+        PSD 字节块迭代器
+    """
+    layers = [LayerSource.from_png(name, png_bytes) for name, png_bytes in layer_images]
+    if output_size and output_size != (max_width, max_height):
+        fx, fy = output_size[0] / max_width, output_size[1] / max_height
+        layers = [l.resized(max(1, round(l.width * fx)), max(1, round(l.height * fy))) for l in layers]
+        max_width, max_height = output_size
+    return iter_psd(layers, max_width, max_height, compression, level, chunk_size, low_memory)
+
+
+def iter_psd(
+    layers: List[LayerSource],
+    width: int,
+    height: int,
+    compression: str = COMPRESSION_RLE,
+    level: int = LEVEL_BEST,
+    chunk_size: int = CHUNK_SIZE,
+    low_memory: bool = False,
+) -> Iterator[bytes]:
+    """
+    流式写出 PSD：先根据图层尺寸算出各段长度，再依次产出文件头、图层记录和通道数据
+
+    每个图层只写出 alpha 非零的最小矩形（全透明图层写成零尺寸记录）。
+    规划时每个图层只解码一次：同时算出矩形、编码通道数据（rle 压缩后的 / raw 裁剪后的原始字节）
+    并合成到合并图像的画布上，之后不再解码。
+
+    low_memory 模式用于超大画布：通道按行条带转换和压缩，编码后的数据写入临时文件，
+    合并图像的画布用 numpy.memmap，内存占用不随分辨率和图层数增长（只保留单个解码图层）。
+    输出与普通模式逐字节相同。
+    """
+    if compression not in _COMPRESSION_CODES:
+        raise ValueError(f"不支持的压缩方式: {compression}")
+    return _iter_psd(layers, width, height, compression, level, chunk_size, low_memory)
+
+
+def _write_psd_to_file(f, layers_data, width, height, compression=COMPRESSION_RLE, level=LEVEL_BEST):
+    """内部实现：写入 PSD 二进制格式"""
+    layers = [LayerSource.from_array(name, arr) for name, arr in layers_data]
+    for chunk in iter_psd(layers, width, height, compression, level):
+        f.write(chunk)
+
+
+def _iter_psd(layers, width, height, compression, level, chunk_size, low_memory=False):
+    scratch = _Scratch() if low_memory else None
+    try:
+        yield from _iter_sections(layers, width, height, compression, level, chunk_size, scratch)
+    finally:
+        if scratch is not None:
+            scratch.close()
+
+
+def _iter_sections(layers, width, height, compression, level, chunk_size, scratch):
+    # === File Header ===
+    header = b"".join([
+        b"8BPS",  # signature
+        struct.pack(">H", 1),  # version
+        b"\x00" * 6,  # reserved
+        struct.pack(">H", 4),  # channels (RGBA)
+        struct.pack(">I", height),
+        struct.pack(">I", width),
+        struct.pack(">H", 8),  # depth 8bit
+        struct.pack(">H", 3),  # color mode: RGB
+        # === Color Mode Data ===
+        struct.pack(">I", 0),
+        # === Image Resources ===
+        struct.pack(">I", 0),
+    ])
+    yield header
+
+    # 所有图层 over 合成的合并图像，文件管理器 / 看图软件的预览用它；规划各图层时顺带合成
+    merged = scratch.memmap((height, width, 4)) if scratch else np.zeros((height, width, 4), dtype=np.uint8)
+    # 预先编码各图层的通道数据，得到每个通道的长度
+    plans = [_plan_layer(layer, merged, compression, level, scratch) for layer in layers]
+    records = [
+        _layer_record(layer, bbox, [len(data) for data in encoded]) for layer, (bbox, encoded) in zip(layers, plans)
+    ]
+
+    # === Layer and Mask Info ===
+    layer_info_size = 2 + sum(len(r) for r in records) + sum(len(d) for _, encoded in plans for d in encoded)
+    pad = layer_info_size % 2  # pad to even
+    layer_info_size += pad
+    layer_mask_size = 4 + layer_info_size
+    yield b"".join([
+        struct.pack(">I", layer_mask_size),
+        # -- Layer Info --
+        struct.pack(">I", layer_info_size),
+        struct.pack(">h", len(layers)),
+        *records,
+    ])
 
     # Channel image data for each layer
-    for layer_ch_data in channel_buffers:
-        for raw in layer_ch_data:
-            f.write(struct.pack(">H", 0))  # compression = raw
-            f.write(raw)
-
-    layer_info_end = f.tell()
-    layer_info_size = layer_info_end - layer_info_start - 4
-    # pad to even
-    if layer_info_size % 2 != 0:
-        f.write(b"\x00")
-        layer_info_end += 1
-        layer_info_size += 1
-    f.seek(layer_info_start)
-    f.write(struct.pack(">I", layer_info_size))
-    f.seek(layer_info_end)
-
-    layer_mask_end = f.tell()
-    layer_mask_size = layer_mask_end - layer_mask_start - 4
-    f.seek(layer_mask_start)
-    f.write(struct.pack(">I", layer_mask_size))
-    f.seek(layer_mask_end)
+    for _, encoded in plans:
+        for data in encoded:
+            yield from _emit(data, chunk_size)
+
+    if pad:
+        yield b"\x00"
 
     # === Merged Image Data (required) ===
-    f.write(struct.pack(">H", 0))  # compression = raw
-    # 写入合并后的 RGBA 数据（用最上层）
-    merged = np.zeros((height, width, 4), dtype=np.uint8)
-    if layers_data:
-        _, first = layers_data[-1]  # 最上层
-        h, w = first.shape[:2]
-        merged[:h, :w] = first
-    for ch in range(4):
-        f.write(merged[:, :, ch].tobytes())
+    channels = [merged[:, :, ch] for ch in range(4)]
+    if compression == COMPRESSION_RLE:
+        yield from _emit(_encode_channels(channels, compression, level, scratch), chunk_size)
+        return
+    yield struct.pack(">H", _COMPRESSION_CODES[COMPRESSION_RAW])
+    for ch in channels:
+        yield from _iter_rows(ch, chunk_size)
+
+
+def _plan_layer(
+    layer: LayerSource, merged: np.ndarray, compression: str, level: int, scratch: Optional["_Scratch"] = None
+):
+    """解码图层（只解码这一次）并合成到 merged 上，返回 (图层矩形, 编码后的各通道数据)"""
+    arr = layer.load()
+    composite_over(merged, arr, layer.top, layer.left)
+    bbox = _alpha_bbox(arr[:, :, 3])
+    top, left, bottom, right = bbox
+    if bottom == top:
+        # 全透明：零尺寸图层，每个通道只有压缩标记
+        return bbox, [struct.pack(">H", _COMPRESSION_CODES[COMPRESSION_RAW])] * len(_LAYER_CHANNELS)
+
+    arr = arr[top:bottom, left:right]
+    return bbox, [_encode_channels([arr[:, :, idx]], compression, level, scratch) for _, idx in _LAYER_CHANNELS]
+
+
+def _alpha_bbox(alpha: np.ndarray) -> Tuple[int, int, int, int]:
+    """alpha 非零区域的最小矩形 (top, left, bottom, right)，全透明返回 (0, 0, 0, 0)"""
+    rows = np.flatnonzero(alpha.any(axis=1))
+    if rows.size == 0:
+        return 0, 0, 0, 0
+    cols = np.flatnonzero(alpha[rows[0]:rows[-1] + 1].any(axis=0))
+    return int(rows[0]), int(cols[0]), int(rows[-1]) + 1, int(cols[-1]) + 1
+
+
+def _layer_record(layer: LayerSource, bbox: Tuple[int, int, int, int], lengths: List[int]) -> bytes:
+    """生成单个图层记录"""
+    top, left, bottom, right = bbox
+    if bottom > top:
+        top, bottom = top + layer.top, bottom + layer.top
+        left, right = left + layer.left, right + layer.left
+    parts = [
+        struct.pack(">i", top),
+        struct.pack(">i", left),
+        struct.pack(">i", bottom),
+        struct.pack(">i", right),
+        struct.pack(">H", len(_LAYER_CHANNELS)),  # R G B A
+    ]
+    # channel info: id + data length
+    for (ch_id, _), data_len in zip(_LAYER_CHANNELS, lengths):
+        parts.append(struct.pack(">h", ch_id))
+        parts.append(struct.pack(">I", data_len))
+
+    # blend mode signature
+    parts += [
+        b"8BIM",
+        b"norm",  # blend mode
+        struct.pack(">B", 255),  # opacity
+        struct.pack(">B", 0),  # clipping
+        struct.pack(">B", 0x08),  # flags: transparency protected=no
+        struct.pack(">B", 0),  # filler
+    ]
+
+    # layer name (Pascal string, padded to 4 bytes)
+    name_bytes = layer.name.encode("utf-8")[:255]
+    total = 1 + len(name_bytes)
+    pad = (4 - total % 4) % 4
+    extra = b"".join([
+        struct.pack(">I", 0),  # layer mask data
+        struct.pack(">I", 0),  # blending ranges
+        struct.pack(">B", len(name_bytes)),
+        name_bytes,
+        b"\x00" * pad,
+    ])
+    parts.append(struct.pack(">I", len(extra)))  # extra data
+    parts.append(extra)
+    return b"".join(parts)
+
+
+def _encode_channels(channels, compression, level, scratch: Optional["_Scratch"] = None):
+    """
+    编码一组通道：2 字节压缩方式 + 数据
+
+    RLE 时先写所有通道的每行字节数表，再写各通道的压缩数据；
+    图层通道每次只传一个通道，合并图像四个通道共用一个压缩标记。
+    传入 scratch 时按行条带编码并把数据写入临时文件，返回 _Spilled。
+    """
+    if scratch is not None:
+        return _encode_channels_spilled(channels, compression, level, scratch)
+
+    parts = [struct.pack(">H", _COMPRESSION_CODES[compression])]
+    if compression == COMPRESSION_RAW:
+        parts.extend(ch.tobytes() for ch in channels)
+        return b"".join(parts)
+
+    encoded = [encode_rows(ch, level) for ch in channels]
+    parts.extend(counts.astype(">u2").tobytes() for counts, _ in encoded)
+    parts.extend(data for _, data in encoded)
+    return b"".join(parts)
+
+
+def _encode_channels_spilled(channels, compression, level, scratch: "_Scratch") -> "_Spilled":
+    # PackBits 包不跨行，按条带编码后拼接与整块编码结果相同
+    start = scratch.size
+    counts = []
+    for ch in channels:
+        h, w = ch.shape
+        rows = max(1, STRIP_PIXELS // max(w, 1))
+        for r0 in range(0, h, rows):
+            if compression == COMPRESSION_RAW:
+                scratch.write(ch[r0:r0 + rows].tobytes())
+                continue
+            strip_counts, data = encode_rows(ch[r0:r0 + rows], level)
+            counts.append(strip_counts)
+            scratch.write(data)
+    header = struct.pack(">H", _COMPRESSION_CODES[compression])
+    if counts:
+        header += np.concatenate(counts).astype(">u2").tobytes()
+    return _Spilled(scratch, header, start, scratch.size - start)
+
+
+class _Scratch:
+    """低内存模式的临时文件：压缩后的通道数据追加写入，产出时再按块读回"""
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile()
+        self._maps = []
+        self.size = 0
+
+    def write(self, data: bytes):
+        self._file.seek(self.size)
+        self._file.write(data)
+        self.size += len(data)
+
+    def read(self, offset: int, length: int, chunk_size: int) -> Iterator[bytes]:
+        end = offset + length
+        while offset < end:
+            self._file.seek(offset)
+            data = self._file.read(min(chunk_size, end - offset))
+            offset += len(data)
+            yield data
+
+    def memmap(self, shape) -> np.ndarray:
+        """在单独的临时文件上分配全零的 uint8 数组"""
+        f = tempfile.TemporaryFile()
+        self._maps.append(f)
+        if 0 in shape:
+            return np.zeros(shape, dtype=np.uint8)
+        return np.memmap(f, dtype=np.uint8, mode="w+", shape=shape)
+
+    def close(self):
+        self._file.close()
+        for f in self._maps:
+            f.close()
+
+
+class _Spilled:
+    """写入临时文件的编码数据：内存中只保留头部（压缩标记 + 行字节数表）"""
+
+    def __init__(self, scratch: _Scratch, header: bytes, offset: int, length: int):
+        self._scratch = scratch
+        self.header = header
+        self.offset = offset
+        self.length = length
+
+    def __len__(self) -> int:
+        return len(self.header) + self.length
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[bytes]:
+        yield self.header
+        yield from self._scratch.read(self.offset, self.length, chunk_size)
+
+
+def _emit(encoded, chunk_size: int) -> Iterator[bytes]:
+    if isinstance(encoded, _Spilled):
+        return encoded.iter_chunks(chunk_size)
+    return _split(encoded, chunk_size)
+
+
+def _iter_rows(channel: np.ndarray, chunk_size: int) -> Iterator[bytes]:
+    """按行条带产出单个通道的原始字节"""
+    h, w = channel.shape
+    rows = max(1, chunk_size // max(w, 1))
+    for r0 in range(0, h, rows):
+        yield channel[r0:r0 + rows].tobytes()
+
+
+def _split(data: bytes, chunk_size: int) -> Iterator[bytes]:
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield view[start:start + chunk_size]
+
+
+def _decode_rgba(png_bytes: bytes) -> np.ndarray:
+    return _load_rgba(io.BytesIO(png_bytes))
+
+
+def _resize_rgba(arr: np.ndarray, width: int, height: int) -> np.ndarray:
+    # RGBA 按预乘 alpha 插值，透明边缘不会出现杂色
+    return np.array(Image.fromarray(arr, "RGBA").resize((width, height), Image.Resampling.LANCZOS))
+
+
+def _load_rgba(fp) -> np.ndarray:
+    with Image.open(fp) as img:
+        return np.array(img.convert("RGBA"))
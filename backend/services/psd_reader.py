@@ -0,0 +1,366 @@
+import io
+import mmap
+import struct
+import zlib
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from backend.services.compositor import composite
+from backend.services.packbits import decode_rows
+
+# 通道压缩方式（PSD 规范）
+_RAW, _RLE, _ZIP, _ZIP_PREDICT = 0, 1, 2, 3
+
+# RGBA 数组下标 -> 通道 id
+_RGBA_CHANNELS = [(0, 0), (1, 1), (2, 2), (3, -1)]
+
+
+class PSDFormatError(ValueError):
+    """文件不是本模块支持的 PSD（签名错误、PSB、非 8 位 RGB 等）或结构损坏"""
+
+
+class ChannelInfo:
+    __slots__ = ("id", "length", "offset")
+
+    def __init__(self, channel_id: int, length: int, offset: int):
+        self.id = channel_id
+        self.length = length  # 含 2 字节压缩标记
+        self.offset = offset  # 通道数据在文件中的位置
+
+
+class LayerRecord:
+    """图层记录：矩形、通道表和名称，通道数据只记录位置不读取"""
+
+    __slots__ = ("name", "top", "left", "bottom", "right", "channels", "blend_mode", "opacity", "flags")
+
+    def __init__(self, name, top, left, bottom, right, channels, blend_mode, opacity, flags):
+        self.name = name
+        self.top = top
+        self.left = left
+        self.bottom = bottom
+        self.right = right
+        self.channels: Dict[int, ChannelInfo] = channels
+        self.blend_mode = blend_mode
+        self.opacity = opacity
+        self.flags = flags
+
+    @property
+    def height(self) -> int:
+        return max(0, self.bottom - self.top)
+
+    @property
+    def width(self) -> int:
+        return max(0, self.right - self.left)
+
+
+class PSDReader:
+    """
+    mmap 方式读取 PSD（8 位 RGB，psd_builder 写出的文件和一般的 Photoshop 文件）
+
+    打开时只解析文件头和图层记录，得到每个通道数据的位置；
+    读取某个图层时只访问该图层的通道数据，其余部分不读入内存。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise PSDFormatError("空文件")
+        try:
+            self._parse()
+        except (struct.error, IndexError) as e:
+            self.close()
+            raise PSDFormatError(f"PSD 结构损坏: {e}")
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self) -> "PSDReader":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+    def read_channel(self, layer: LayerRecord, channel_id: int) -> np.ndarray:
+        """解码单个通道为 (height, width) 的 uint8 数组"""
+        info = layer.channels.get(channel_id)
+        if info is None:
+            raise KeyError(f"图层 {layer.name} 没有通道 {channel_id}")
+        if info.offset + info.length > len(self._mm):
+            raise PSDFormatError(f"图层 {layer.name} 的通道 {channel_id} 超出文件末尾")
+        h, w = layer.height, layer.width
+        compression = self._u16(info.offset)
+        return self._decode(compression, info.offset + 2, info.offset + info.length, [(h, w)])[0]
+
+    def read_layer(self, index: int) -> np.ndarray:
+        """解码图层为 (height, width, 4) 的 RGBA 数组（图层矩形大小，没有 alpha 通道时为不透明）"""
+        layer = self.layers[index]
+        arr = np.empty((layer.height, layer.width, 4), dtype=np.uint8)
+        for idx, ch_id in _RGBA_CHANNELS:
+            if ch_id in layer.channels:
+                arr[:, :, idx] = self.read_channel(layer, ch_id)
+            else:
+                arr[:, :, idx] = 255
+        return arr
+
+    def read_layer_canvas(self, index: int) -> np.ndarray:
+        """把图层放回画布，得到 (画布高, 画布宽, 4) 的 RGBA 数组，矩形外全透明"""
+        layer = self.layers[index]
+        canvas = np.zeros((self.height, self.width, 4), dtype=np.uint8)
+        if layer.height and layer.width:
+            # 超出画布的部分裁掉
+            t, l = max(layer.top, 0), max(layer.left, 0)
+            b, r = min(layer.bottom, self.height), min(layer.right, self.width)
+            if b > t and r > l:
+                arr = self.read_layer(index)
+                canvas[t:b, l:r] = arr[t - layer.top:b - layer.top, l - layer.left:r - layer.left]
+        return canvas
+
+    def read_merged(self) -> np.ndarray:
+        """解码合并图像为 (高, 宽, 通道数) 的 uint8 数组"""
+        offset = self._merged_offset
+        compression = self._u16(offset)
+        shapes = [(self.height, self.width)] * self.channels
+        planes = self._decode(compression, offset + 2, len(self._mm), shapes)
+        return np.stack(planes, axis=2)
+
+    # ---- 解析 ----
+
+    def _parse(self):
+        mm = self._mm
+        if mm[:4] != b"8BPS":
+            raise PSDFormatError("不是 PSD 文件")
+        version, = struct.unpack_from(">H", mm, 4)
+        if version != 1:
+            raise PSDFormatError("不支持 PSB（大文档格式）")
+        self.channels, self.height, self.width, self.depth, self.color_mode = struct.unpack_from(">HIIHH", mm, 12)
+        if self.depth != 8 or self.color_mode != 3:
+            raise PSDFormatError(f"只支持 8 位 RGB，当前 depth={self.depth}, color_mode={self.color_mode}")
+
+        pos = 26
+        pos += 4 + self._u32(pos)  # Color Mode Data
+        pos += 4 + self._u32(pos)  # Image Resources
+        layer_mask_size = self._u32(pos)
+        self._merged_offset = pos + 4 + layer_mask_size
+        self.layers: List[LayerRecord] = self._parse_layers(pos + 4) if layer_mask_size else []
+
+    def _parse_layers(self, pos: int) -> List[LayerRecord]:
+        layer_info_size = self._u32(pos)
+        if layer_info_size == 0:
+            return []
+        count, = struct.unpack_from(">h", self._mm, pos + 4)
+        pos += 6
+
+        layers, channel_lists = [], []
+        for _ in range(abs(count)):  # 负数表示第一个 alpha 通道是合并图像的透明度
+            top, left, bottom, right, n_channels = struct.unpack_from(">iiiiH", self._mm, pos)
+            pos += 18
+            channels = []
+            for _ in range(n_channels):
+                ch_id, length = struct.unpack_from(">hI", self._mm, pos)
+                channels.append((ch_id, length))
+                pos += 6
+            if self._mm[pos:pos + 4] != b"8BIM":
+                raise PSDFormatError("图层记录签名错误")
+            blend_mode = bytes(self._mm[pos + 4:pos + 8]).decode("latin-1")
+            opacity, _, flags = struct.unpack_from(">BBB", self._mm, pos + 8)
+            extra_len = self._u32(pos + 12)
+            extra_start = pos + 16
+            name = self._parse_name(extra_start, extra_start + extra_len)
+            pos = extra_start + extra_len
+            layers.append(LayerRecord(name, top, left, bottom, right, {}, blend_mode, opacity, flags))
+            channel_lists.append(channels)
+
+        # 图层记录之后依次是各图层各通道的数据：累加长度得到每个通道的位置
+        for layer, channels in zip(layers, channel_lists):
+            for ch_id, length in channels:
+                layer.channels[ch_id] = ChannelInfo(ch_id, length, pos)
+                pos += length
+        return layers
+
+    def _parse_name(self, pos: int, end: int) -> str:
+        """图层名：优先用附加信息中的 Unicode 名称（luni），否则用 Pascal 字符串（按 UTF-8 解码）"""
+        pos += 4 + self._u32(pos)  # layer mask data
+        pos += 4 + self._u32(pos)  # blending ranges
+        name_len = self._mm[pos]
+        name = bytes(self._mm[pos + 1:pos + 1 + name_len]).decode("utf-8", errors="replace")
+        pos += (1 + name_len + 3) // 4 * 4
+
+        # Additional Layer Information：signature(4) key(4) length(4) data
+        while pos + 12 <= end:
+            if self._mm[pos:pos + 4] not in (b"8BIM", b"8B64"):
+                break
+            key = self._mm[pos + 4:pos + 8]
+            length = self._u32(pos + 8)
+            if key == b"luni" and length >= 4:
+                n = self._u32(pos + 12)
+                return bytes(self._mm[pos + 16:pos + 16 + n * 2]).decode("utf-16-be", errors="replace")
+            pos += 12 + length + (length % 2)
+        return name
+
+    def _decode(self, compression: int, start: int, end: int, shapes: List[Tuple[int, int]]) -> List[np.ndarray]:
+        """解码连续存放的若干平面（图层通道为 1 个，合并图像为所有通道）"""
+        mm = self._mm
+        if compression == _RAW:
+            planes, pos = [], start
+            for h, w in shapes:
+                planes.append(np.frombuffer(mm, dtype=np.uint8, count=h * w, offset=pos).reshape(h, w).copy())
+                pos += h * w
+            return planes
+
+        if compression == _RLE:
+            # 先是所有平面所有行的字节数表，再是各平面的压缩数据
+            total_rows = sum(h for h, _ in shapes)
+            counts = np.frombuffer(mm, dtype=">u2", count=total_rows, offset=start).astype(np.int64)
+            planes, pos, row = [], start + 2 * total_rows, 0
+            for h, w in shapes:
+                size = int(counts[row:row + h].sum())
+                planes.append(decode_rows(mm[pos:pos + size], h, w))
+                pos += size
+                row += h
+            return planes
+
+        if compression in (_ZIP, _ZIP_PREDICT):
+            if len(shapes) != 1:
+                raise PSDFormatError("合并图像不支持 ZIP 压缩")
+            h, w = shapes[0]
+            data = np.frombuffer(zlib.decompress(mm[start:end]), dtype=np.uint8)
+            plane = data[:h * w].reshape(h, w)
+            if compression == _ZIP_PREDICT:
+                # 每行按左侧像素做差分
+                plane = np.cumsum(plane, axis=1, dtype=np.uint8)
+            return [plane.copy()]
+
+        raise PSDFormatError(f"不支持的压缩方式: {compression}")
+
+    def _u16(self, pos: int) -> int:
+        return struct.unpack_from(">H", self._mm, pos)[0]
+
+    def _u32(self, pos: int) -> int:
+        return struct.unpack_from(">I", self._mm, pos)[0]
+
+
+def validate_psd(path: str, layers: list, width: int, height: int, check_merged: bool = True) -> List[str]:
+    """
+    往返校验：读回 PSD，逐个图层与源数据比对，返回发现的问题（为空表示一致）
+
+    每次只解码一个源图层和对应的 PSD 图层。
+
+    Args:
+        path: PSD 路径
+        layers: 写入时用的图层，每个元素需有 name / load() / top / left（如 psd_builder.LayerSource）
+        width: 画布宽度
+        height: 画布高度
+        check_merged: 是否同时校验合并图像（需要重新合成一遍）
+    """
+    problems = []
+    try:
+        reader = PSDReader(path)
+    except (OSError, PSDFormatError) as e:
+        return [f"无法读取: {e}"]
+
+    with reader:
+        if (reader.width, reader.height) != (width, height):
+            problems.append(f"画布尺寸 {reader.width}x{reader.height}，应为 {width}x{height}")
+        if len(reader.layers) != len(layers):
+            problems.append(f"图层数 {len(reader.layers)}，应为 {len(layers)}")
+            return problems
+
+        for i, (src, rec) in enumerate(zip(layers, reader.layers)):
+            if rec.name != src.name:
+                problems.append(f"图层 {i} 名称 {rec.name!r}，应为 {src.name!r}")
+            try:
+                actual = reader.read_layer(i)
+            except (PSDFormatError, ValueError) as e:
+                problems.append(f"图层 {i} 解码失败: {e}")
+                continue
+            diff = _count_mismatches(src.load(), src.top, src.left, actual, rec.top, rec.left, width, height)
+            if diff:
+                problems.append(f"图层 {i} ({src.name}) 有 {diff} 个像素不一致")
+
+        if check_merged and not problems:
+            try:
+                merged = reader.read_merged()
+            except (PSDFormatError, ValueError) as e:
+                return problems + [f"合并图像解码失败: {e}"]
+            if merged.shape[2] < 4:
+                return problems + [f"合并图像只有 {merged.shape[2]} 个通道，应为 RGBA"]
+            expected = composite(layers, width, height)
+            diff = int(np.count_nonzero(merged[:, :, :4].view(np.uint32) != expected.view(np.uint32)))
+            if diff:
+                problems.append(f"合并图像有 {diff} 个像素不一致")
+    return problems
+
+
+def extract_layer_png(path: str, index: int, crop: bool = False) -> bytes:
+    """
+    从 PSD 中取出单个图层编码为 PNG（可在子进程中执行）
+
+    Args:
+        path: PSD 路径
+        index: 图层下标（自底向上）
+        crop: True 时只输出图层矩形，否则放回整个画布（与原图层 PNG 尺寸一致）
+
+    Raises:
+        IndexError: 图层不存在
+    """
+    with PSDReader(path) as reader:
+        if not 0 <= index < len(reader.layers):
+            raise IndexError(f"图层 {index} 不存在")
+        layer = reader.layers[index]
+        if crop and layer.height and layer.width:
+            arr = reader.read_layer(index)
+        else:
+            arr = reader.read_layer_canvas(index)
+    buf = io.BytesIO()
+    Image.fromarray(arr, "RGBA").save(buf, format="PNG", compress_level=1)
+    return buf.getvalue()
+
+
+def _count_mismatches(src, src_top, src_left, actual, rec_top, rec_left, width, height) -> int:
+    """
+    画布范围内源图层与读回图层不一致的可见像素数（任一方 alpha 非零才比较，全透明像素的颜色不重要）
+
+    只在两者的相交区域逐像素比较，区域外只需确认没有可见像素，不分配画布大小的数组。
+    """
+    src_box = _clip(src_top, src_left, src.shape, width, height)
+    rec_box = _clip(rec_top, rec_left, actual.shape, width, height)
+    src_visible = _visible(src, src_top, src_left, src_box)
+    rec_visible = _visible(actual, rec_top, rec_left, rec_box)
+
+    t, l = max(src_box[0], rec_box[0]), max(src_box[1], rec_box[1])
+    b, r = min(src_box[2], rec_box[2]), min(src_box[3], rec_box[3])
+    if b <= t or r <= l:
+        return src_visible + rec_visible
+    a = src[t - src_top:b - src_top, l - src_left:r - src_left]
+    c = actual[t - rec_top:b - rec_top, l - rec_left:r - rec_left]
+    a_vis, c_vis = a[:, :, 3] > 0, c[:, :, 3] > 0
+    # RGBA 按 uint32 整体比较，比逐通道 any 快
+    mismatched = int(np.count_nonzero((a.view(np.uint32)[:, :, 0] != c.view(np.uint32)[:, :, 0]) & (a_vis | c_vis)))
+    # 相交区域之外的可见像素都算不一致
+    outside = (src_visible - int(np.count_nonzero(a_vis))) + (rec_visible - int(np.count_nonzero(c_vis)))
+    return mismatched + outside
+
+
+def _clip(top: int, left: int, shape, width: int, height: int) -> Tuple[int, int, int, int]:
+    """图层在画布内的部分 (top, left, bottom, right)"""
+    h, w = shape[:2]
+    return max(top, 0), max(left, 0), min(top + h, height), min(left + w, width)
+
+
+def _visible(arr: np.ndarray, top: int, left: int, box: Tuple[int, int, int, int]) -> int:
+    t, l, b, r = box
+    if b <= t or r <= l:
+        return 0
+    return int(np.count_nonzero(arr[t - top:b - top, l - left:r - left, 3]))
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# 熔断器状态
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class UpstreamBusyError(Exception):
+    """上游不可用或本地排队已满（熔断中、队列满、排队超时），调用方应快速失败并稍后重试"""
+
+
+class TokenBucket:
+    """令牌桶限流：平均每秒 rate 个请求，允许 burst 个突发"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    def try_acquire(self) -> bool:
+        if self.rate <= 0:
+            return True
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        """等待直到拿到一个令牌"""
+        while not self.try_acquire():
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    - closed：正常放行，连续失败达到 failure_threshold 次后打开
+    - open：直接拒绝，recovery_timeout 秒后进入半开
+    - half_open：只放行一个试探请求，成功则关闭，失败则重新打开
+    """
+
+    def __init__(self, name: str, failure_threshold: int, recovery_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._state = STATE_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial = False  # 半开状态下是否已有试探请求在进行
+
+    @property
+    def state(self) -> str:
+        if self._state == STATE_OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = STATE_HALF_OPEN
+            self._trial = False
+            logger.info(f"熔断器半开，放行试探请求: {self.name}")
+        return self._state
+
+    def allow(self) -> bool:
+        """是否放行一次调用；放行后必须调用 record_success / record_failure / release 之一"""
+        state = self.state
+        if state == STATE_CLOSED:
+            return True
+        if state == STATE_HALF_OPEN and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        """距离下次可能放行还有多少秒"""
+        state = self.state
+        if state == STATE_CLOSED:
+            return 0.0
+        if state == STATE_OPEN:
+            return max(0.0, self._opened_at + self.recovery_timeout - time.monotonic())
+        return 0.0 if not self._trial else min(1.0, self.recovery_timeout)
+
+    def record_success(self):
+        if self._state != STATE_CLOSED:
+            logger.info(f"熔断器关闭，上游已恢复: {self.name}")
+        self._state = STATE_CLOSED
+        self._failures = 0
+        self._trial = False
+
+    def record_failure(self):
+        self._failures += 1
+        if self._state == STATE_HALF_OPEN or self._failures >= self.failure_threshold:
+            if self._state != STATE_OPEN:
+                logger.warning(f"熔断器打开: {self.name}, 连续失败 {self._failures} 次")
+            self._state = STATE_OPEN
+            self._opened_at = time.monotonic()
+            self._trial = False
+
+    def release(self):
+        """放行的调用没有结果（如被取消）：归还半开状态的试探名额"""
+        self._trial = False
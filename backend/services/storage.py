@@ -1,17 +1,28 @@
+import asyncio
 import logging
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+from typing import BinaryIO, List, Optional, Tuple
 
-import boto3
 from botocore.exceptions import ClientError
 
 from backend.config import settings
+from backend.lazy import Lazy
+from backend.services.metrics import BYTES_TOTAL
 
 logger = logging.getLogger(__name__)
 
+# delete_objects 单次请求的对象数上限
+MAX_DELETE_KEYS = 1000
+
 
 class StorageService:
     def __init__(self):
+        # boto3 导入和创建客户端都较慢，推迟到第一次用到存储时
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+
         self.s3_client = boto3.client(
             "s3",
             endpoint_url=settings.aws_endpoint,
@@ -22,6 +33,17 @@ class StorageService:
         self.bucket = settings.aws_s3_bucket
         self.prefix = settings.aws_s3_prefix
         self.public_url = settings.aws_public_url
+        # boto3 是同步客户端，异步上传放到有界线程池里执行
+        self._executor = ThreadPoolExecutor(max_workers=settings.storage_workers, thread_name_prefix="r2")
+        # 超过阈值自动切换为分块上传
+        self._transfer_config = TransferConfig(
+            multipart_threshold=settings.storage_multipart_threshold,
+            multipart_chunksize=settings.storage_multipart_chunksize,
+            max_concurrency=settings.storage_multipart_concurrency,
+        )
+
+    def close(self):
+        self._executor.shutdown(wait=False)
 
     def upload_image(self, file_bytes: bytes, filename: str) -> str:
         """
@@ -34,9 +56,7 @@ class StorageService:
         Returns:
             公网可访问的 URL
         """
-        # 生成唯一文件名
-        ext = filename.rsplit(".", 1)[-1] if "." in filename else "png"
-        key = f"{self.prefix}/{uuid.uuid4().hex}.{ext}"
+        key, ext = self._new_key(filename)
 
         try:
             self.s3_client.put_object(
@@ -55,9 +75,155 @@ class StorageService:
             logger.error(f"上传失败: {e}")
             raise
 
+    async def upload_stream(self, fileobj: BinaryIO, filename: str) -> str:
+        """
+        从文件对象分块流式上传到 R2，返回公网 URL（不阻塞事件循环）
+
+        大文件自动使用分块上传（multipart upload）。
+
+        Args:
+            fileobj: 可读的文件对象（如 UploadFile.file），从当前位置读到末尾
+            filename: 原始文件名
+
+        Returns:
+            公网可访问的 URL
+        """
+        key, ext = self._new_key(filename)
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(
+                self._executor,
+                lambda: self.s3_client.upload_fileobj(
+                    fileobj,
+                    self.bucket,
+                    key,
+                    ExtraArgs={"ContentType": f"image/{ext}"},
+                    Config=self._transfer_config,
+                    Callback=lambda n: BYTES_TOTAL.inc(n, direction="r2_upload"),
+                ),
+            )
+            logger.info(f"上传成功: {key}")
+            return self.public_url_of(key)
+        except ClientError as e:
+            logger.error(f"上传失败: {e}")
+            raise
+
+    async def upload_file(self, path: str, key: str, content_type: str):
+        """上传本地文件到指定 key（不阻塞事件循环），大文件自动分块上传"""
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(
+                self._executor,
+                lambda: self.s3_client.upload_file(
+                    path,
+                    self.bucket,
+                    key,
+                    ExtraArgs={"ContentType": content_type},
+                    Config=self._transfer_config,
+                    Callback=lambda n: BYTES_TOTAL.inc(n, direction="r2_upload"),
+                ),
+            )
+            logger.info(f"上传成功: {key}")
+        except ClientError as e:
+            logger.error(f"上传失败: {e}")
+            raise
+
+    def presign_upload(self, filename: str, content_type: str) -> Tuple[str, str]:
+        """
+        生成浏览器直传用的预签名 PUT URL
+
+        Content-Type 参与签名，上传时必须带相同的请求头。
+
+        Returns:
+            (对象 key, 预签名 URL)
+        """
+        key, _ = self._new_key(filename)
+        url = self.s3_client.generate_presigned_url(
+            "put_object",
+            Params={"Bucket": self.bucket, "Key": key, "ContentType": content_type},
+            ExpiresIn=settings.storage_presign_ttl,
+        )
+        return key, url
+
+    def presign_download(self, key: str, filename: str) -> str:
+        """生成预签名 GET URL，响应头带 Content-Disposition 作为附件下载"""
+        return self.s3_client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": key,
+                "ResponseContentDisposition": f"attachment; filename={filename}",
+            },
+            ExpiresIn=settings.storage_presign_ttl,
+        )
+
+    async def head(self, key: str) -> Optional[dict]:
+        """
+        查询对象元信息（不阻塞事件循环）
+
+        Returns:
+            {"size": 字节数, "content_type": ...}，对象不存在返回 None
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            resp = await loop.run_in_executor(
+                self._executor, lambda: self.s3_client.head_object(Bucket=self.bucket, Key=key)
+            )
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return {"size": resp["ContentLength"], "content_type": resp.get("ContentType", "")}
+
+    def public_url_of(self, key: str) -> str:
+        return f"{self.public_url}/{key}"
+
+    def key_of(self, url: str) -> str:
+        """从公网 URL 提取对象 key"""
+        return url.replace(f"{self.public_url}/", "")
+
+    def psd_key(self, name: str) -> str:
+        """PSD 的对象 key"""
+        return f"{self.prefix}/psd/{name}.psd"
+
+    def _new_key(self, filename: str):
+        """生成唯一的对象 key，返回 (key, 扩展名)"""
+        ext = filename.rsplit(".", 1)[-1] if "." in filename else "png"
+        return f"{self.prefix}/{uuid.uuid4().hex}.{ext}", ext
+
+    def delete_objects(self, keys: List[str]) -> List[str]:
+        """
+        批量删除对象（同步，单次最多 MAX_DELETE_KEYS 个），返回删除失败的 key
+
+        不存在的对象视为删除成功。
+        """
+        resp = self.s3_client.delete_objects(
+            Bucket=self.bucket,
+            Delete={"Objects": [{"Key": k} for k in keys], "Quiet": True},
+        )
+        errors = resp.get("Errors", [])
+        if errors:
+            first = errors[0]
+            logger.warning(f"批量删除部分失败: {len(errors)}/{len(keys)}, {first.get('Key')}: {first.get('Code')}")
+        return [e["Key"] for e in errors]
+
+    def list_objects(self, continuation_token: str = "") -> Tuple[List[Tuple[str, float]], str]:
+        """
+        列出 prefix 下的一页对象（同步，最多 1000 个）
+
+        Returns:
+            ([(key, 最后修改时间戳), ...], 下一页的 continuation token，没有下一页时为空)
+        """
+        params = {"Bucket": self.bucket, "Prefix": f"{self.prefix}/"}
+        if continuation_token:
+            params["ContinuationToken"] = continuation_token
+        resp = self.s3_client.list_objects_v2(**params)
+        items = [(o["Key"], o["LastModified"].timestamp()) for o in resp.get("Contents", [])]
+        return items, resp.get("NextContinuationToken", "") if resp.get("IsTruncated") else ""
+
     def delete_image(self, url: str):
         """删除图片（从 URL 提取 key）"""
-        key = url.replace(f"{self.public_url}/", "")
+        key = self.key_of(url)
         try:
             self.s3_client.delete_object(Bucket=self.bucket, Key=key)
             logger.info(f"删除成功: {key}")
@@ -65,4 +231,4 @@ class StorageService:
             logger.error(f"删除失败: {e}")
 
 
-storage_service = StorageService()
+storage_service = Lazy("storage", StorageService)
@@ -0,0 +1,48 @@
+import asyncio
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, Set
+
+from backend.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class TaskEventBus:
+    """
+    进程内任务状态发布 / 订阅
+
+    每个订阅者一个有界队列；订阅者消费太慢时丢弃最旧的事件（客户端只关心最新状态）。
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+
+    @contextmanager
+    def subscribe(self, task_id: str) -> Iterator[asyncio.Queue]:
+        """订阅任务状态变化，退出 with 块时自动取消订阅"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=settings.sse_queue_size)
+        self._subscribers[task_id].add(queue)
+        try:
+            yield queue
+        finally:
+            subscribers = self._subscribers.get(task_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[task_id]
+
+    def publish(self, task_id: str, event: dict):
+        """向所有订阅者推送事件（非阻塞）"""
+        for queue in self._subscribers.get(task_id, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    @property
+    def subscribers(self) -> int:
+        return sum(len(s) for s in self._subscribers.values())
+
+
+task_events = TaskEventBus()
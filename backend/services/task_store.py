@@ -0,0 +1,628 @@
+import asyncio
+import dataclasses
+import itertools
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from backend.config import settings
+from backend.lazy import Lazy
+from backend.models import BatchItem, LayerInfo, PSDStatus, TaskStatus
+
+logger = logging.getLogger(__name__)
+
+# 当前 worker 进程的标识，用于多 worker 共享存储时认领任务
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+STORE_MEMORY = "memory"
+STORE_SQLITE = "sqlite"
+
+
+@dataclass(slots=True)
+class TaskRecord:
+    task_id: str
+    status: TaskStatus
+    created_at: float = field(default_factory=time.time)
+    request_id: str = ""
+    image_url: str = ""
+    layers: List[LayerInfo] = field(default_factory=list)
+    error: str = ""
+    psd_status: Optional[PSDStatus] = None
+    dedup_key: Optional[tuple] = None
+    timings: Dict[str, float] = field(default_factory=dict)  # 各阶段耗时（秒），key 为 metrics.STAGE_*
+    psd_key: str = ""  # PSD 在 R2 上的对象 key（storage_psd_redirect 模式）
+    source_size: Optional[Tuple[int, int]] = None  # 预处理缩小前的原图尺寸（宽, 高），未缩小时为空
+
+
+@dataclass(slots=True)
+class BatchRecord:
+    batch_id: str
+    items: List[BatchItem]
+    created_at: float = field(default_factory=time.time)
+
+
+class TaskStore(ABC):
+    """
+    任务存储接口
+
+    所有方法都是同步的（内存 / 本地 SQLite 操作足够快），直接在事件循环中调用。
+    后台维护（心跳、清理、认领）较重，需要时由 _offload 放到线程中执行。
+    """
+
+    def __init__(self):
+        self._maintainer: Optional[asyncio.Task] = None
+
+    @abstractmethod
+    def get(self, task_id: str) -> Optional[TaskRecord]:
+        ...
+
+    @abstractmethod
+    def put(self, record: TaskRecord):
+        """新建或整体覆盖任务记录"""
+
+    @abstractmethod
+    def update(self, task_id: str, **fields) -> Optional[TaskRecord]:
+        """
+        更新部分字段，返回更新后的记录；任务不存在返回 None
+
+        状态改为 PROCESSING 时任务归当前 worker 轮询（多 worker 共享的存储记录所属 worker）。
+        """
+
+    @abstractmethod
+    def delete(self, task_id: str):
+        ...
+
+    @abstractmethod
+    def ids_by_status(self, status: TaskStatus) -> List[str]:
+        """按状态查任务 ID（走状态索引，不扫描全部任务）"""
+
+    @abstractmethod
+    def count_by_status(self) -> Dict[str, int]:
+        ...
+
+    @abstractmethod
+    def get_batch(self, batch_id: str) -> Optional[BatchRecord]:
+        ...
+
+    @abstractmethod
+    def put_batch(self, record: BatchRecord):
+        ...
+
+    @abstractmethod
+    def evict_expired(self) -> List[str]:
+        """
+        删除超过 TTL / 超出容量的任务（以及批次），返回被删除的任务 ID
+
+        被删除任务引用的 R2 对象不再被任何任务引用时放入待删除队列（由 janitor 删除）。
+        """
+
+    @abstractmethod
+    def track_objects(self, task_id: str, keys: List[str]):
+        """记录任务引用的 R2 对象 key（自己上传的和复用的），已在待删除队列中的移出队列"""
+
+    @abstractmethod
+    def untrack_objects(self, task_id: str, keys: List[str]):
+        """撤销任务对这些对象的引用（如提交失败），不再被任何任务引用的放入待删除队列"""
+
+    @abstractmethod
+    def referenced_objects(self, keys: List[str]) -> Set[str]:
+        """keys 中仍被任务引用的部分"""
+
+    @abstractmethod
+    def take_released_objects(self, limit: int) -> List[str]:
+        """从待删除队列取出最多 limit 个对象 key（先释放的先取），取出即移出队列"""
+
+    @abstractmethod
+    def release_objects(self, keys: List[str]):
+        """放回待删除队列（删除失败时下次重试）"""
+
+    def heartbeat(self):
+        """上报当前 worker 存活（仅多 worker 共享的存储需要）"""
+
+    def claim_orphans(self) -> List[TaskRecord]:
+        """认领所属 worker 已失联的进行中任务（仅多 worker 共享的存储需要）"""
+        return []
+
+    def close(self):
+        pass
+
+    def start(self, on_orphans: Callable[[List[TaskRecord]], None]):
+        """启动后台维护：定期心跳、清理过期任务、认领失联 worker 的任务"""
+        if self._maintainer is None:
+            self._maintainer = asyncio.create_task(self._maintain(on_orphans))
+
+    async def stop(self):
+        if self._maintainer is not None:
+            self._maintainer.cancel()
+            await asyncio.gather(self._maintainer, return_exceptions=True)
+            self._maintainer = None
+        self.close()
+
+    async def _offload(self, fn: Callable, *args):
+        """执行较重的维护操作；默认直接执行，可跨线程访问的存储放到线程中执行"""
+        return fn(*args)
+
+    async def _maintain(self, on_orphans):
+        while True:
+            try:
+                await self._offload(self.heartbeat)
+                evicted = await self._offload(self.evict_expired)
+                if evicted:
+                    logger.info(f"清理过期任务: {len(evicted)} 个")
+                orphans = await self._offload(self.claim_orphans)
+                if orphans:
+                    logger.info(f"接管失联 worker 的任务: {len(orphans)} 个")
+                    on_orphans(orphans)
+            except Exception as e:
+                logger.error(f"任务存储维护失败: {e}")
+            await asyncio.sleep(settings.task_sweep_interval)
+
+
+class MemoryTaskStore(TaskStore):
+    """进程内任务存储，按创建顺序淘汰：超过 TTL 或超过容量的最旧任务被删除"""
+
+    def __init__(self, ttl: int, max_entries: int):
+        super().__init__()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._records: "OrderedDict[str, TaskRecord]" = OrderedDict()
+        self._by_status: Dict[TaskStatus, Set[str]] = {s: set() for s in TaskStatus}
+        self._batches: "OrderedDict[str, BatchRecord]" = OrderedDict()
+        self._objects: Dict[str, Set[str]] = {}  # R2 对象 key -> 引用它的任务 ID
+        self._task_objects: Dict[str, Set[str]] = {}  # 任务 ID -> 引用的对象 key
+        self._released: Dict[str, None] = {}  # 待删除的对象 key（按释放顺序）
+
+    def get(self, task_id: str) -> Optional[TaskRecord]:
+        return self._records.get(task_id)
+
+    def put(self, record: TaskRecord):
+        self.delete(record.task_id)
+        self._records[record.task_id] = record
+        self._by_status[record.status].add(record.task_id)
+        if len(self._records) > self.max_entries:
+            self.evict_expired()
+
+    def update(self, task_id: str, **fields) -> Optional[TaskRecord]:
+        record = self._records.get(task_id)
+        if record is None:
+            return None
+        if "status" in fields and fields["status"] != record.status:
+            self._by_status[record.status].discard(task_id)
+            self._by_status[fields["status"]].add(task_id)
+        for name, value in fields.items():
+            setattr(record, name, value)
+        return record
+
+    def delete(self, task_id: str):
+        record = self._records.pop(task_id, None)
+        if record is not None:
+            self._by_status[record.status].discard(task_id)
+
+    def ids_by_status(self, status: TaskStatus) -> List[str]:
+        return list(self._by_status[status])
+
+    def count_by_status(self) -> Dict[str, int]:
+        return {s.value: len(ids) for s, ids in self._by_status.items()}
+
+    def get_batch(self, batch_id: str) -> Optional[BatchRecord]:
+        return self._batches.get(batch_id)
+
+    def put_batch(self, record: BatchRecord):
+        self._batches[record.batch_id] = record
+
+    def evict_expired(self) -> List[str]:
+        evicted = []
+        cutoff = time.time() - self.ttl
+        while self._batches:
+            batch = next(iter(self._batches.values()))
+            if batch.created_at >= cutoff and len(self._batches) <= self.max_entries:
+                break
+            self._batches.popitem(last=False)
+        while self._records:
+            task_id, record = next(iter(self._records.items()))
+            if record.created_at >= cutoff and len(self._records) <= self.max_entries:
+                break
+            self.delete(task_id)
+            self._untrack(task_id)
+            evicted.append(task_id)
+        return evicted
+
+    def track_objects(self, task_id: str, keys: List[str]):
+        for key in keys:
+            self._objects.setdefault(key, set()).add(task_id)
+            self._task_objects.setdefault(task_id, set()).add(key)
+            self._released.pop(key, None)
+
+    def untrack_objects(self, task_id: str, keys: List[str]):
+        tracked = self._task_objects.get(task_id, set())
+        for key in keys:
+            if key in tracked:
+                tracked.discard(key)
+                self._drop_ref(key, task_id)
+        if not tracked:
+            self._task_objects.pop(task_id, None)
+
+    def referenced_objects(self, keys: List[str]) -> Set[str]:
+        return {k for k in keys if k in self._objects}
+
+    def take_released_objects(self, limit: int) -> List[str]:
+        keys = list(itertools.islice(self._released, limit))
+        for key in keys:
+            del self._released[key]
+        return keys
+
+    def release_objects(self, keys: List[str]):
+        for key in keys:
+            if key not in self._objects:
+                self._released[key] = None
+
+    def _untrack(self, task_id: str):
+        for key in self._task_objects.pop(task_id, ()):
+            self._drop_ref(key, task_id)
+
+    def _drop_ref(self, key: str, task_id: str):
+        refs = self._objects[key]
+        refs.discard(task_id)
+        if not refs:
+            del self._objects[key]
+            self._released[key] = None
+
+
+_BUSY_CODES = (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+
+
+def _retry_busy(method):
+    """其他 worker 持有写锁时（SQLITE_BUSY / SQLITE_LOCKED）短暂等待后重试，超过重试次数抛出"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        for attempt in range(self.busy_retries + 1):
+            try:
+                return method(self, *args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if e.sqlite_errorcode not in _BUSY_CODES or attempt == self.busy_retries:
+                    raise
+            time.sleep(self.busy_timeout * (attempt + 1))
+    return wrapper
+
+
+class SQLiteTaskStore(TaskStore):
+    """
+    SQLite（WAL 模式）任务存储，同一台机器上的多个 worker 可以共享
+
+    状态单独成列并建索引，轮询器只扫描进行中的任务；其余字段以紧凑 JSON 存放。
+    每个进行中的任务记录所属 worker，worker 失联后由其他 worker 认领继续轮询。
+
+    请求路径上的读写在事件循环中同步执行：WAL 模式下读不等锁，写锁只等 busy_timeout（很短），
+    超时后递增间隔重试，单次调用让事件循环停顿的时间有上限；后台维护放到线程中执行。
+    """
+
+    def __init__(self, path: str, ttl: int, max_entries: int, busy_timeout: float = 0.05, busy_retries: int = 3):
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.busy_timeout = busy_timeout
+        self.busy_retries = busy_retries
+        self._lock = threading.Lock()
+        # 建表在启动时执行，多个 worker 同时启动时可以多等一会
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                owner TEXT NOT NULL DEFAULT '',
+                created_at REAL NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, owner);
+            CREATE INDEX IF NOT EXISTS idx_tasks_created ON tasks (created_at);
+            CREATE TABLE IF NOT EXISTS batches (
+                batch_id TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_batches_created ON batches (created_at);
+            CREATE TABLE IF NOT EXISTS workers (
+                worker_id TEXT PRIMARY KEY,
+                heartbeat REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS objects (
+                key TEXT NOT NULL,
+                task_id TEXT NOT NULL,
+                PRIMARY KEY (key, task_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_objects_task ON objects (task_id);
+            CREATE TABLE IF NOT EXISTS released_objects (
+                key TEXT PRIMARY KEY,
+                released_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_released_at ON released_objects (released_at);
+        """)
+        self._conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout * 1000)}")
+        logger.info(f"SQLite 任务存储: {path}, worker={WORKER_ID}")
+
+    def get(self, task_id: str) -> Optional[TaskRecord]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT task_id, status, created_at, data FROM tasks WHERE task_id = ?", (task_id,)
+            ).fetchone()
+        return _decode(*row) if row else None
+
+    @_retry_busy
+    def put(self, record: TaskRecord):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tasks (task_id, status, owner, created_at, data) VALUES (?, ?, ?, ?, ?)",
+                (record.task_id, record.status.value, WORKER_ID, record.created_at, _encode(record)),
+            )
+
+    @_retry_busy
+    def update(self, task_id: str, **fields) -> Optional[TaskRecord]:
+        # 读-改-写放在一个写事务里，避免多个 worker 互相覆盖
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT task_id, status, created_at, data FROM tasks WHERE task_id = ?", (task_id,)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                record = _decode(*row)
+                for name, value in fields.items():
+                    setattr(record, name, value)
+                self._conn.execute(
+                    "UPDATE tasks SET status = ?, data = ? WHERE task_id = ?",
+                    (record.status.value, _encode(record), task_id),
+                )
+                if fields.get("status") == TaskStatus.PROCESSING:
+                    # 直传时在 A 上创建、在 B 上提交：由提交的 worker 轮询，它失联后才由其他 worker 认领
+                    self._conn.execute("UPDATE tasks SET owner = ? WHERE task_id = ?", (WORKER_ID, task_id))
+                self._conn.execute("COMMIT")
+                return record
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    @_retry_busy
+    def delete(self, task_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+
+    def ids_by_status(self, status: TaskStatus) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT task_id FROM tasks WHERE status = ?", (status.value,)).fetchall()
+        return [r[0] for r in rows]
+
+    def count_by_status(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall()
+        counts = {s.value: 0 for s in TaskStatus}
+        counts.update(dict(rows))
+        return counts
+
+    def get_batch(self, batch_id: str) -> Optional[BatchRecord]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT created_at, data FROM batches WHERE batch_id = ?", (batch_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        items = [BatchItem(filename=f, task_id=t, error=e) for f, t, e in json.loads(row[1])]
+        return BatchRecord(batch_id=batch_id, items=items, created_at=row[0])
+
+    @_retry_busy
+    def put_batch(self, record: BatchRecord):
+        items = [[i.filename, i.task_id, i.error] for i in record.items]
+        data = json.dumps(items, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO batches (batch_id, created_at, data) VALUES (?, ?, ?)",
+                (record.batch_id, record.created_at, data),
+            )
+
+    @_retry_busy
+    def evict_expired(self) -> List[str]:
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM batches WHERE created_at < ?", (cutoff,))
+                rows = self._conn.execute(
+                    """
+                    SELECT task_id FROM tasks WHERE created_at < ?
+                    UNION
+                    SELECT task_id FROM (SELECT task_id FROM tasks ORDER BY created_at DESC LIMIT -1 OFFSET ?)
+                    """,
+                    (cutoff, self.max_entries),
+                ).fetchall()
+                evicted = [r[0] for r in rows]
+                self._conn.executemany("DELETE FROM tasks WHERE task_id = ?", rows)
+                keys = set()
+                for row in rows:
+                    keys.update(k for (k,) in self._conn.execute("SELECT key FROM objects WHERE task_id = ?", row))
+                self._conn.executemany("DELETE FROM objects WHERE task_id = ?", rows)
+                # 其他任务（包括其他 worker 的）仍在引用的对象不释放
+                now = time.time()
+                self._conn.executemany(
+                    """
+                    INSERT OR IGNORE INTO released_objects (key, released_at)
+                    SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM objects WHERE key = ?)
+                    """,
+                    [(k, now, k) for k in keys],
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return evicted
+
+    @_retry_busy
+    def track_objects(self, task_id: str, keys: List[str]):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO objects (key, task_id) VALUES (?, ?)", [(k, task_id) for k in keys]
+                )
+                self._conn.executemany("DELETE FROM released_objects WHERE key = ?", [(k,) for k in keys])
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    @_retry_busy
+    def untrack_objects(self, task_id: str, keys: List[str]):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "DELETE FROM objects WHERE key = ? AND task_id = ?", [(k, task_id) for k in keys]
+                )
+                self._conn.executemany(
+                    """
+                    INSERT OR IGNORE INTO released_objects (key, released_at)
+                    SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM objects WHERE key = ?)
+                    """,
+                    [(k, now, k) for k in keys],
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def referenced_objects(self, keys: List[str]) -> Set[str]:
+        found = set()
+        with self._lock:
+            # SQLite 单条语句的参数个数有上限，分批查询
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT DISTINCT key FROM objects WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                found.update(r[0] for r in rows)
+        return found
+
+    @_retry_busy
+    def take_released_objects(self, limit: int) -> List[str]:
+        # 多个 worker 同时取时各取各的，不会重复删除
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT key FROM released_objects ORDER BY released_at LIMIT ?", (limit,)
+                ).fetchall()
+                self._conn.executemany("DELETE FROM released_objects WHERE key = ?", rows)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [r[0] for r in rows]
+
+    @_retry_busy
+    def release_objects(self, keys: List[str]):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                """
+                INSERT OR IGNORE INTO released_objects (key, released_at)
+                SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM objects WHERE key = ?)
+                """,
+                [(k, now, k) for k in keys],
+            )
+
+    @_retry_busy
+    def heartbeat(self):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO workers (worker_id, heartbeat) VALUES (?, ?)", (WORKER_ID, time.time())
+            )
+
+    @_retry_busy
+    def claim_orphans(self) -> List[TaskRecord]:
+        stale = time.time() - settings.task_sweep_interval * 3
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    """
+                    SELECT task_id, status, created_at, data FROM tasks
+                    WHERE status = ? AND owner != ? AND owner NOT IN (
+                        SELECT worker_id FROM workers WHERE heartbeat >= ?
+                    )
+                    """,
+                    (TaskStatus.PROCESSING.value, WORKER_ID, stale),
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE tasks SET owner = ? WHERE task_id = ?", [(WORKER_ID, r[0]) for r in rows]
+                )
+                self._conn.execute("DELETE FROM workers WHERE heartbeat < ?", (stale,))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [_decode(*r) for r in rows]
+
+    async def _offload(self, fn: Callable, *args):
+        # 连接由锁保护，可在线程中使用；等写锁时不阻塞事件循环
+        return await asyncio.to_thread(fn, *args)
+
+    def close(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM workers WHERE worker_id = ?", (WORKER_ID,))
+            self._conn.close()
+
+
+def _encode(record: TaskRecord) -> str:
+    """除主键、状态、创建时间外的字段编码为紧凑 JSON，省略默认值"""
+    data = {}
+    for f in dataclasses.fields(TaskRecord):
+        if f.name in ("task_id", "status", "created_at"):
+            continue
+        value = getattr(record, f.name)
+        if not value:
+            continue
+        if f.name == "layers":
+            value = [[l.name, l.url, l.width, l.height] for l in value]
+        data[f.name] = value
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def _decode(task_id: str, status: str, created_at: float, data: str) -> TaskRecord:
+    fields = json.loads(data)
+    if "layers" in fields:
+        fields["layers"] = [LayerInfo(name=n, url=u, width=w, height=h) for n, u, w, h in fields["layers"]]
+    if "psd_status" in fields:
+        fields["psd_status"] = PSDStatus(fields["psd_status"])
+    if "dedup_key" in fields:
+        fields["dedup_key"] = tuple(fields["dedup_key"])
+    if "source_size" in fields:
+        fields["source_size"] = tuple(fields["source_size"])
+    return TaskRecord(task_id=task_id, status=TaskStatus(status), created_at=created_at, **fields)
+
+
+def create_task_store() -> TaskStore:
+    if settings.task_store == STORE_SQLITE:
+        return SQLiteTaskStore(
+            settings.task_store_path, settings.task_ttl, settings.task_max_entries,
+            settings.task_store_busy_timeout, settings.task_store_busy_retries,
+        )
+    if settings.task_store == STORE_MEMORY:
+        return MemoryTaskStore(settings.task_ttl, settings.task_max_entries)
+    raise ValueError(f"不支持的任务存储类型: {settings.task_store}")
+
+
+task_store = Lazy("task_store", create_task_store)
@@ -0,0 +1,114 @@
+"""
+PSD 合成基准测试
+
+用合成的 RGBA 图层（PNG）测试 psd_builder 在不同分辨率、图层数、压缩方式下的耗时和内存。
+每个用例在独立的子进程中运行，峰值 RSS 互不影响。
+
+用法（在仓库根目录）：
+    python -m benchmarks.bench_psd
+    python -m benchmarks.bench_psd --sizes 2048,4096x3072 --layers 4,8 --compression rle,raw --low-memory
+    python -m benchmarks.bench_psd --baseline benchmarks/results/psd-xxx.json
+"""
+import argparse
+import math
+import multiprocessing
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+from benchmarks.common import (
+    compare, encode_png, peak_rss_mb, percentile, print_table, reset_peak_rss, rss_mb, run_meta, save_results,
+    synthetic_layers,
+)
+
+COLUMNS = ["seconds_p50", "seconds_min", "mpix_per_s", "output_mb", "peak_rss_mb", "build_rss_mb"]
+
+
+def _run_case(
+    layer_images: List[Tuple[str, bytes]], width: int, height: int, compression: str, level: int,
+    low_memory: bool, repeat: int,
+) -> dict:
+    """子进程中执行：重复生成 PSD（输出丢弃），返回各次耗时、输出大小和 RSS"""
+    from backend.services.psd_builder import iter_psd_from_png
+
+    reset = reset_peak_rss()
+    rss_before = rss_mb()
+    times = []
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = 0
+        for chunk in iter_psd_from_png(layer_images, width, height, compression, level, low_memory=low_memory):
+            size += len(chunk)
+        times.append(time.perf_counter() - start)
+    return {"reset": reset, "times": times, "size": size, "rss_before": rss_before, "rss_after": peak_rss_mb()}
+
+
+def _parse_size(text: str) -> Tuple[int, int]:
+    if "x" in text:
+        w, h = text.lower().split("x", 1)
+        return int(w), int(h)
+    return int(text), int(text)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="PSD 合成基准测试")
+    parser.add_argument("--sizes", default="1024,2048,4096", help="画布尺寸，逗号分隔，如 2048 或 4096x3072")
+    parser.add_argument("--layers", default="4,8", help="图层数，逗号分隔")
+    parser.add_argument("--compression", default="rle", help="压缩方式，逗号分隔：rle,raw")
+    parser.add_argument("--level", type=int, default=2, help="RLE 压缩等级，1 最快，2 体积最小")
+    parser.add_argument("--low-memory", action="store_true", help="同时测试低内存模式")
+    parser.add_argument("--repeat", type=int, default=3, help="每个用例重复次数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="结果文件路径，默认 benchmarks/results/psd-<时间>.json")
+    parser.add_argument("--baseline", help="与该结果文件对比")
+    parser.add_argument("--threshold", type=float, default=10.0, help="退化判定阈值（百分比）")
+    args = parser.parse_args(argv)
+
+    sizes = [_parse_size(s) for s in args.sizes.split(",") if s]
+    layer_counts = [int(n) for n in args.layers.split(",") if n]
+    compressions = [c for c in args.compression.split(",") if c]
+    modes = [False, True] if args.low_memory else [False]
+
+    results: Dict[str, Dict[str, float]] = {}
+    ctx = multiprocessing.get_context("spawn")
+    for width, height in sizes:
+        for count in layer_counts:
+            print(f"生成图层: {width}x{height} x {count}", file=sys.stderr)
+            layer_images = [
+                (f"Layer_{i}", encode_png(arr))
+                for i, arr in enumerate(synthetic_layers(width, height, count, args.seed))
+            ]
+            for compression in compressions:
+                for low_memory in modes:
+                    case = f"{width}x{height}-{count}L-{compression}" + ("-lowmem" if low_memory else "")
+                    print(f"运行: {case}", file=sys.stderr)
+                    with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                        r = pool.submit(
+                            _run_case, layer_images, width, height, compression, args.level,
+                            low_memory, args.repeat,
+                        ).result()
+                    p50 = percentile(r["times"], 50)
+                    results[case] = {
+                        "seconds_p50": round(p50, 4),
+                        "seconds_min": round(min(r["times"]), 4),
+                        "mpix_per_s": round(width * height * count / 1e6 / p50, 2),
+                        "output_mb": round(r["size"] / (1024 * 1024), 2),
+                        "peak_rss_mb": round(r["rss_after"], 1),
+                        "build_rss_mb": round(r["rss_after"] - r["rss_before"], 1) if r["reset"] else math.nan,
+                    }
+            del layer_images
+
+    print()
+    print_table(results, COLUMNS)
+    path = save_results("psd", run_meta(vars(args)), results, args.output)
+    print(f"\n结果已保存: {path}")
+
+    if args.baseline:
+        return 1 if compare(results, args.baseline, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+"""
+启动耗时基准测试
+
+- import：新进程中 import backend.main 的耗时、加载的模块数、峰值 RSS，以及是否提前加载了重依赖
+  （numpy / PIL / boto3 应在第一次用到时才导入）。不设置凭据等环境变量，import 失败说明又有模块在导入时读取配置。
+- ready：启动 uvicorn 到 /api/health 第一次返回 200 的耗时（冷启动 / worker 重启），以及 lifespan 自身的耗时。
+
+用法（在仓库根目录）：
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --repeat 10
+    python -m benchmarks.bench_startup --baseline benchmarks/results/startup-xxx.json
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict
+
+import httpx
+
+from benchmarks.common import ROOT, compare, free_port, percentile, print_table, run_meta, save_results
+from benchmarks.load_test import DEFAULT_ENV, _parse_env, _start_backend, _stop_backend
+
+COLUMNS = ["seconds_p50", "seconds_min", "ready_p50", "ready_min", "lifespan_s", "modules", "heavy_modules",
+           "peak_rss_mb"]
+
+# 不应在 import backend.main 时加载的模块
+HEAVY_MODULES = ("numpy", "PIL", "boto3", "psd_tools")
+
+# 子进程中执行：import 耗时、已加载模块、峰值 RSS（VmHWM）
+_IMPORT_SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+import backend.main
+seconds = time.perf_counter() - start
+rss = float("nan")
+try:
+    with open("/proc/self/status") as f:
+        rss = next(int(l.split()[1]) / 1024 for l in f if l.startswith("VmHWM:"))
+except (OSError, StopIteration):
+    pass
+print(json.dumps({"seconds": seconds, "modules": sorted(sys.modules), "rss": rss}))
+"""
+
+# 配置相关的环境变量：import 用例中全部去掉
+_CONFIG_PREFIXES = ("API_", "AWS_", "CACHE_", "TASK_STORE", "CPU_", "POLL_", "PSD_", "PREVIEW_", "PREPROCESS_")
+
+
+def _run_import(repeat: int) -> dict:
+    env = {k: v for k, v in os.environ.items() if not k.startswith(_CONFIG_PREFIXES)}
+    times, modules, rss = [], [], []
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, "-c", _IMPORT_SNIPPET], cwd=ROOT, env=env, capture_output=True, text=True, timeout=60,
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(f"import backend.main 失败（不应依赖环境变量）:\n{proc.stderr}")
+        data = json.loads(proc.stdout.strip().splitlines()[-1])
+        times.append(data["seconds"])
+        modules = data["modules"]
+        rss.append(data["rss"])
+    heavy = sorted(m for m in HEAVY_MODULES if m in modules)
+    return {
+        "seconds_p50": round(percentile(times, 50), 4),
+        "seconds_min": round(min(times), 4),
+        "modules": len(modules),
+        "heavy_modules": len(heavy),
+        "heavy_loaded": heavy,
+        "peak_rss_mb": round(max(rss), 1),
+    }
+
+
+def _lifespan_seconds(port: int) -> float:
+    text = httpx.get(f"http://127.0.0.1:{port}/api/metrics", timeout=5).text
+    m = re.search(r'^layer_tool_startup_seconds\{phase="lifespan"\} (\S+)$', text, re.M)
+    return float(m.group(1)) if m else float("nan")
+
+
+def _run_ready(repeat: int, extra_env: Dict[str, str]) -> dict:
+    times, lifespans = [], []
+    with tempfile.TemporaryDirectory(prefix="layer-tool-startup-") as tmp:
+        # 存储和 302ai 客户端在第一次用到时才创建，启动过程不会访问这两个地址
+        env = {
+            **DEFAULT_ENV,
+            "API_302_BASE_URL": "http://127.0.0.1:9",
+            "AWS_ENDPOINT": "http://127.0.0.1:9",
+            "AWS_PUBLIC_URL": "http://127.0.0.1:9/bench",
+            "CACHE_DIR": os.path.join(tmp, "cache"),
+            "TASK_STORE_PATH": os.path.join(tmp, "tasks.db"),
+            **extra_env,
+        }
+        for _ in range(repeat):
+            port = free_port()
+            start = time.perf_counter()
+            proc = _start_backend(port, env, subprocess.DEVNULL)
+            times.append(time.perf_counter() - start)
+            try:
+                lifespans.append(_lifespan_seconds(port))
+            finally:
+                _stop_backend(proc)
+    return {
+        "ready_p50": round(percentile(times, 50), 4),
+        "ready_min": round(min(times), 4),
+        "lifespan_s": round(percentile(lifespans, 50), 4),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="启动耗时基准测试")
+    parser.add_argument("--repeat", type=int, default=5, help="每个用例启动的次数")
+    parser.add_argument("--env", action="append", default=[], help="ready 用例传给后端的环境变量 KEY=VALUE，可重复")
+    parser.add_argument("--output", help="结果文件路径，默认 benchmarks/results/startup-<时间>.json")
+    parser.add_argument("--baseline", help="与该结果文件对比")
+    parser.add_argument("--threshold", type=float, default=10.0, help="退化判定阈值（百分比）")
+    args = parser.parse_args(argv)
+
+    print(f"import backend.main × {args.repeat}", file=sys.stderr)
+    results = {"import": _run_import(args.repeat)}
+    print(f"启动 uvicorn 到 /api/health × {args.repeat}", file=sys.stderr)
+    results["ready"] = _run_ready(args.repeat, _parse_env(args.env))
+
+    print()
+    print_table(results, COLUMNS)
+    heavy = results["import"]["heavy_loaded"]
+    if heavy:
+        print(f"\nimport 时加载了重依赖: {', '.join(heavy)}")
+    path = save_results("startup", run_meta(vars(args)), results, args.output)
+    print(f"\n结果已保存: {path}")
+
+    if args.baseline:
+        return 1 if compare(results, args.baseline, args.threshold) else 0
+    return 1 if heavy else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+import io
+import json
+import math
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+# 与基线对比时各指标的方向：True 表示越小越好，False 表示越大越好；不在表中的指标只展示不判定
+LOWER_IS_BETTER = {
+    "seconds_p50": True,
+    "seconds_min": True,
+    "peak_rss_mb": True,
+    "build_rss_mb": True,
+    "output_mb": True,
+    "mpix_per_s": False,
+    "throughput_rps": False,
+    "failed": True,
+    "total_p50": True,
+    "total_p99": True,
+    "upload_p50": True,
+    "upload_p99": True,
+    "wait_p50": True,
+    "wait_p99": True,
+    "download_p50": True,
+    "download_p99": True,
+    "server_peak_rss_mb": True,
+    "worker_peak_rss_mb": True,
+    "ready_p50": True,
+    "ready_min": True,
+    "lifespan_s": True,
+    "modules": True,
+    "heavy_modules": True,
+}
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """线性插值分位数，q 取 0~100；空序列返回 nan"""
+    if not values:
+        return math.nan
+    return float(np.percentile(np.asarray(values, dtype=np.float64), q))
+
+
+def summarize(prefix: str, values: Sequence[float]) -> Dict[str, float]:
+    """耗时序列的 p50 / p99 / 最大值（秒）"""
+    return {
+        f"{prefix}_p50": round(percentile(values, 50), 4),
+        f"{prefix}_p99": round(percentile(values, 99), 4),
+        f"{prefix}_max": round(max(values), 4) if values else math.nan,
+    }
+
+
+def maxrss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    """
+    进程（或已回收子进程中最大者）的峰值 RSS，单位 MB
+
+    Linux 上 ru_maxrss 为 KB 且会跨 exec 继承父进程的值，测当前进程优先用 peak_rss_mb()。
+    """
+    rss = resource.getrusage(who).ru_maxrss
+    if sys.platform == "darwin":
+        return rss / (1024 * 1024)
+    return rss / 1024
+
+
+def rss_mb() -> float:
+    """当前 RSS，单位 MB（没有 /proc 时返回 nan）"""
+    return _proc_status("VmRSS")
+
+
+def peak_rss_mb() -> float:
+    """当前进程的峰值 RSS，单位 MB（Linux 读 VmHWM，其他平台退回 ru_maxrss）"""
+    peak = _proc_status("VmHWM")
+    return maxrss_mb() if math.isnan(peak) else peak
+
+
+def reset_peak_rss() -> bool:
+    """把峰值 RSS 重置为当前值（Linux 4.0+），成功返回 True"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def proc_peak_rss_mb(pid: int) -> float:
+    """其他进程的峰值 RSS，单位 MB（没有 /proc 时返回 nan）"""
+    return _proc_status("VmHWM", pid)
+
+
+def child_pids(pid: int) -> List[int]:
+    """直接子进程的 pid（Linux）"""
+    pids = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                pids.extend(int(p) for p in f.read().split())
+    except OSError:
+        pass
+    return pids
+
+
+def _proc_status(field: str, pid="self") -> float:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return math.nan
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def synthetic_layers(width: int, height: int, count: int, seed: int = 0) -> List[np.ndarray]:
+    """
+    生成接近真实分层结果的 RGBA 图层：
+
+    第 0 层是不透明的渐变背景，其余图层是带噪点的半透明椭圆主体，
+    周围全透明（测试按 alpha 裁剪、RLE 压缩和合成的真实开销）。
+    """
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    layers = []
+    for i in range(count):
+        arr = np.empty((height, width, 4), dtype=np.uint8)
+        if i == 0:
+            arr[:, :, 0] = (xx * (255.0 / max(width - 1, 1))).astype(np.uint8)
+            arr[:, :, 1] = (yy * (255.0 / max(height - 1, 1))).astype(np.uint8)
+            arr[:, :, 2] = 128
+            arr[:, :, 3] = 255
+        else:
+            cy, cx = rng.uniform(0.2, 0.8) * height, rng.uniform(0.2, 0.8) * width
+            ry, rx = rng.uniform(0.1, 0.3) * height, rng.uniform(0.1, 0.3) * width
+            d = ((yy - cy) / ry) ** 2 + ((xx - cx) / rx) ** 2
+            alpha = np.clip((1.0 - d) * 4.0, 0.0, 1.0)
+            base = rng.integers(0, 256, size=3)
+            noise = rng.integers(-16, 17, size=(height, width, 3))
+            arr[:, :, :3] = np.clip(base + noise, 0, 255).astype(np.uint8)
+            arr[:, :, 3] = (alpha * 255).astype(np.uint8)
+            arr[alpha == 0] = 0
+        layers.append(arr)
+    return layers
+
+
+def encode_png(arr: np.ndarray) -> bytes:
+    buf = io.BytesIO()
+    Image.fromarray(arr, "RGBA" if arr.shape[2] == 4 else "RGB").save(buf, format="PNG", compress_level=1)
+    return buf.getvalue()
+
+
+def run_meta(args: Optional[dict] = None) -> dict:
+    """运行环境信息，写入结果文件便于对比时核对"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=10,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ""
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "args": args or {},
+    }
+
+
+def save_results(name: str, meta: dict, results: Dict[str, Dict[str, float]], output: Optional[str] = None) -> Path:
+    """保存结果 JSON，默认 benchmarks/results/<name>-<时间>.json"""
+    if output:
+        path = Path(output)
+    else:
+        RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+        path = RESULTS_DIR / f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({"benchmark": name, "meta": meta, "results": results}, indent=2, ensure_ascii=False))
+    return path
+
+
+def print_table(results: Dict[str, Dict[str, float]], columns: Iterable[str]):
+    columns = list(columns)
+    rows = [[case] + [_fmt(metrics.get(c)) for c in columns] for case, metrics in results.items()]
+    header = ["case"] + columns
+    widths = [max(len(str(r[i])) for r in rows + [header]) for i in range(len(header))]
+    print("  ".join(h.ljust(w) for h, w in zip(header, widths)))
+    for r in rows:
+        print("  ".join(str(v).ljust(w) for v, w in zip(r, widths)))
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline_path: str, threshold: float) -> List[str]:
+    """
+    与基线结果对比，打印各指标的变化，返回超过 threshold（百分比）的退化项
+
+    只对比两边都有的用例和 LOWER_IS_BETTER 中的指标。
+    """
+    baseline = json.loads(Path(baseline_path).read_text())
+    base_results = baseline.get("results", {})
+    print(f"\n与基线对比: {baseline_path} (commit {baseline.get('meta', {}).get('git_commit', '?')})")
+    regressions = []
+    for case, metrics in results.items():
+        base = base_results.get(case)
+        if base is None:
+            print(f"  {case}: 基线中没有该用例")
+            continue
+        parts = []
+        for metric, lower_better in LOWER_IS_BETTER.items():
+            new, old = metrics.get(metric), base.get(metric)
+            if not _number(new) or not _number(old):
+                continue
+            if old == 0:
+                change = 0.0 if new == 0 else math.inf
+            else:
+                change = (new - old) / abs(old) * 100
+            worse = change > threshold if lower_better else change < -threshold
+            mark = " !" if worse else ""
+            parts.append(f"{metric} {_fmt(old)} -> {_fmt(new)} ({change:+.1f}%){mark}")
+            if worse:
+                regressions.append(f"{case}.{metric}: {_fmt(old)} -> {_fmt(new)} ({change:+.1f}%)")
+        print(f"  {case}:")
+        for p in parts:
+            print(f"    {p}")
+    if regressions:
+        print(f"\n超过 {threshold}% 的退化:")
+        for r in regressions:
+            print(f"  {r}")
+    else:
+        print(f"\n没有超过 {threshold}% 的退化")
+    return regressions
+
+
+def _number(v) -> bool:
+    return isinstance(v, (int, float)) and not math.isnan(v)
+
+
+def _fmt(v) -> str:
+    if v is None:
+        return "-"
+    if isinstance(v, float):
+        if math.isnan(v):
+            return "nan"
+        return f"{v:.4g}" if abs(v) < 1000 else f"{v:.0f}"
+    return str(v)
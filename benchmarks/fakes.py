@@ -0,0 +1,255 @@
+"""
+压测用的本地替身服务：假 302ai 分层接口和假 S3（R2）
+
+两者都是普通的 FastAPI 应用，由 serve() 在后台线程中用 uvicorn 运行。
+"""
+import asyncio
+import random
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+from xml.sax.saxutils import escape
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from benchmarks.common import encode_png, free_port, synthetic_layers
+
+SUBMIT_PATH = "/302/submit/qwen-image-layered"
+
+
+class FakeLayerAPI:
+    """
+    假 302ai：提交后 processing_delay 秒返回结果，结果中的图层 URL 指向自身
+
+    图层 PNG 启动时预先生成，各任务共用同一组数据，但 URL 各不相同（不会命中服务端缓存）。
+    latency 为每次请求的附加延迟，error_rate 为随机返回 503 的比例。
+    """
+
+    def __init__(
+        self, layer_size: Tuple[int, int] = (1024, 1024), num_layers: int = 4,
+        processing_delay: float = 2.0, latency: float = 0.0, error_rate: float = 0.0,
+    ):
+        self.width, self.height = layer_size
+        self.processing_delay = processing_delay
+        self.latency = latency
+        self.error_rate = error_rate
+        self.layers: List[bytes] = [encode_png(arr) for arr in synthetic_layers(self.width, self.height, num_layers)]
+        self.tasks: Dict[str, float] = {}  # request_id -> 提交时间
+        self.stats = {"submit": 0, "poll": 0, "layer": 0, "errors": 0}
+        self.base_url = ""
+        self.app = FastAPI()
+        self.app.post(SUBMIT_PATH)(self.submit)
+        self.app.get(SUBMIT_PATH)(self.poll)
+        self.app.get("/layers/{request_id}/{index}.png")(self.layer)
+
+    async def submit(self, request: Request):
+        await self._simulate("submit")
+        await request.json()
+        request_id = uuid.uuid4().hex
+        self.tasks[request_id] = time.monotonic()
+        return {"request_id": request_id}
+
+    async def poll(self, request_id: str):
+        await self._simulate("poll")
+        submitted = self.tasks.get(request_id)
+        if submitted is None:
+            raise HTTPException(status_code=404, detail="unknown request_id")
+        if time.monotonic() - submitted < self.processing_delay:
+            return {"status": "processing"}
+        return {
+            "images": [
+                {"url": f"{self.base_url}/layers/{request_id}/{i}.png", "width": self.width, "height": self.height}
+                for i in range(len(self.layers))
+            ]
+        }
+
+    async def layer(self, request_id: str, index: int):
+        self.stats["layer"] += 1
+        if request_id not in self.tasks or not 0 <= index < len(self.layers):
+            raise HTTPException(status_code=404)
+        return Response(self.layers[index], media_type="image/png")
+
+    async def _simulate(self, call: str):
+        self.stats[call] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            self.stats["errors"] += 1
+            raise HTTPException(status_code=503, detail="fake upstream error")
+
+
+class FakeS3:
+    """
+    假 S3：实现 boto3 上传（PutObject、分块上传）、GetObject / HeadObject、ListObjectsV2、
+    DeleteObject / DeleteObjects 用到的接口，覆盖预签名直传、PSD 重定向下载和 R2 清理
+
+    对象内容直接丢弃，只记录 key、大小和写入时间；GET 返回同样大小的全零内容。
+    """
+
+    def __init__(self):
+        self.objects: Dict[str, int] = {}  # "bucket/key" -> 字节数
+        self.modified: Dict[str, float] = {}  # "bucket/key" -> 写入时间戳
+        self.uploads: Dict[str, Dict[int, int]] = {}  # uploadId -> {partNumber: 字节数}
+        self.bytes_received = 0
+        self.stats = {"put": 0, "get": 0, "list": 0, "delete": 0}
+        self.app = FastAPI()
+        self.app.add_api_route("/{bucket}", self.handle_bucket, methods=["GET", "POST"])
+        self.app.add_api_route("/{bucket}/{key:path}", self.handle, methods=["GET", "PUT", "POST", "DELETE", "HEAD"])
+
+    async def handle(self, bucket: str, key: str, request: Request):
+        if not key:
+            return await self.handle_bucket(bucket, request)
+        params = request.query_params
+        name = f"{bucket}/{key}"
+        if request.method == "DELETE":
+            self.stats["delete"] += 1
+            self._remove(name)
+            return Response(status_code=204)
+        if request.method == "HEAD":
+            size = self.objects.get(name)
+            return Response(status_code=404 if size is None else 200, headers={"Content-Length": str(size or 0)})
+        if request.method == "GET":
+            return self._get(bucket, key, request)
+
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+        self.bytes_received += size
+        etag = {"ETag": f'"{uuid.uuid4().hex}"'}
+
+        if request.method == "PUT" and "uploadId" in params:
+            self.uploads.setdefault(params["uploadId"], {})[int(params["partNumber"])] = size
+            return Response(headers=etag)
+        if request.method == "PUT":
+            self._store(name, size)
+            return Response(headers=etag)
+        if "uploads" in params:
+            upload_id = uuid.uuid4().hex
+            self.uploads[upload_id] = {}
+            return _xml(
+                f"<InitiateMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{escape(key)}</Key>"
+                f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>"
+            )
+        if "uploadId" in params:
+            parts = self.uploads.pop(params["uploadId"], {})
+            self._store(name, sum(parts.values()))
+            return _xml(
+                f"<CompleteMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{escape(key)}</Key>"
+                f"<ETag>{etag['ETag']}</ETag></CompleteMultipartUploadResult>"
+            )
+        return JSONResponse({"error": "unsupported"}, status_code=400)
+
+    async def handle_bucket(self, bucket: str, request: Request):
+        params = request.query_params
+        if request.method == "GET" and params.get("list-type") == "2":
+            return self._list(bucket, params)
+        if request.method == "POST" and "delete" in params:
+            return self._delete_many(bucket, await request.body())
+        return JSONResponse({"error": "unsupported"}, status_code=400)
+
+    def _get(self, bucket: str, key: str, request: Request) -> Response:
+        """GetObject（含预签名 GET），支持 response-content-disposition 参数"""
+        self.stats["get"] += 1
+        size = self.objects.get(f"{bucket}/{key}")
+        if size is None:
+            return _xml(f"<Error><Code>NoSuchKey</Code><Key>{escape(key)}</Key></Error>", status_code=404)
+        headers = {"Content-Length": str(size)}
+        disposition = request.query_params.get("response-content-disposition")
+        if disposition:
+            headers["Content-Disposition"] = disposition
+        return StreamingResponse(_zeros(size), headers=headers, media_type="application/octet-stream")
+
+    def _list(self, bucket: str, params) -> Response:
+        """ListObjectsV2：按 key 排序分页，continuation token 为上一页最后一个 key"""
+        self.stats["list"] += 1
+        prefix = params.get("prefix", "")
+        max_keys = int(params.get("max-keys", 1000))
+        after = params.get("continuation-token") or params.get("start-after", "")
+        head = f"{bucket}/"
+        keys = sorted(
+            name[len(head):] for name in self.objects
+            if name.startswith(head) and name[len(head):].startswith(prefix) and name[len(head):] > after
+        )
+        page, truncated = keys[:max_keys], len(keys) > max_keys
+        contents = "".join(
+            f"<Contents><Key>{escape(k)}</Key><LastModified>{_iso(self.modified[head + k])}</LastModified>"
+            f"<Size>{self.objects[head + k]}</Size><StorageClass>STANDARD</StorageClass></Contents>"
+            for k in page
+        )
+        token = f"<NextContinuationToken>{escape(page[-1])}</NextContinuationToken>" if truncated else ""
+        return _xml(
+            f"<ListBucketResult><Name>{bucket}</Name><Prefix>{escape(prefix)}</Prefix><KeyCount>{len(page)}</KeyCount>"
+            f"<MaxKeys>{max_keys}</MaxKeys><IsTruncated>{str(truncated).lower()}</IsTruncated>"
+            f"{contents}{token}</ListBucketResult>"
+        )
+
+    def _delete_many(self, bucket: str, body: bytes) -> Response:
+        """DeleteObjects：不存在的 key 也算删除成功，Quiet 模式只返回失败项（这里没有失败）"""
+        self.stats["delete"] += 1
+        root = ET.fromstring(body)
+        ns = root.tag[:root.tag.index("}") + 1] if root.tag.startswith("{") else ""
+        keys = [obj.findtext(f"{ns}Key") for obj in root.iter(f"{ns}Object")]
+        for key in keys:
+            self._remove(f"{bucket}/{key}")
+        quiet = (root.findtext(f"{ns}Quiet") or "").lower() == "true"
+        deleted = "" if quiet else "".join(f"<Deleted><Key>{escape(k)}</Key></Deleted>" for k in keys)
+        return _xml(f"<DeleteResult>{deleted}</DeleteResult>")
+
+    def _store(self, name: str, size: int):
+        self.stats["put"] += 1
+        self.objects[name] = size
+        self.modified[name] = time.time()
+
+    def _remove(self, name: str):
+        self.objects.pop(name, None)
+        self.modified.pop(name, None)
+
+
+def _xml(body: str, status_code: int = 200) -> Response:
+    return Response(
+        f'<?xml version="1.0" encoding="UTF-8"?>{body}', status_code=status_code, media_type="application/xml"
+    )
+
+
+def _iso(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+async def _zeros(size: int, chunk_size: int = 1024 * 1024):
+    block = bytes(min(size, chunk_size))
+    while size > 0:
+        yield block[:size] if size < len(block) else block
+        size -= len(block)
+
+
+class ServerThread:
+    """在后台线程中运行 uvicorn，stop() 时优雅退出"""
+
+    def __init__(self, app, port: int):
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def start(self, timeout: float = 10.0):
+        self.thread.start()
+        deadline = time.monotonic() + timeout
+        while not self.server.started:
+            if time.monotonic() > deadline or not self.thread.is_alive():
+                raise RuntimeError(f"替身服务启动失败: {self.url}")
+            time.sleep(0.05)
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+def serve(app) -> ServerThread:
+    server = ServerThread(app, free_port())
+    server.start()
+    return server
@@ -0,0 +1,279 @@
+"""
+端到端压测：上传 → 轮询 → 下载 PSD
+
+在子进程中启动后端（uvicorn backend.main:app），302ai 和 R2 替换为本地替身服务（benchmarks.fakes），
+用并发客户端跑完整流程，统计吞吐、各阶段 p50 / p99 延迟、后端峰值 RSS，并读取 /api/metrics 中的服务端各阶段耗时。
+
+用法（在仓库根目录）：
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --requests 200 --concurrency 20 --layer-size 2048 --num-layers 6
+    python -m benchmarks.load_test --env CPU_EXECUTOR=thread --env PSD_PREBUILD=true
+    python -m benchmarks.load_test --env STORAGE_PSD_REDIRECT=true --env TASK_TTL=5 --env STORAGE_GC_INTERVAL=1
+    python -m benchmarks.load_test --baseline benchmarks/results/load-xxx.json
+"""
+import argparse
+import asyncio
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List
+
+import httpx
+import numpy as np
+
+from benchmarks.common import (
+    ROOT, child_pids, compare, encode_png, free_port, print_table, proc_peak_rss_mb, run_meta, save_results,
+    summarize, synthetic_layers,
+)
+from benchmarks.fakes import FakeLayerAPI, FakeS3, serve
+
+COLUMNS = [
+    "completed", "failed", "throughput_rps", "upload_p50", "upload_p99", "wait_p50", "wait_p99",
+    "download_p50", "download_p99", "total_p50", "total_p99", "server_peak_rss_mb", "worker_peak_rss_mb",
+]
+
+BUCKET = "bench"
+
+# 后端默认配置：替身服务不限流，轮询间隔缩短到替身的处理时间量级
+DEFAULT_ENV = {
+    "API_302_KEY": "bench",
+    "AWS_ACCESS_KEY_ID": "bench",
+    "AWS_SECRET_ACCESS_KEY": "bench",
+    "AWS_S3_BUCKET": BUCKET,
+    "AWS_S3_REGION": "us-east-1",
+    "API_RATE_LIMIT": "0",
+    "POLL_INTERVAL": "1",
+    "TASK_STORE": "memory",
+}
+
+
+class Sample:
+    __slots__ = ("upload", "wait", "download", "total", "psd_bytes", "error")
+
+    def __init__(self):
+        self.upload = self.wait = self.download = self.total = 0.0
+        self.psd_bytes = 0
+        self.error = ""
+
+
+async def _run_one(client: httpx.AsyncClient, image: bytes, index: int, args) -> Sample:
+    s = Sample()
+    start = time.perf_counter()
+    try:
+        resp = await client.post(
+            "/api/upload",
+            files={"file": (f"bench_{index}.png", image, "image/png")},
+            data={"num_layers": str(args.num_layers)},
+        )
+        s.upload = time.perf_counter() - start
+        if resp.status_code != 200:
+            s.error = f"upload {resp.status_code}"
+            return s
+        task_id = resp.json()["task_id"]
+
+        t = time.perf_counter()
+        while True:
+            resp = await client.get(f"/api/task/{task_id}")
+            status = resp.json().get("status") if resp.status_code == 200 else None
+            if status == "COMPLETED":
+                break
+            if status == "FAILED" or status is None:
+                s.error = f"task {status or resp.status_code}"
+                return s
+            if time.perf_counter() - start > args.timeout:
+                s.error = "timeout"
+                return s
+            await asyncio.sleep(args.poll_interval)
+        s.wait = time.perf_counter() - t
+
+        t = time.perf_counter()
+        # STORAGE_PSD_REDIRECT=true 时跟随 302 到替身 R2 的预签名 GET URL
+        async with client.stream("GET", f"/api/download/{task_id}", follow_redirects=True) as resp:
+            if resp.status_code != 200:
+                s.error = f"download {resp.status_code}"
+                return s
+            async for chunk in resp.aiter_bytes():
+                s.psd_bytes += len(chunk)
+        s.download = time.perf_counter() - t
+    except httpx.HTTPError as e:
+        s.error = type(e).__name__
+        return s
+    s.total = time.perf_counter() - start
+    return s
+
+
+async def _run_clients(base_url: str, images: List[bytes], args) -> tuple:
+    slots = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        async def limited(i: int) -> Sample:
+            async with slots:
+                return await _run_one(client, images[i], i, args)
+
+        start = time.perf_counter()
+        samples = await asyncio.gather(*(limited(i) for i in range(len(images))))
+        elapsed = time.perf_counter() - start
+        metrics = (await client.get("/api/metrics")).text
+    return samples, elapsed, metrics
+
+
+def _make_images(count: int, size: int) -> List[bytes]:
+    """每个请求一张内容不同的图片（避免命中上传去重）"""
+    base = synthetic_layers(size, size, 1)[0][:, :, :3].copy()
+    images = []
+    for i in range(count):
+        base[0, :4] = np.frombuffer(i.to_bytes(12, "big"), dtype=np.uint8).reshape(4, 3)
+        images.append(encode_png(base))
+    return images
+
+
+def _stage_means(metrics_text: str) -> Dict[str, float]:
+    """从 /api/metrics 取各阶段平均耗时"""
+    sums, counts = {}, {}
+    for m in re.finditer(r'^layer_tool_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$', metrics_text, re.M):
+        (sums if m.group(1) == "sum" else counts)[m.group(2)] = float(m.group(3))
+    return {f"server_{stage}_mean": round(sums[stage] / n, 4) for stage, n in counts.items() if n and stage in sums}
+
+
+def _start_backend(port: int, env: Dict[str, str], log) -> subprocess.Popen:
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=ROOT, env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"后端启动失败，退出码 {proc.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/api/health", timeout=1).status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("后端启动超时")
+
+
+def _stop_backend(proc: subprocess.Popen):
+    proc.send_signal(signal.SIGINT)
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def _parse_env(items: List[str]) -> Dict[str, str]:
+    env = {}
+    for item in items:
+        key, sep, value = item.partition("=")
+        if not sep:
+            raise SystemExit(f"--env 格式应为 KEY=VALUE: {item}")
+        env[key] = value
+    return env
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="端到端压测（本地 302ai / S3 替身）")
+    parser.add_argument("--requests", type=int, default=50, help="总请求数")
+    parser.add_argument("--concurrency", type=int, default=10, help="并发客户端数")
+    parser.add_argument("--image-size", type=int, default=1024, help="上传图片边长")
+    parser.add_argument("--layer-size", type=int, default=1024, help="替身返回的图层边长")
+    parser.add_argument("--num-layers", type=int, default=4)
+    parser.add_argument("--processing-delay", type=float, default=2.0, help="替身 302ai 的处理耗时（秒）")
+    parser.add_argument("--upstream-latency", type=float, default=0.0, help="替身 302ai 每次请求的附加延迟（秒）")
+    parser.add_argument("--upstream-error-rate", type=float, default=0.0, help="替身 302ai 随机返回 503 的比例")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="客户端查询任务状态的间隔（秒）")
+    parser.add_argument("--timeout", type=float, default=300, help="单个请求的超时（秒）")
+    parser.add_argument("--env", action="append", default=[], help="传给后端的环境变量 KEY=VALUE，可重复")
+    parser.add_argument("--server-log", help="后端日志写入该文件，默认丢弃")
+    parser.add_argument("--case", help="结果中的用例名，默认由参数生成")
+    parser.add_argument("--output", help="结果文件路径，默认 benchmarks/results/load-<时间>.json")
+    parser.add_argument("--baseline", help="与该结果文件对比")
+    parser.add_argument("--threshold", type=float, default=10.0, help="退化判定阈值（百分比）")
+    args = parser.parse_args(argv)
+
+    print("生成测试图片和替身图层", file=sys.stderr)
+    images = _make_images(args.requests, args.image_size)
+    fake_api = FakeLayerAPI(
+        (args.layer_size, args.layer_size), args.num_layers,
+        args.processing_delay, args.upstream_latency, args.upstream_error_rate,
+    )
+    fake_s3 = FakeS3()
+    api_server, s3_server = serve(fake_api.app), serve(fake_s3.app)
+    fake_api.base_url = api_server.url
+
+    port = free_port()
+    with tempfile.TemporaryDirectory(prefix="layer-tool-bench-") as tmp:
+        env = {
+            **DEFAULT_ENV,
+            "API_302_BASE_URL": api_server.url,
+            "AWS_ENDPOINT": s3_server.url,
+            "AWS_PUBLIC_URL": f"{s3_server.url}/{BUCKET}",
+            "CACHE_DIR": os.path.join(tmp, "cache"),
+            "TASK_STORE_PATH": os.path.join(tmp, "tasks.db"),
+            "POLL_EXPECTED_DURATION": str(args.processing_delay),
+            **_parse_env(args.env),
+        }
+        print(f"启动后端: http://127.0.0.1:{port}", file=sys.stderr)
+        log = open(args.server_log, "wb") if args.server_log else subprocess.DEVNULL
+        proc = _start_backend(port, env, log)
+        try:
+            print(f"压测: {args.requests} 个请求，并发 {args.concurrency}", file=sys.stderr)
+            samples, elapsed, metrics_text = asyncio.run(_run_clients(f"http://127.0.0.1:{port}", images, args))
+            server_rss = proc_peak_rss_mb(proc.pid)
+            worker_rss = max((proc_peak_rss_mb(pid) for pid in child_pids(proc.pid)), default=float("nan"))
+        finally:
+            _stop_backend(proc)
+            if args.server_log:
+                log.close()
+            api_server.stop()
+            s3_server.stop()
+
+    ok = [s for s in samples if not s.error]
+    errors = Counter(s.error for s in samples if s.error)
+    case = args.case or f"{args.requests}req-c{args.concurrency}-{args.layer_size}px-{args.num_layers}L"
+    result = {
+        "completed": len(ok),
+        "failed": len(samples) - len(ok),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        **summarize("upload", [s.upload for s in ok]),
+        **summarize("wait", [s.wait for s in ok]),
+        **summarize("download", [s.download for s in ok]),
+        **summarize("total", [s.total for s in ok]),
+        "psd_mb_mean": round(sum(s.psd_bytes for s in ok) / len(ok) / (1024 * 1024), 3) if ok else 0.0,
+        "server_peak_rss_mb": round(server_rss, 1),
+        "worker_peak_rss_mb": round(worker_rss, 1),
+        "upstream_calls": dict(fake_api.stats),
+        "r2_mb_received": round(fake_s3.bytes_received / (1024 * 1024), 2),
+        "r2_calls": dict(fake_s3.stats),
+        "errors": dict(errors),
+        **_stage_means(metrics_text),
+    }
+    results = {case: result}
+
+    print()
+    print_table(results, COLUMNS)
+    stages = {k: v for k, v in result.items() if k.startswith("server_") and k.endswith("_mean")}
+    if stages:
+        print("\n服务端各阶段平均耗时（秒）: " + ", ".join(f"{k[7:-5]}={v}" for k, v in stages.items()))
+    if errors:
+        print(f"失败原因: {dict(errors)}")
+    path = save_results("load", run_meta(vars(args)), results, args.output)
+    print(f"\n结果已保存: {path}")
+
+    if args.baseline:
+        return 1 if compare(results, args.baseline, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,6 +10,8 @@ export interface LayerInfo {
   url: string
   width: number
   height: number
+  thumb_url?: string // 缩略图（后端未开启预览图时为空）
+  preview_url?: string // 中等尺寸预览图
 }
 
 export interface TaskResponse {
@@ -17,13 +19,30 @@ export interface TaskResponse {
   message?: string
   layers?: LayerInfo[]
   error?: string
+  psd_ready?: boolean
+  thumb_url?: string // 拼合图的缩略图
+  preview_url?: string // 拼合图的预览图
 }
 
+interface PresignResponse {
+  task_id: string
+  upload_url: string
+  headers: Record<string, string>
+  expires_in: number
+}
+
+// 后端是否开启了直传 R2（第一次请求预签名时确定）
+let directUpload: boolean | null = null
+
 export const uploadImage = async (
   file: File,
   numLayers: number = 4,
   prompt: string = ''
 ): Promise<{ task_id: string }> => {
+  if (directUpload !== false) {
+    const result = await uploadDirect(file, numLayers, prompt)
+    if (result) return result
+  }
   const formData = new FormData()
   formData.append('file', file)
   formData.append('num_layers', numLayers.toString())
@@ -32,23 +51,80 @@ export const uploadImage = async (
   return data
 }
 
+// 直传：申请预签名 URL，浏览器直接 PUT 到 R2，再确认提交；后端未开启直传时返回 null
+const uploadDirect = async (
+  file: File,
+  numLayers: number,
+  prompt: string
+): Promise<{ task_id: string } | null> => {
+  const presignForm = new FormData()
+  presignForm.append('filename', file.name)
+  presignForm.append('content_type', file.type)
+  presignForm.append('size', file.size.toString())
+  let presign: PresignResponse
+  try {
+    const { data } = await api.post('/upload/presign', presignForm)
+    presign = data
+  } catch (err) {
+    if (axios.isAxiosError(err) && err.response?.status === 404) {
+      directUpload = false
+      return null
+    }
+    throw err
+  }
+  directUpload = true
+
+  const put = await fetch(presign.upload_url, { method: 'PUT', headers: presign.headers, body: file })
+  if (!put.ok) {
+    throw new Error(`直传失败: ${put.status}`)
+  }
+
+  const submitForm = new FormData()
+  submitForm.append('num_layers', numLayers.toString())
+  submitForm.append('prompt', prompt)
+  const { data } = await api.post(`/task/${presign.task_id}/submit`, submitForm)
+  return data
+}
+
 export const getTaskStatus = async (taskId: string): Promise<TaskResponse> => {
   const { data } = await api.get(`/task/${taskId}`)
   return data
 }
 
-export const downloadPSD = async (taskId: string) => {
+// 订阅任务状态推送（SSE），返回关闭函数；连接出错时关闭并调用 onError，由调用方回退到轮询
+export const subscribeTaskStatus = (
+  taskId: string,
+  onStatus: (result: TaskResponse) => void,
+  onError: () => void
+): (() => void) => {
+  const baseURL = import.meta.env.DEV ? 'http://localhost:8000' : ''
+  const source = new EventSource(`${baseURL}/api/task/${taskId}/events`)
+  source.addEventListener('status', (e) => {
+    onStatus(JSON.parse((e as MessageEvent).data))
+  })
+  source.onerror = () => {
+    source.close()
+    onError()
+  }
+  return () => source.close()
+}
+
+// 由浏览器直接下载（不经过 JS 内存）；后端开启 PSD 重定向时会跳转到 R2 的预签名 URL
+export const downloadPSD = (taskId: string) => {
   const baseURL = import.meta.env.DEV ? 'http://localhost:8000' : ''
-  const response = await fetch(`${baseURL}/api/download/${taskId}`)
-  const blob = await response.blob()
-  const url = window.URL.createObjectURL(blob)
   const a = document.createElement('a')
-  a.href = url
+  a.href = `${baseURL}/api/download/${taskId}`
   a.download = `layered_${taskId}.psd`
   document.body.appendChild(a)
   a.click()
   document.body.removeChild(a)
-  window.URL.revokeObjectURL(url)
+}
+
+// 后端返回的预览图地址是相对路径（/api/...），开发环境下补上后端地址；为空时用 fallback（原图）
+export const mediaUrl = (path: string | undefined, fallback: string): string => {
+  if (!path) return fallback
+  const baseURL = import.meta.env.DEV ? 'http://localhost:8000' : ''
+  return path.startsWith('/') ? `${baseURL}${path}` : path
 }
 
 export const downloadLayerPNG = (url: string, name: string) => {
@@ -1,159 +1,221 @@
-import argparse
-import struct
-import numpy as np
-from PIL import Image
-from pathlib import Path
+"""
+离线批量合成 PSD（与后端共用 backend.services.psd_builder）
+
+用法：
+    # 单个任务：多张 PNG 合成一个 PSD（图层自底向上）
+    python test.py a.png b.png -o output.psd
 
+    # 目录：每个直接包含 PNG 的子目录是一个任务，输出到 out/<相对路径>.psd
+    python test.py --dir archive/ --out-dir out/ -j 8
 
-def write_psd(layers_data, width, height, output_path):
-    """手动写入PSD文件，避免pytoshop的packbits问题"""
-    f = open(output_path, "wb")
-
-    # === File Header ===
-    f.write(b"8BPS")           # signature
-    f.write(struct.pack(">H", 1))  # version
-    f.write(b"\x00" * 6)      # reserved
-    f.write(struct.pack(">H", 4))  # channels (RGBA)
-    f.write(struct.pack(">I", height))
-    f.write(struct.pack(">I", width))
-    f.write(struct.pack(">H", 8))  # depth 8bit
-    f.write(struct.pack(">H", 3))  # color mode: RGB
-
-    # === Color Mode Data ===
-    f.write(struct.pack(">I", 0))
-
-    # === Image Resources ===
-    f.write(struct.pack(">I", 0))
-
-    # === Layer and Mask Info ===
-    layer_mask_start = f.tell()
-    f.write(struct.pack(">I", 0))  # placeholder
-
-    # -- Layer Info --
-    layer_info_start = f.tell()
-    f.write(struct.pack(">I", 0))  # placeholder
-
-    num_layers = len(layers_data)
-    f.write(struct.pack(">h", num_layers))
-
-    # 每个图层的 channel data 先缓存
-    channel_buffers = []
-
-    for name, arr in layers_data:
-        h, w = arr.shape[:2]
-        top, left, bottom, right = 0, 0, h, w
-
-        f.write(struct.pack(">i", top))
-        f.write(struct.pack(">i", left))
-        f.write(struct.pack(">i", bottom))
-        f.write(struct.pack(">i", right))
-
-        num_ch = 4  # R G B A
-        f.write(struct.pack(">H", num_ch))
-
-        # channel info: id + data length
-        ch_map = [(-1, arr[:, :, 3]), (0, arr[:, :, 0]),
-                  (1, arr[:, :, 1]), (2, arr[:, :, 2])]
-        layer_ch_data = []
-        for ch_id, ch_arr in ch_map:
-            raw = ch_arr.tobytes()
-            data_len = 2 + len(raw)  # 2 bytes compression + raw data
-            f.write(struct.pack(">h", ch_id))
-            f.write(struct.pack(">I", data_len))
-            layer_ch_data.append(raw)
-        channel_buffers.append(layer_ch_data)
-
-        # blend mode signature
-        f.write(b"8BIM")
-        f.write(b"norm")  # blend mode
-        f.write(struct.pack(">B", 255))  # opacity
-        f.write(struct.pack(">B", 0))    # clipping
-        f.write(struct.pack(">B", 0x08)) # flags: transparency protected=no
-        f.write(struct.pack(">B", 0))    # filler
-
-        # extra data
-        extra_start = f.tell()
-        f.write(struct.pack(">I", 0))  # placeholder
-
-        # layer mask data
-        f.write(struct.pack(">I", 0))
-        # blending ranges
-        f.write(struct.pack(">I", 0))
-
-        # layer name (Pascal string, padded to 4 bytes)
-        name_bytes = name.encode("utf-8")[:255]
-        name_len = len(name_bytes)
-        f.write(struct.pack(">B", name_len))
-        f.write(name_bytes)
-        # pad to multiple of 4
-        total = 1 + name_len
-        pad = (4 - total % 4) % 4
-        f.write(b"\x00" * pad)
-
-        extra_end = f.tell()
-        extra_size = extra_end - extra_start - 4
-        f.seek(extra_start)
-        f.write(struct.pack(">I", extra_size))
-        f.seek(extra_end)
-
-    # Channel image data for each layer
-    for layer_ch_data in channel_buffers:
-        for raw in layer_ch_data:
-            f.write(struct.pack(">H", 0))  # compression = raw
-            f.write(raw)
-
-    layer_info_end = f.tell()
-    layer_info_size = layer_info_end - layer_info_start - 4
-    # pad to even
-    if layer_info_size % 2 != 0:
-        f.write(b"\x00")
-        layer_info_end += 1
-        layer_info_size += 1
-    f.seek(layer_info_start)
-    f.write(struct.pack(">I", layer_info_size))
-    f.seek(layer_info_end)
-
-    layer_mask_end = f.tell()
-    layer_mask_size = layer_mask_end - layer_mask_start - 4
-    f.seek(layer_mask_start)
-    f.write(struct.pack(">I", layer_mask_size))
-    f.seek(layer_mask_end)
-
-    # === Merged Image Data (required) ===
-    f.write(struct.pack(">H", 0))  # compression = raw
-    # 写入合并后的 RGBA 数据（用第一张图或空白）
-    merged = np.zeros((height, width, 4), dtype=np.uint8)
-    if layers_data:
-        _, first = layers_data[-1]  # 最上层
-        h, w = first.shape[:2]
-        merged[:h, :w] = first
-    for ch in range(4):
-        f.write(merged[:, :, ch].tobytes())
-
-    f.close()
-
-
-def main():
-    parser = argparse.ArgumentParser(description="多张PNG合成PSD")
-    parser.add_argument("images", nargs="+", help="PNG图片路径")
-    parser.add_argument("-o", "--output", default="output.psd", help="输出路径")
-    args = parser.parse_args()
-
-    layers_data = []
-    max_w, max_h = 0, 0
-
-    for img_path in args.images:
-        name = Path(img_path).stem
-        print(f"添加图层: {name}")
-        img = Image.open(img_path).convert("RGBA")
-        arr = np.array(img)
-        layers_data.append((name, arr))
-        max_w = max(max_w, img.width)
-        max_h = max(max_h, img.height)
-
-    write_psd(layers_data, max_w, max_h, args.output)
-    print(f"完成! {args.output} ({len(layers_data)} 个图层, {max_w}x{max_h})")
+    # 清单：JSON Lines，每行 {"output": "x.psd", "layers": ["a.png", "b.png"], "names": [...]}（names 可省略）
+    python test.py --manifest jobs.jsonl -j 8
+
+输出先写临时文件再改名，已存在且比所有输入新的 PSD 默认跳过（--force 强制重建），
+中断后重新运行即可从断点继续。--verify 在改名前读回 PSD 与输入逐图层比对，不一致时该任务失败。
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Optional
+
+from backend.services.packbits import LEVEL_BEST
+from backend.services.psd_builder import COMPRESSION_RLE, LayerSource, iter_psd
+from backend.services.psd_reader import validate_psd
+
+PNG_EXTENSIONS = {".png"}
+
+# 与后端默认的 psd_low_memory_pixels 一致：画布像素数 × 图层数达到该值时用低内存模式
+LOW_MEMORY_PIXELS = 64 * 1024 * 1024
+
+
+@dataclass
+class Job:
+    output: str
+    layers: List[str]  # 自底向上
+    names: List[str] = field(default_factory=list)  # 为空时用文件名
+
+
+@dataclass
+class JobResult:
+    output: str
+    status: str  # done / skipped / failed
+    layers: int = 0
+    width: int = 0
+    height: int = 0
+    seconds: float = 0.0
+    size: int = 0
+    error: str = ""
+
+
+def build_job(
+    job: Job, compression: str, level: int, low_memory_pixels: int, force: bool, verify: bool = False
+) -> JobResult:
+    """合成单个 PSD（在子进程中执行）：流式写入临时文件，（校验通过后）改名"""
+    if not force and _up_to_date(job):
+        return JobResult(job.output, "skipped")
+
+    start = time.perf_counter()
+    tmp_path = f"{job.output}.tmp{os.getpid()}"
+    try:
+        names = job.names or [Path(p).stem for p in job.layers]
+        layers = [LayerSource.from_file(name, path) for name, path in zip(names, job.layers)]
+        width, height = max(l.width for l in layers), max(l.height for l in layers)
+        low_memory = width * height * len(layers) >= low_memory_pixels
+
+        os.makedirs(os.path.dirname(os.path.abspath(job.output)), exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            for chunk in iter_psd(layers, width, height, compression, level, low_memory=low_memory):
+                f.write(chunk)
+        if verify:
+            problems = validate_psd(tmp_path, layers, width, height)
+            if problems:
+                raise ValueError("校验失败: " + "; ".join(problems[:3]))
+        os.replace(tmp_path, job.output)
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return JobResult(job.output, "failed", error=f"{type(e).__name__}: {e}")
+
+    return JobResult(
+        job.output, "done", len(layers), width, height,
+        time.perf_counter() - start, os.path.getsize(job.output),
+    )
+
+
+def _up_to_date(job: Job) -> bool:
+    """输出已存在且不早于所有输入"""
+    try:
+        out_mtime = os.path.getmtime(job.output)
+        return all(os.path.getmtime(p) <= out_mtime for p in job.layers)
+    except OSError:
+        return False
+
+
+def _natural_key(path: Path):
+    """Layer_2 排在 Layer_10 之前"""
+    return [int(t) if t.isdigit() else t.lower() for t in re.split(r"(\d+)", path.name)]
+
+
+def jobs_from_dir(root: str, out_dir: Optional[str]) -> List[Job]:
+    """每个直接包含 PNG 的目录是一个任务，图层按文件名自然排序（自底向上）"""
+    root_path = Path(root)
+    out_path = Path(out_dir) if out_dir else root_path
+    jobs = []
+    for dirpath, dirnames, filenames in os.walk(root_path):
+        dirnames.sort()
+        pngs = sorted(
+            (Path(dirpath) / f for f in filenames if Path(f).suffix.lower() in PNG_EXTENSIONS), key=_natural_key
+        )
+        if not pngs:
+            continue
+        rel = Path(dirpath).relative_to(root_path)
+        name = str(rel) if str(rel) != "." else root_path.resolve().name
+        jobs.append(Job(str(out_path / f"{name}.psd"), [str(p) for p in pngs]))
+    return jobs
+
+
+def jobs_from_manifest(manifest: str, out_dir: Optional[str]) -> List[Job]:
+    """JSON Lines 清单，相对路径相对于清单所在目录（output 指定 --out-dir 时相对于它）"""
+    base = Path(manifest).resolve().parent
+    out_base = Path(out_dir) if out_dir else base
+    jobs = []
+    with open(manifest, encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                entry = json.loads(line)
+                layers = [str(base / p) for p in entry["layers"]]
+                output = str(out_base / entry["output"])
+            except (ValueError, KeyError, TypeError) as e:
+                raise SystemExit(f"清单第 {lineno} 行无效: {e}")
+            names = entry.get("names") or []
+            if names and len(names) != len(layers):
+                raise SystemExit(f"清单第 {lineno} 行: names 与 layers 数量不一致")
+            jobs.append(Job(output, layers, names))
+    return jobs
+
+
+def _print_result(result: JobResult, index: int, total: int):
+    prefix = f"[{index}/{total}]"
+    if result.status == "skipped":
+        print(f"{prefix} 跳过（已是最新）: {result.output}")
+    elif result.status == "failed":
+        print(f"{prefix} 失败: {result.output}: {result.error}", file=sys.stderr)
+    else:
+        mpix = result.width * result.height * result.layers / 1e6
+        print(
+            f"{prefix} 完成: {result.output} ({result.layers} 个图层, {result.width}x{result.height}) "
+            f"{result.seconds:.2f}s, {mpix / result.seconds:.1f} MPix/s, {result.size / 1024 / 1024:.1f}MB"
+        )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="多张 PNG 合成 PSD（支持批量）")
+    parser.add_argument("images", nargs="*", help="PNG 图片路径（单个任务，自底向上）")
+    parser.add_argument("-o", "--output", default="output.psd", help="单个任务的输出路径")
+    parser.add_argument("--dir", help="批量：每个包含 PNG 的子目录是一个任务")
+    parser.add_argument("--manifest", help="批量：JSON Lines 任务清单")
+    parser.add_argument("--out-dir", help="批量输出目录，默认与输入相同")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="并行进程数")
+    parser.add_argument("--compression", default=COMPRESSION_RLE, choices=["rle", "raw"])
+    parser.add_argument("--level", type=int, default=LEVEL_BEST, choices=[1, 2], help="RLE 压缩等级，1 最快，2 体积最小")
+    parser.add_argument("--low-memory-pixels", type=int, default=LOW_MEMORY_PIXELS, help="超过该值用低内存模式")
+    parser.add_argument("--force", action="store_true", help="忽略已有输出，全部重建")
+    parser.add_argument("--verify", action="store_true", help="写完后读回 PSD 与输入逐图层比对")
+    args = parser.parse_args(argv)
+
+    if args.images:
+        jobs = [Job(args.output, args.images)]
+        force = True  # 单个任务保持原来的行为：总是重新生成
+    elif args.dir or args.manifest:
+        jobs = jobs_from_dir(args.dir, args.out_dir) if args.dir else jobs_from_manifest(args.manifest, args.out_dir)
+        force = args.force
+    else:
+        parser.error("需要 PNG 图片路径、--dir 或 --manifest")
+
+    total = len(jobs)
+    print(f"共 {total} 个任务，{min(args.jobs, total) or 1} 个进程")
+    start = time.perf_counter()
+    results: List[JobResult] = []
+    build_args = (args.compression, args.level, args.low_memory_pixels, force, args.verify)
+
+    if args.jobs <= 1 or total <= 1:
+        for job in jobs:
+            results.append(build_job(job, *build_args))
+            _print_result(results[-1], len(results), total)
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            futures = [pool.submit(build_job, job, *build_args) for job in jobs]
+            try:
+                for future in as_completed(futures):
+                    results.append(future.result())
+                    _print_result(results[-1], len(results), total)
+            except KeyboardInterrupt:
+                # 已完成的输出都是完整文件，重新运行会跳过它们
+                for future in futures:
+                    future.cancel()
+                raise
+
+    elapsed = time.perf_counter() - start
+    done = [r for r in results if r.status == "done"]
+    failed = [r for r in results if r.status == "failed"]
+    mpix = sum(r.width * r.height * r.layers for r in done) / 1e6
+    size = sum(r.size for r in done) / 1024 / 1024
+    print(
+        f"完成 {len(done)}，跳过 {total - len(done) - len(failed)}，失败 {len(failed)}；"
+        f"总耗时 {elapsed:.2f}s，{len(done) / elapsed:.2f} 个/s，{mpix / elapsed:.1f} MPix/s，输出 {size:.1f}MB"
+    )
+    return 1 if failed else 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,11 @@
+import os
+
+# Settings 的必填项：测试不访问真实的 302ai / R2，给占位值即可（需在导入 backend 之前设置）
+for _name, _value in {
+    "API_302_KEY": "test",
+    "AWS_ACCESS_KEY_ID": "test",
+    "AWS_SECRET_ACCESS_KEY": "test",
+    "AWS_ENDPOINT": "http://127.0.0.1:9",
+    "AWS_PUBLIC_URL": "http://127.0.0.1:9/bucket",
+}.items():
+    os.environ.setdefault(_name, _value)
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from backend.services.dedup import DedupIndex
+
+KEY = DedupIndex.make_key("0" * 64, 4, "")
+
+
+def test_concurrent_requests_share_one_factory_call():
+    async def main():
+        index = DedupIndex()
+        calls = []
+        release = asyncio.Event()
+
+        async def factory():
+            calls.append(1)
+            await release.wait()
+            return "task-1"
+
+        waiters = [asyncio.create_task(index.coalesce(KEY, factory)) for _ in range(5)]
+        await asyncio.sleep(0)
+        release.set()
+        return await asyncio.gather(*waiters), calls, index
+
+    results, calls, index = asyncio.run(main())
+    assert results == ["task-1"] * 5
+    assert len(calls) == 1
+    assert not index._inflight
+
+
+def test_factory_error_propagates_to_waiters():
+    async def main():
+        index = DedupIndex()
+        release = asyncio.Event()
+
+        async def factory():
+            await release.wait()
+            raise RuntimeError("上游失败")
+
+        waiters = [asyncio.create_task(index.coalesce(KEY, factory)) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        return await asyncio.gather(*waiters, return_exceptions=True), index
+
+    results, index = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert not index._inflight
+
+
+def test_cancelled_leader_hands_over_to_a_waiter():
+    async def main():
+        index = DedupIndex()
+        calls = []
+        started = asyncio.Event()
+
+        def factory_for(name):
+            async def factory():
+                calls.append(name)
+                started.set()
+                await asyncio.sleep(0.01)
+                return f"task-{name}"
+            return factory
+
+        leader = asyncio.create_task(index.coalesce(KEY, factory_for("leader")))
+        await started.wait()
+        waiters = [asyncio.create_task(index.coalesce(KEY, factory_for(f"w{i}"))) for i in range(3)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        results = await asyncio.gather(*waiters)
+        return leader, results, calls
+
+    leader, results, calls = asyncio.run(main())
+    assert leader.cancelled()
+    # 由一个等待者用自己的 factory 重新执行，其余等待者共享它的结果
+    assert calls[0] == "leader" and len(calls) == 2
+    assert results == [f"task-{calls[1]}"] * 3
+
+
+def test_cancelled_waiter_does_not_affect_leader():
+    async def main():
+        index = DedupIndex()
+        release = asyncio.Event()
+
+        async def factory():
+            await release.wait()
+            return "task-1"
+
+        leader = asyncio.create_task(index.coalesce(KEY, factory))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(index.coalesce(KEY, factory))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        release.set()
+        return await leader
+
+    assert asyncio.run(main()) == "task-1"
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from backend.services.packbits import LEVEL_BEST, LEVEL_FAST, decode_rows, encode_rows
+
+
+def _cases():
+    rng = np.random.default_rng(0)
+    noise = rng.integers(0, 256, (37, 301), dtype=np.uint8)
+    runs = np.repeat(rng.integers(0, 4, (19, 40), dtype=np.uint8), 9, axis=1)  # 游程长短不一，跨 128 字节包边界
+    mixed = noise.copy()
+    mixed[::3] = 7  # 整行相同
+    mixed[:, 100:260] = 0  # 超过 128 字节的重复段
+    return {
+        "noise": noise,
+        "runs": runs,
+        "mixed": mixed,
+        "const": np.full((5, 1000), 255, dtype=np.uint8),
+        "single_column": rng.integers(0, 2, (64, 1), dtype=np.uint8),
+        "single_pixel": np.array([[42]], dtype=np.uint8),
+        "pairs": np.tile(np.array([1, 1, 2, 3, 3, 3, 4], dtype=np.uint8), (3, 50)),
+    }
+
+
+@pytest.mark.parametrize("level", [LEVEL_FAST, LEVEL_BEST])
+@pytest.mark.parametrize("name", list(_cases()))
+def test_round_trip(name, level):
+    data = _cases()[name]
+    row_counts, encoded = encode_rows(data, level)
+    assert row_counts.dtype == np.uint16
+    assert row_counts.shape == (data.shape[0],)
+    assert int(row_counts.sum()) == len(encoded)
+    np.testing.assert_array_equal(decode_rows(encoded, *data.shape), data)
+
+
+def test_rows_decode_independently():
+    """包不跨行：每行的编码数据可以单独解码"""
+    data = _cases()["mixed"]
+    row_counts, encoded = encode_rows(data)
+    offset = 0
+    for row, count in zip(data, row_counts):
+        np.testing.assert_array_equal(decode_rows(encoded[offset:offset + count], 1, data.shape[1])[0], row)
+        offset += int(count)
+
+
+def test_best_level_not_larger_than_fast():
+    for data in _cases().values():
+        assert len(encode_rows(data, LEVEL_BEST)[1]) <= len(encode_rows(data, LEVEL_FAST)[1])
+
+
+def test_runs_are_compressed():
+    data = np.zeros((10, 1000), dtype=np.uint8)
+    _, encoded = encode_rows(data)
+    # 每行 1000 字节拆成 8 个重复包，每包 2 字节
+    assert len(encoded) == 10 * 8 * 2
+
+
+def test_empty():
+    row_counts, encoded = encode_rows(np.zeros((3, 0), dtype=np.uint8))
+    assert encoded == b""
+    assert row_counts.tolist() == [0, 0, 0]
+
+
+def test_decode_rejects_truncated_data():
+    data = _cases()["noise"]
+    _, encoded = encode_rows(data)
+    with pytest.raises(ValueError):
+        decode_rows(encoded[:-10], *data.shape)
@@ -0,0 +1,108 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from backend.services.compositor import composite
+from backend.services.psd_builder import COMPRESSION_RAW, COMPRESSION_RLE, LayerSource, iter_psd
+from backend.services.psd_reader import PSDFormatError, PSDReader, extract_layer_png, validate_psd
+
+WIDTH, HEIGHT = 96, 64
+
+
+def _layers():
+    rng = np.random.default_rng(1)
+    background = rng.integers(0, 256, (HEIGHT, WIDTH, 4), dtype=np.uint8)
+    background[:, :, 3] = 255
+    subject = np.zeros((HEIGHT, WIDTH, 4), dtype=np.uint8)
+    subject[10:40, 20:70] = rng.integers(0, 256, (30, 50, 4), dtype=np.uint8)
+    subject[10:40, 20:70, 3] |= 1  # 矩形内 alpha 非零
+    offset = rng.integers(0, 256, (30, 40, 4), dtype=np.uint8)
+    return [
+        LayerSource.from_array("背景", background),
+        LayerSource.from_array("主体", subject),
+        LayerSource.from_array("空白", np.zeros((HEIGHT, WIDTH, 4), dtype=np.uint8)),
+        LayerSource.from_array("超出画布", offset, top=-10, left=70),
+    ]
+
+
+def _write(path, layers, compression, low_memory=False):
+    with open(path, "wb") as f:
+        for chunk in iter_psd(layers, WIDTH, HEIGHT, compression, chunk_size=1000, low_memory=low_memory):
+            f.write(chunk)
+    return str(path)
+
+
+@pytest.mark.parametrize("low_memory", [False, True])
+@pytest.mark.parametrize("compression", [COMPRESSION_RLE, COMPRESSION_RAW])
+def test_round_trip(tmp_path, compression, low_memory):
+    layers = _layers()
+    path = _write(tmp_path / "out.psd", layers, compression, low_memory)
+
+    assert validate_psd(path, layers, WIDTH, HEIGHT) == []
+    with PSDReader(path) as reader:
+        assert (reader.width, reader.height) == (WIDTH, HEIGHT)
+        assert [layer.name for layer in reader.layers] == [layer.name for layer in layers]
+        # 只写出 alpha 非零的矩形，全透明图层为零尺寸
+        subject = reader.layers[1]
+        assert (subject.top, subject.left, subject.bottom, subject.right) == (10, 20, 40, 70)
+        assert reader.layers[2].height == reader.layers[2].width == 0
+        for i, layer in enumerate(layers):
+            expected = np.zeros((HEIGHT, WIDTH, 4), dtype=np.uint8)
+            arr = layer.load()
+            t, l = max(layer.top, 0), max(layer.left, 0)
+            b, r = min(layer.top + arr.shape[0], HEIGHT), min(layer.left + arr.shape[1], WIDTH)
+            expected[t:b, l:r] = arr[t - layer.top:b - layer.top, l - layer.left:r - layer.left]
+            expected[expected[:, :, 3] == 0] = 0
+            actual = reader.read_layer_canvas(i)
+            actual[actual[:, :, 3] == 0] = 0
+            np.testing.assert_array_equal(actual, expected)
+        np.testing.assert_array_equal(reader.read_merged()[:, :, :4], composite(layers, WIDTH, HEIGHT))
+
+
+def test_low_memory_output_is_identical(tmp_path):
+    layers = _layers()
+    normal = _write(tmp_path / "normal.psd", layers, COMPRESSION_RLE)
+    low = _write(tmp_path / "low.psd", layers, COMPRESSION_RLE, low_memory=True)
+    with open(normal, "rb") as a, open(low, "rb") as b:
+        assert a.read() == b.read()
+
+
+def test_extract_layer_png(tmp_path):
+    layers = _layers()
+    path = _write(tmp_path / "out.psd", layers, COMPRESSION_RLE)
+
+    full = Image.open(io.BytesIO(extract_layer_png(path, 1)))
+    assert full.size == (WIDTH, HEIGHT) and full.mode == "RGBA"
+    np.testing.assert_array_equal(np.asarray(full), layers[1].load())
+
+    cropped = Image.open(io.BytesIO(extract_layer_png(path, 1, crop=True)))
+    assert cropped.size == (50, 30)
+
+    with pytest.raises(IndexError):
+        extract_layer_png(path, len(layers))
+
+
+def test_validate_detects_mismatch(tmp_path):
+    layers = _layers()
+    path = _write(tmp_path / "out.psd", layers, COMPRESSION_RLE)
+
+    assert validate_psd(path, layers[::-1], WIDTH, HEIGHT)
+    assert validate_psd(path, layers, WIDTH + 1, HEIGHT)
+
+    data = bytearray(open(path, "rb").read())
+    data[len(data) // 2] ^= 0xFF
+    corrupt = tmp_path / "corrupt.psd"
+    corrupt.write_bytes(bytes(data))
+    assert validate_psd(str(corrupt), layers, WIDTH, HEIGHT)
+
+
+def test_reader_rejects_non_psd(tmp_path):
+    path = tmp_path / "empty.psd"
+    path.write_bytes(b"")
+    with pytest.raises(PSDFormatError):
+        PSDReader(str(path))
+    path.write_bytes(b"not a psd" * 10)
+    with pytest.raises(PSDFormatError):
+        PSDReader(str(path))
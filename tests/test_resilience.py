@@ -0,0 +1,90 @@
+import pytest
+
+from backend.services import resilience
+from backend.services.resilience import STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, CircuitBreaker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(resilience.time, "monotonic", clock)
+    return clock
+
+
+def _opened(clock) -> CircuitBreaker:
+    breaker = CircuitBreaker("test", failure_threshold=3, recovery_timeout=30)
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record_failure()
+    return breaker
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, recovery_timeout=30)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == STATE_CLOSED and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == STATE_OPEN
+    assert not breaker.allow()
+    assert breaker.retry_after() == pytest.approx(30)
+
+
+def test_success_resets_failure_count(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, recovery_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == STATE_CLOSED
+
+
+def test_half_open_allows_a_single_trial(clock):
+    breaker = _opened(clock)
+    clock.now += 29
+    assert breaker.state == STATE_OPEN
+    assert breaker.retry_after() == pytest.approx(1)
+    clock.now += 1
+    assert breaker.state == STATE_HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()
+    assert breaker.retry_after() > 0
+
+
+def test_trial_success_closes(clock):
+    breaker = _opened(clock)
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == STATE_CLOSED
+    assert breaker.allow() and breaker.allow()
+    assert breaker.retry_after() == 0
+
+
+def test_trial_failure_reopens(clock):
+    breaker = _opened(clock)
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == STATE_OPEN
+    assert not breaker.allow()
+    clock.now += 30
+    assert breaker.state == STATE_HALF_OPEN
+
+
+def test_release_returns_the_trial_slot(clock):
+    breaker = _opened(clock)
+    clock.now += 30
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == STATE_HALF_OPEN
+    assert breaker.allow()
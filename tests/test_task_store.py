@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+from backend.config import settings
+from backend.models import TaskStatus
+from backend.services.task_store import WORKER_ID, SQLiteTaskStore, TaskRecord
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteTaskStore(str(tmp_path / "tasks.db"), ttl=3600, max_entries=100)
+    yield store
+    store.close()
+
+
+def _put_owned(store, task_id, owner, status=TaskStatus.PROCESSING):
+    """模拟其他 worker 创建的任务"""
+    store.put(TaskRecord(task_id=task_id, status=status, request_id=f"req-{task_id}"))
+    store._conn.execute("UPDATE tasks SET owner = ? WHERE task_id = ?", (owner, task_id))
+
+
+def _beat(store, worker_id, age):
+    store._conn.execute(
+        "INSERT OR REPLACE INTO workers (worker_id, heartbeat) VALUES (?, ?)", (worker_id, time.time() - age)
+    )
+
+
+def _owner(store, task_id):
+    return store._conn.execute("SELECT owner FROM tasks WHERE task_id = ?", (task_id,)).fetchone()[0]
+
+
+def test_claims_tasks_of_stale_workers(store):
+    stale_age = settings.task_sweep_interval * 3 + 5
+    _beat(store, "alive", 0)
+    _beat(store, "dead", stale_age)
+    _put_owned(store, "t-alive", "alive")
+    _put_owned(store, "t-dead", "dead")
+    _put_owned(store, "t-gone", "never-seen")  # 没有心跳记录（已被清理）的 worker
+    _put_owned(store, "t-done", "dead", status=TaskStatus.COMPLETED)
+    store.put(TaskRecord(task_id="t-mine", status=TaskStatus.PROCESSING))
+
+    claimed = store.claim_orphans()
+
+    assert sorted(r.task_id for r in claimed) == ["t-dead", "t-gone"]
+    assert {r.request_id for r in claimed} == {"req-t-dead", "req-t-gone"}
+    assert _owner(store, "t-dead") == _owner(store, "t-gone") == WORKER_ID
+    assert _owner(store, "t-alive") == "alive"
+    assert _owner(store, "t-done") == "dead"
+    # 失联 worker 的心跳记录被清理，已认领的任务不会再次认领
+    workers = {r[0] for r in store._conn.execute("SELECT worker_id FROM workers")}
+    assert "dead" not in workers and "alive" in workers
+    assert store.claim_orphans() == []
+
+
+def test_processing_update_takes_ownership(store):
+    _put_owned(store, "t-1", "creator", status=TaskStatus.PENDING)
+    store.update("t-1", request_id="req-1")
+    assert _owner(store, "t-1") == "creator"
+    store.update("t-1", status=TaskStatus.PROCESSING, request_id="req-1")
+    assert _owner(store, "t-1") == WORKER_ID
+    assert store.get("t-1").request_id == "req-1"